@@ -2,6 +2,7 @@ from django.contrib import admin
 from django.contrib.auth import get_user_model
 from django.contrib.auth.admin import UserAdmin
 
+from utils.pagination import CachedCountPaginator
 from .models import Relation
 from .forms import CustomUserCreationForm, CustomUserChangeForm
 
@@ -15,6 +16,9 @@ class CustomUserAdmin(UserAdmin):
     form = CustomUserChangeForm
     list_display = ['username', 'email', 'first_name', 'last_name', 'phone_number', 'is_staff']
     list_filter = ['is_staff', 'is_superuser', 'is_active', 'groups']
+    search_fields = ['^username', '^email', '^first_name', '^last_name']
+    paginator = CachedCountPaginator
+    show_full_result_count = False
     add_fieldsets = UserAdmin.fieldsets + (
         (
             'Personal Info', {
@@ -34,5 +38,9 @@ class CustomUserAdmin(UserAdmin):
 @admin.register(Relation)
 class RelationAdmin(admin.ModelAdmin):
     list_display = ['id', 'from_user', 'to_user', 'created_at']
-    list_filter = ['from_user', 'to_user', 'created_at']
-    search_fields = ['from_user', 'to_user']
+    list_filter = ['created_at']
+    list_select_related = ['from_user', 'to_user']
+    search_fields = ['^from_user__username', '^to_user__username']
+    autocomplete_fields = ['from_user', 'to_user']
+    paginator = CachedCountPaginator
+    show_full_result_count = False
@@ -0,0 +1,159 @@
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connections
+from django.db.models import Q
+
+from utils.bloom import BloomFilter
+
+
+User = get_user_model()
+
+AVAILABILITY_FIELDS = ['username', 'email', 'phone_number']
+# What the anonymous check-availability/ endpoint answers for; emails and
+# phone numbers would tell anyone who has an account
+PUBLIC_AVAILABILITY_FIELDS = ['username']
+UNIQUE_ERRORS = {
+    'username': 'This username already exists.',
+    'email': 'This email address already exists.',
+    'phone_number': 'This phone number already exists.',
+}
+
+
+def normalize(field, value):
+    return f'{field}:{str(value).lower()}'
+
+
+class AvailabilityIndex:
+    # A Bloom filter over every taken username, email and phone number, built
+    # by the worker warm-up (utils.startup) and kept up to date with this
+    # process' saves. A miss is only a hint: users saved by other processes
+    # since the build are missing, so the database confirms it (the unique
+    # constraints at save, or a lookup). Deleted users cannot be removed from
+    # the filter, they only make it more conservative until the next rebuild.
+
+    def __init__(self):
+        self.bloom = None
+        self.built_at = 0
+        self.stale_count = 0
+        # Saves while a build scans the table, replayed into the new filter
+        self.added = None
+        self.lock = threading.Lock()
+        self.build_lock = threading.Lock()
+
+    def build(self, blocking=True):
+        # One build at a time; returns the number of users scanned, or None
+        # when another one is already running
+        if not self.build_lock.acquire(blocking=blocking):
+            return None
+
+        try:
+            with self.lock:
+                self.added = []
+
+            capacity = getattr(settings, 'AVAILABILITY_BLOOM_CAPACITY', 1_000_000)
+            bloom = BloomFilter(
+                max(capacity, User.objects.count() * 2) * len(AVAILABILITY_FIELDS),
+                getattr(settings, 'AVAILABILITY_BLOOM_ERROR_RATE', 0.01),
+            )
+
+            count = 0
+            for row in User.objects.order_by().values_list(*AVAILABILITY_FIELDS).iterator(chunk_size=5000):
+                for field, value in zip(AVAILABILITY_FIELDS, row):
+                    bloom.add(normalize(field, value))
+                count += 1
+
+            with self.lock:
+                for value in self.added:
+                    bloom.add(value)
+                self.bloom = bloom
+                self.built_at = time.monotonic()
+                self.stale_count = 0
+            return count
+        finally:
+            with self.lock:
+                self.added = None
+            self.build_lock.release()
+
+    def build_in_background(self):
+        if self.build_lock.locked():
+            return False
+
+        def run():
+            try:
+                self.build(blocking=False)
+            finally:
+                connections.close_all()
+
+        threading.Thread(target=run, name='availability-build', daemon=True).start()
+        return True
+
+    def needs_rebuild(self):
+        if self.bloom is None:
+            return True
+
+        interval = getattr(settings, 'AVAILABILITY_BLOOM_REBUILD_INTERVAL', 3600)
+        max_stale = getattr(settings, 'AVAILABILITY_BLOOM_MAX_STALE', 10_000)
+        return time.monotonic() - self.built_at > interval or self.stale_count > max_stale
+
+    def get_bloom(self):
+        # None until the first build finished; requests never wait for a scan
+        if self.needs_rebuild():
+            self.build_in_background()
+        return self.bloom
+
+    def add_user(self, user):
+        values = [normalize(field, getattr(user, field)) for field in AVAILABILITY_FIELDS]
+
+        with self.lock:
+            if self.added is not None:
+                self.added.extend(values)
+            if self.bloom is not None:
+                for value in values:
+                    self.bloom.add(value)
+
+    def mark_stale(self):
+        with self.lock:
+            self.stale_count += 1
+
+    def might_exist(self, field, value):
+        bloom = self.get_bloom()
+        return bloom is None or normalize(field, value) in bloom
+
+
+availability_index = AvailabilityIndex()
+
+
+def get_taken_fields(exclude_pk=None, fast_path=True, **values):
+    values = {field: value for field, value in values.items() if value}
+    candidates = {
+        field: value for field, value in values.items()
+        if not fast_path or availability_index.might_exist(field, value)
+    }
+
+    if not candidates:
+        return set()
+
+    query = Q()
+    for field, value in candidates.items():
+        query |= Q(**{field: value})
+
+    queryset = User.objects.filter(query)
+    if exclude_pk is not None:
+        queryset = queryset.exclude(pk=exclude_pk)
+
+    taken = set()
+    for row in queryset.order_by().values_list(*candidates)[:len(candidates)]:
+        for field, value in zip(candidates, row):
+            if str(value) == str(candidates[field]):
+                taken.add(field)
+    return taken
+
+
+def check_availability(exclude_pk=None, **values):
+    # An answer given out can't wait for the unique constraints, so a filter
+    # miss is confirmed too: one unique index lookup per field
+    taken = get_taken_fields(exclude_pk, False, **values)
+    return {field: field not in taken for field, value in values.items() if value}
@@ -0,0 +1,75 @@
+from django.core.files.storage import default_storage
+from django.db.models.query import ValuesListIterable
+from django.templatetags.static import static
+
+from utils.activity import is_recently_seen
+from .models import UserUrls
+from .search import SearchResults
+from .sharding import EdgeUserList
+
+
+DEFAULT_PROFILE_IMAGE = 'accounts/images/default_profile_image.jpeg'
+
+
+class UserCard:
+    # The columns a user card in the people/follower/following lists renders,
+    # without a full CustomUser instance (password hash, flags, dates, ...).
+    fields = ['pk', 'username', 'first_name', 'last_name', 'image', 'last_seen']
+
+    __slots__ = fields
+
+    def __init__(self, pk, username, first_name, last_name, image, last_seen):
+        self.pk = pk
+        self.username = username
+        self.first_name = first_name
+        self.last_name = last_name
+        self.image = image
+        self.last_seen = last_seen
+
+    def __str__(self):
+        return self.username
+
+    def __eq__(self, other):
+        return getattr(other, 'pk', None) == self.pk and self.pk is not None
+
+    def __hash__(self):
+        return hash(self.pk)
+
+    @property
+    def id(self):
+        return self.pk
+
+    @property
+    def urls(self):
+        return UserUrls(self)
+
+    @property
+    def is_online(self):
+        return is_recently_seen(self.last_seen)
+
+    @property
+    def image_url(self):
+        if self.image:
+            return default_storage.url(self.image)
+        return static(DEFAULT_PROFILE_IMAGE)
+
+    def get_full_name(self):
+        return f'{self.first_name} {self.last_name}'.strip()
+
+    def get_absolute_url(self):
+        return self.urls.detail
+
+
+class UserCardIterable(ValuesListIterable):
+    def __iter__(self):
+        for row in super().__iter__():
+            yield UserCard(*row)
+
+
+def get_user_cards(queryset):
+    if isinstance(queryset, (EdgeUserList, SearchResults)):
+        return queryset.map_users(get_user_cards)
+
+    cards = queryset.values_list(*UserCard.fields)
+    cards._iterable_class = UserCardIterable
+    return cards
@@ -0,0 +1,73 @@
+import hashlib
+
+from django.contrib import messages
+from django.contrib.auth import get_user_model
+from django.views.decorators.http import condition
+
+
+User = get_user_model()
+
+
+def get_user_versions(request, username):
+    # etag_func and last_modified_func both need the row, so look it up once
+    cache = request.__dict__.setdefault('_user_versions', {})
+
+    if username not in cache:
+        cache[username] = User.objects.filter(username=username).values_list(
+            'pk', 'updated_at', 'relations_updated_at', 'last_seen',
+        ).first()
+    return cache[username]
+
+
+def can_revalidate(request):
+    # Pending flash messages must be rendered (and consumed) by a full response
+    return request.user.is_authenticated and not len(messages.get_messages(request))
+
+
+def user_page_etag(request, username, **kwargs):
+    versions = get_user_versions(request, username)
+
+    if versions is None or not can_revalidate(request):
+        return None
+
+    pk, updated_at, relations_updated_at, last_seen = versions
+    viewer = request.user
+    # The viewer's own relations too: they decide the mutual connections shown
+    key = (
+        f'{request.get_full_path()}:{pk}:{updated_at.timestamp()}:{relations_updated_at.timestamp()}:{last_seen}:'
+        f'{viewer.pk}:{viewer.updated_at.timestamp()}:{viewer.relations_updated_at.timestamp()}'
+    )
+    return hashlib.md5(key.encode(), usedforsecurity=False).hexdigest()
+
+
+def user_page_last_modified(request, username, **kwargs):
+    versions = get_user_versions(request, username)
+
+    if versions is None or not can_revalidate(request):
+        return None
+    # last_seen is null for users never seen since it was added
+    return max(filter(None, [*versions[1:], request.user.updated_at, request.user.relations_updated_at]))
+
+
+def get_page_last_seen(page_obj):
+    # Every card renders its user's presence
+    return max(filter(None, (card.last_seen for card in page_obj)), default=None)
+
+
+def user_list_condition(get_page):
+    # A follower/following list also changes with the last_seen of the users on
+    # the page; get_page(request, username) must cache the page for the view
+    def etag_func(request, username, **kwargs):
+        etag = user_page_etag(request, username)
+        if etag is None:
+            return None
+        key = f'{etag}:{get_page_last_seen(get_page(request, username))}'
+        return hashlib.md5(key.encode(), usedforsecurity=False).hexdigest()
+
+    def last_modified_func(request, username, **kwargs):
+        last_modified = user_page_last_modified(request, username)
+        if last_modified is None:
+            return None
+        return max(filter(None, [last_modified, get_page_last_seen(get_page(request, username))]))
+
+    return condition(etag_func=etag_func, last_modified_func=last_modified_func)
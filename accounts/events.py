@@ -0,0 +1,82 @@
+import asyncio
+import itertools
+import json
+
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+
+from utils.pubsub import get_broker
+from .models import Relation
+
+
+event_ids = itertools.count(1)
+
+
+def get_user_channel(user_id):
+    return f'accounts.user.{user_id}'
+
+
+def get_counts(user_id):
+    return {
+        'followers_count': Relation.objects.followers_of(user_id).count(),
+        'following_count': Relation.objects.following_of(user_id).count(),
+    }
+
+
+def get_username(relation, field):
+    # The other side may be gone already when the user deletion cascaded
+    try:
+        return getattr(relation, field).username
+    except ObjectDoesNotExist:
+        return None
+
+
+def publish_relation_event(kind, relation):
+    broker = get_broker()
+    sides = [
+        ('follower', relation.to_user_id, 'from_user'),
+        ('following', relation.from_user_id, 'to_user'),
+    ]
+
+    for direction, user_id, other_field in sides:
+        channel = get_user_channel(user_id)
+        if not broker.has_subscribers(channel):
+            continue
+
+        broker.publish(channel, {
+            'id': next(event_ids),
+            'type': kind,
+            'direction': direction,
+            'username': get_username(relation, other_field),
+            **get_counts(user_id),
+        })
+
+
+def format_event(event):
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+def format_snapshot(counts, retry):
+    # The reconnection delay, then the current counts
+    return f'retry: {int(retry * 1000)}\n' + format_event({'id': 0, 'type': 'counts', **counts})
+
+
+async def stream_user_events(user_id, counts):
+    heartbeat = getattr(settings, 'EVENTS_HEARTBEAT_SECONDS', 15)
+    subscription = get_broker().subscribe(
+        get_user_channel(user_id),
+        getattr(settings, 'EVENTS_QUEUE_SIZE', 100),
+    )
+
+    try:
+        yield format_snapshot(counts, heartbeat)
+
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.get(), heartbeat)
+            except asyncio.TimeoutError:
+                yield ': heartbeat\n\n'
+                continue
+            yield format_event(event)
+    finally:
+        subscription.close()
@@ -0,0 +1,86 @@
+import csv
+import json
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.utils.text import compress_sequence
+
+from .models import Relation
+
+
+User = get_user_model()
+
+EXPORT_DIRECTIONS = {
+    'followers': ('followers_of', 'from_user_id'),
+    'following': ('following_of', 'to_user_id'),
+}
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+EXPORT_COLUMNS = ['cursor', 'username', 'first_name', 'last_name', 'followed_at']
+
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+def get_export_chunk_size():
+    return getattr(settings, 'ACCOUNTS_EXPORT_CHUNK_SIZE', 2000)
+
+
+def iter_relation_rows(user, direction, cursor=0, chunk_size=None):
+    edges_of, other_field = EXPORT_DIRECTIONS[direction]
+    edges = getattr(Relation.objects, edges_of)(user.pk)
+    chunk_size = chunk_size or get_export_chunk_size()
+
+    # Keyset order on the relation pk: resuming from a cursor is an index
+    # range scan and only one chunk is held in memory. Edges and users may
+    # live on different databases, so each chunk's users are a second query.
+    while True:
+        chunk = list(edges.filter(pk__gt=cursor or 0).order_by('pk').values_list('pk', other_field, 'created_at')[:chunk_size])
+        if not chunk:
+            return
+
+        users = {
+            pk: row
+            for pk, *row in User.objects.filter(
+                pk__in=[other_id for pk, other_id, created_at in chunk],
+                is_active=True,
+            ).order_by().values_list('pk', 'username', 'first_name', 'last_name')
+        }
+        for pk, other_id, created_at in chunk:
+            if other_id in users:
+                yield (pk, *users[other_id], created_at)
+        cursor = chunk[-1][0]
+
+
+def iter_ndjson(rows):
+    for row in rows:
+        data = dict(zip(EXPORT_COLUMNS, row))
+        data['followed_at'] = data['followed_at'].isoformat()
+        yield json.dumps(data) + '\n'
+
+
+def iter_csv(rows, header=True):
+    writer = csv.writer(Echo())
+
+    if header:
+        yield writer.writerow(EXPORT_COLUMNS)
+    for pk, username, first_name, last_name, created_at in rows:
+        yield writer.writerow([pk, username, first_name, last_name, created_at.isoformat()])
+
+
+def iter_export(user, direction, export_format='ndjson', cursor=0, chunk_size=None, gzip=False):
+    rows = iter_relation_rows(user, direction, cursor, chunk_size)
+
+    if export_format == 'csv':
+        lines = iter_csv(rows, header=not cursor)
+    else:
+        lines = iter_ndjson(rows)
+
+    chunks = (line.encode() for line in lines)
+    if gzip:
+        return compress_sequence(chunks)
+    return chunks
@@ -1,14 +1,15 @@
-import os
-
 from django import forms
 from django.shortcuts import get_object_or_404
 from django.contrib.auth import get_user_model, authenticate
 from django.contrib.auth.forms import AdminUserCreationForm, UserChangeForm
 from django.core.exceptions import ValidationError
 from django.core.validators import FileExtensionValidator
+from django.db import IntegrityError, transaction
 from phonenumber_field.formfields import PhoneNumberField
 
 from utils.validators import UsernameValidator, NameValidator
+from .availability import AVAILABILITY_FIELDS, UNIQUE_ERRORS, get_taken_fields
+from .jobs import enqueue
 
 
 User = get_user_model()
@@ -64,6 +65,27 @@ class UserBaseForm(forms.Form):
         }),
     )
 
+    def get_exclude_pk(self):
+        return None
+
+    def add_unique_errors(self, fast_path=True):
+        cd = self.cleaned_data
+        taken = get_taken_fields(
+            self.get_exclude_pk(),
+            fast_path,
+            **{field: cd.get(field) for field in AVAILABILITY_FIELDS},
+        )
+
+        for field in AVAILABILITY_FIELDS:
+            if field in taken:
+                self.add_error(field, UNIQUE_ERRORS[field])
+        return taken
+
+    def clean(self):
+        cd = super().clean()
+        self.add_unique_errors()
+        return cd
+
 
 class UserCreateForm(UserBaseForm):
     password = forms.CharField(
@@ -83,27 +105,6 @@ class UserCreateForm(UserBaseForm):
         }),
     )
 
-    def clean_username(self):
-        username = self.cleaned_data.get('username')
-
-        if username and User.objects.filter(username=username).exists():
-            raise ValidationError('This username already exists.')
-        return username
-    
-    def clean_email(self):
-        email = self.cleaned_data.get('email')
-
-        if email and User.objects.filter(email=email).exists():
-            raise ValidationError('This email address already exists.')
-        return email
-    
-    def clean_phone_number(self):
-        phone_number = self.cleaned_data.get('phone_number')
-
-        if phone_number and User.objects.filter(phone_number=phone_number).exists():
-            raise ValidationError('This phone number already exists.')
-        return phone_number
-
     def clean(self):
         cd = super().clean()
         password = cd.get('password')
@@ -116,7 +117,16 @@ class UserCreateForm(UserBaseForm):
     def save(self):
         cd = self.cleaned_data
         cd.pop('confirm_password')
-        return User.objects.create_user(**cd)
+
+        # The availability check can race with another signup, the unique
+        # constraints have the final word.
+        try:
+            with transaction.atomic():
+                return User.objects.create_user(**cd)
+        except IntegrityError:
+            if not self.add_unique_errors(fast_path=False):
+                raise
+            return None
 
 
 class UserLoginForm(forms.Form):
@@ -135,6 +145,11 @@ class UserLoginForm(forms.Form):
         }),
     )
 
+    def clean_username(self):
+        # Usernames are stored lower case, so this is a case-insensitive
+        # lookup on the unique index
+        return self.cleaned_data['username'].lower()
+
     def clean(self):
         cd = super().clean()
         username = cd.get('username')
@@ -162,27 +177,9 @@ class UserUpdateForm(UserBaseForm):
         self.user = kwargs.pop('user', None)
         super().__init__(*args, **kwargs)
 
-    def clean_username(self):
-        username = self.cleaned_data.get('username')
+    def get_exclude_pk(self):
+        return self.user.pk
 
-        if username and User.objects.filter(username=username).exclude(pk=self.user.pk).exists():
-            raise ValidationError('This username already exists.')
-        return username
-    
-    def clean_email(self):
-        email = self.cleaned_data.get('email')
-
-        if email and User.objects.filter(email=email).exclude(pk=self.user.pk).exists():
-            raise ValidationError('This email address already exists.')
-        return email
-    
-    def clean_phone_number(self):
-        phone_number = self.cleaned_data.get('phone_number')
-
-        if phone_number and User.objects.filter(phone_number=phone_number).exclude(pk=self.user.pk).exists():
-            raise ValidationError('This phone number already exists.')
-        return phone_number
-    
     def save(self):
         cd = self.cleaned_data
 
@@ -193,12 +190,16 @@ class UserUpdateForm(UserBaseForm):
         self.user.phone_number = cd['phone_number']
         
         if not cd['image'] is None:
-            if self.user.image and self.user.image.path:
-                os.remove(self.user.image.path)
-                self.user.image.delete()
             self.user.image = cd['image']
         
-        self.user.save()
+        try:
+            with transaction.atomic():
+                self.user.save()
+        except IntegrityError:
+            self.user.refresh_from_db()
+            if not self.add_unique_errors(fast_path=False):
+                raise
+            return None
         return self.user
 
 
@@ -225,10 +226,13 @@ class UserDeleteForm(forms.Form):
         return cd
     
     def save(self):
-        if self.user.image and self.user.image.path:
-            os.remove(self.user.image.path)
-            self.user.image.delete()
-        self.user.delete()
+        # Deactivated right away (no login, no session, gone from the lists
+        # through the save's receivers), deleted with its relations by the
+        # delete_users job
+        with transaction.atomic():
+            self.user.is_active = False
+            self.user.save(update_fields=['is_active'])
+            enqueue('delete_users', {'user_id': self.user.pk})
 
 
 class UserPasswordResetForm(forms.Form):
@@ -241,7 +245,7 @@ class UserPasswordResetForm(forms.Form):
     )
 
     def clean_username(self):
-        username = self.cleaned_data.get('username')
+        username = self.cleaned_data.get('username', '').lower()
 
         if username and not User.objects.filter(username=username).exists():
             raise ValidationError('Wrong username')
@@ -310,5 +314,6 @@ class UserPasswordChangeForm(forms.Form):
         
         user = get_object_or_404(User, username=self.username)
         user.set_password(cd['password'])
-        user.save()
+        with transaction.atomic():
+            user.save()
         return  user
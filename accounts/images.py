@@ -0,0 +1,161 @@
+import datetime
+import os
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files import File
+from django.db import connection, transaction
+from django.db.models import F, Min
+from django.utils import timezone
+
+from utils.storage import is_content_addressed
+from .models import StoredFile
+from .invalidation import emit, get_user_tags
+from .jobs import enqueue
+
+
+User = get_user_model()
+
+IMAGE_DIRECTORY = 'accounts/images'
+
+
+def get_image_storage():
+    return User._meta.get_field('image').storage
+
+
+# ----- REFERENCE COUNTS -----
+
+def retain(name):
+    if not name:
+        return
+
+    # One statement: a sweep can't delete the row between creating it and
+    # counting the reference (ON CONFLICT: SQLite 3.24+, PostgreSQL)
+    table = connection.ops.quote_name(StoredFile._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} (name, refcount, released_at) VALUES (%s, 1, NULL) '
+            f'ON CONFLICT (name) DO UPDATE SET refcount = {table}.refcount + 1, released_at = NULL',
+            [name],
+        )
+
+
+def release(name):
+    if not name:
+        return
+
+    StoredFile.objects.filter(name=name).update(refcount=F('refcount') - 1)
+    StoredFile.objects.filter(name=name, refcount__lte=0, released_at=None).update(released_at=timezone.now())
+    schedule_image_gc(getattr(settings, 'IMAGE_GC_GRACE_SECONDS', 3600))
+
+
+# ----- GARBAGE COLLECTION -----
+
+def iter_orphan_names(storage, grace_seconds):
+    # Files no StoredFile row knows about: uploads whose model save failed
+    root = storage.path(IMAGE_DIRECTORY)
+    cutoff = time.time() - grace_seconds
+
+    for directory, dirnames, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            name = os.path.relpath(path, storage.location).replace(os.sep, '/')
+            if is_content_addressed(name) and os.path.getmtime(path) < cutoff:
+                yield name
+
+
+def collect_image_garbage(grace_seconds=None, batch_size=500, dry_run=False):
+    # Deletes files that stayed unreferenced for longer than the grace period
+    # (rows at refcount 0, then files without any row), a batch at a time.
+    grace_seconds = getattr(settings, 'IMAGE_GC_GRACE_SECONDS', 3600) if grace_seconds is None else grace_seconds
+    storage = get_image_storage()
+    cutoff = timezone.now() - datetime.timedelta(seconds=grace_seconds)
+    mtime_cutoff = time.time() - grace_seconds
+    stats = {'deleted': 0, 'orphans': 0, 'bytes': 0}
+
+    last_pk = 0
+    while True:
+        rows = list(StoredFile.objects.filter(
+            pk__gt=last_pk, refcount__lte=0, released_at__lt=cutoff,
+        ).order_by('pk').values_list('pk', 'name')[:batch_size])
+        if not rows:
+            break
+        last_pk = rows[-1][0]
+
+        for pk, name in rows:
+            # A fresh duplicate upload touches the file, leave it to the next sweep
+            if storage.exists(name) and os.path.getmtime(storage.path(name)) >= mtime_cutoff:
+                continue
+            if dry_run:
+                stats['deleted'] += 1
+                continue
+
+            with transaction.atomic():
+                if not StoredFile.objects.filter(pk=pk, refcount__lte=0).delete()[0]:
+                    continue
+                if storage.exists(name):
+                    stats['bytes'] += storage.size(name)
+                    storage.delete(name)
+            stats['deleted'] += 1
+
+    orphans = list(iter_orphan_names(storage, grace_seconds))
+    for start in range(0, len(orphans), batch_size):
+        batch = orphans[start:start + batch_size]
+        known = set(StoredFile.objects.filter(name__in=batch).values_list('name', flat=True))
+
+        for name in batch:
+            if name in known:
+                continue
+            if not dry_run:
+                stats['bytes'] += storage.size(name)
+                storage.delete(name)
+            stats['orphans'] += 1
+    return stats
+
+
+def schedule_image_gc(delay):
+    # One pending sweep covers every release until it runs, see accounts.tasks
+    return enqueue('collect_images', key='collect_images', delay=max(delay, getattr(settings, 'IMAGE_GC_INTERVAL', 300)))
+
+
+def schedule_next_image_gc():
+    # For when the oldest file still unreferenced leaves its grace period
+    released_at = StoredFile.objects.filter(refcount__lte=0).aggregate(Min('released_at'))['released_at__min']
+    if released_at is None:
+        return None
+
+    grace_seconds = getattr(settings, 'IMAGE_GC_GRACE_SECONDS', 3600)
+    return schedule_image_gc((released_at - timezone.now()).total_seconds() + grace_seconds)
+
+
+# ----- LEGACY FILES -----
+
+def adopt_legacy_images(progress=None):
+    # Moves images stored under the old accounts/<username>/ names into the
+    # content addressed layout and counts their references.
+    storage = get_image_storage()
+    adopted = 0
+
+    users = User.objects.exclude(image='').exclude(image=None).order_by('pk').values_list('pk', 'image')
+    for pk, name in users.iterator():
+        if is_content_addressed(name) or not storage.exists(name):
+            continue
+
+        with storage.open(name) as file:
+            new_name = storage.save(f'{IMAGE_DIRECTORY}/{os.path.basename(name)}', File(file))
+
+        with transaction.atomic():
+            User.objects.filter(pk=pk).update(image=new_name)
+            retain(new_name)
+            emit(get_user_tags(pk))
+        storage.delete(name)
+
+        directory = os.path.dirname(storage.path(name))
+        if os.path.isdir(directory) and not os.listdir(directory):
+            os.rmdir(directory)
+
+        adopted += 1
+        if progress:
+            progress(adopted)
+    return adopted
@@ -0,0 +1,246 @@
+import csv
+import json
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import identify_hasher, make_password
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Q
+from phonenumber_field.phonenumber import to_python
+
+from .models import Relation
+from .availability import availability_index
+from .relations import record_bulk_follows, get_existing_pairs, insert_new_edges, edge_transaction
+from .invalidation import emit
+
+
+User = get_user_model()
+
+USER_FIELDS = ['username', 'email', 'first_name', 'last_name', 'phone_number']
+UNIQUE_FIELDS = ['username', 'email', 'phone_number']
+
+
+def read_rows(path):
+    # (line number, dict) pairs, one at a time, for .csv or .jsonl/.ndjson files
+    with open(path, newline='', encoding='utf-8') as file:
+        if path.endswith('.csv'):
+            for line, row in enumerate(csv.DictReader(file), start=2):
+                yield line, row
+        else:
+            for line, text in enumerate(file, start=1):
+                if text.strip():
+                    try:
+                        yield line, json.loads(text)
+                    except ValueError:
+                        yield line, None
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def validate_user_row(row):
+    if not isinstance(row, dict):
+        raise ValidationError('Malformed row')
+
+    data = {field: str(row.get(field) or '').strip() for field in USER_FIELDS}
+    missing = [field for field, value in data.items() if not value]
+    if missing:
+        raise ValidationError(f"Missing {', '.join(missing)}")
+
+    phone_number = to_python(data['phone_number'])
+    if not phone_number or not phone_number.is_valid():
+        raise ValidationError('Enter a valid phone number')
+    data['phone_number'] = phone_number.as_e164
+
+    # The model's own field validators and max_lengths, uniqueness is checked
+    # per batch against the database instead
+    user = User(**data)
+    try:
+        user.full_clean(exclude=['password'], validate_unique=False, validate_constraints=False)
+    except ValidationError as e:
+        raise ValidationError([f'{field}: {message}' for field, messages in e.message_dict.items() for message in messages])
+    data['email'] = user.email
+
+    password_hash = row.get('password_hash')
+    if password_hash:
+        try:
+            identify_hasher(password_hash)
+        except ValueError:
+            raise ValidationError('Unknown password hash format')
+        data['password'] = password_hash
+    elif row.get('password'):
+        data['raw_password'] = str(row['password'])
+    else:
+        raise ValidationError('Missing password or password_hash')
+    return data
+
+
+def setup_worker():
+    import django
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+    django.setup()
+
+
+class AccountImporter:
+    def __init__(self, batch_size=1000, workers=None, on_error=None, on_progress=None):
+        self.batch_size = batch_size
+        self.workers = os.cpu_count() if workers is None else workers
+        self.on_error = on_error
+        self.on_progress = on_progress
+        self.stats = Counter()
+        self.pool = None
+
+    def __enter__(self):
+        if self.workers > 1:
+            self.pool = ProcessPoolExecutor(self.workers, initializer=setup_worker)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.pool is not None:
+            self.pool.shutdown()
+
+    def error(self, kind, line, message):
+        self.stats[f'{kind}_errors'] += 1
+        if self.on_error:
+            self.on_error(kind, line, message)
+
+    def hash_passwords(self, passwords):
+        if self.pool is None:
+            return [make_password(password) for password in passwords]
+        return list(self.pool.map(make_password, passwords, chunksize=max(1, len(passwords) // self.workers)))
+
+    # ----- USERS -----
+
+    def import_users(self, rows):
+        for batch in batched(rows, self.batch_size):
+            self.import_user_batch(batch)
+            if self.on_progress:
+                self.on_progress('users', self.stats)
+
+    def import_user_batch(self, batch):
+        valid, seen = [], {field: set() for field in UNIQUE_FIELDS}
+
+        for line, row in batch:
+            try:
+                data = validate_user_row(row)
+            except ValidationError as e:
+                self.error('user', line, '; '.join(e.messages))
+                continue
+
+            duplicate = next((field for field in UNIQUE_FIELDS if data[field] in seen[field]), None)
+            if duplicate:
+                self.error('user', line, f'Duplicate {duplicate} in the input')
+                continue
+
+            for field in UNIQUE_FIELDS:
+                seen[field].add(data[field])
+            valid.append((line, data))
+
+        taken = self.get_taken_values(seen)
+        users = []
+        for line, data in valid:
+            conflict = next((field for field in UNIQUE_FIELDS if data[field] in taken[field]), None)
+            if conflict:
+                self.error('user', line, f'This {conflict} already exists')
+            else:
+                users.append((line, data))
+
+        raw = [data for line, data in users if 'raw_password' in data]
+        for data, password in zip(raw, self.hash_passwords([data.pop('raw_password') for data in raw])):
+            data['password'] = password
+
+        if not users:
+            return
+
+        with transaction.atomic():
+            User.objects.bulk_create([User(**data) for line, data in users], ignore_conflicts=True)
+            created = self.get_created_users(data for line, data in users)
+            if created:
+                emit(['users'])
+
+        # A row taken concurrently since get_taken_values was skipped by the
+        # INSERT and is reported rather than counted
+        for line, data in users:
+            if data['username'] not in created:
+                self.error('user', line, 'This username, email or phone number already exists')
+
+        for user in created.values():
+            availability_index.add_user(user)
+        self.stats['users_created'] += len(created)
+
+    def get_created_users(self, users):
+        # The rows that carry the batch's own unique values, by username
+        keys = {data['username']: tuple(data[field] for field in UNIQUE_FIELDS) for data in users}
+        return {
+            user.username: user
+            for user in User.objects.filter(username__in=keys).order_by()
+            if tuple(str(getattr(user, field)) for field in UNIQUE_FIELDS) == keys[user.username]
+        }
+
+    def get_taken_values(self, values):
+        query = Q()
+        for field in UNIQUE_FIELDS:
+            if values[field]:
+                query |= Q(**{f'{field}__in': values[field]})
+
+        taken = {field: set() for field in UNIQUE_FIELDS}
+        if not query:
+            return taken
+
+        for row in User.objects.filter(query).order_by().values_list(*UNIQUE_FIELDS):
+            for field, value in zip(UNIQUE_FIELDS, row):
+                taken[field].add(str(value))
+        return taken
+
+    # ----- RELATIONS -----
+
+    def import_relations(self, rows):
+        for batch in batched(rows, self.batch_size):
+            self.import_relation_batch(batch)
+            if self.on_progress:
+                self.on_progress('relations', self.stats)
+
+    def import_relation_batch(self, batch):
+        edges = []
+        for line, row in batch:
+            if not isinstance(row, dict) or not row.get('from_user') or not row.get('to_user'):
+                self.error('relation', line, 'Missing from_user or to_user')
+            elif row['from_user'] == row['to_user']:
+                self.error('relation', line, 'Users cannot follow themselves')
+            else:
+                edges.append((line, str(row['from_user']), str(row['to_user'])))
+
+        usernames = {username for line, from_user, to_user in edges for username in (from_user, to_user)}
+        user_ids = dict(User.objects.filter(username__in=usernames).order_by().values_list('username', 'pk'))
+
+        pairs = {}
+        for line, from_user, to_user in edges:
+            missing = next((username for username in (from_user, to_user) if username not in user_ids), None)
+            if missing:
+                self.error('relation', line, f'User {missing} does not exist')
+            else:
+                pairs.setdefault((user_ids[from_user], user_ids[to_user]), line)
+
+        existing = get_existing_pairs(pairs)
+        new_pairs = [pair for pair in pairs if pair not in existing]
+        self.stats['relations_skipped'] += len(pairs) - len(new_pairs)
+
+        if not new_pairs:
+            return
+
+        relations = [Relation(from_user_id=from_id, to_user_id=to_id) for from_id, to_id in new_pairs]
+        with edge_transaction(relations):
+            relations = insert_new_edges(relations)
+            if relations:
+                record_bulk_follows(relations)
+
+        self.stats['relations_skipped'] += len(new_pairs) - len(relations)
+        self.stats['relations_created'] += len(relations)
@@ -0,0 +1,300 @@
+import abc
+import contextlib
+import datetime
+import glob
+import json
+import logging
+import os
+import socket
+import threading
+import weakref
+
+from django.conf import settings
+from django.db import close_old_connections, router, transaction
+from django.db.transaction import TransactionManagementError
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import ChangeEvent
+
+
+logger = logging.getLogger(__name__)
+
+# Tags: 'users' (anything listing or searching users), 'user:<id>' (one
+# user's profile data), 'relations:<id>' (one user's followers/following).
+FLUSH_ALL = '*'
+
+
+def get_user_tags(user_id):
+    return ['users', f'user:{user_id}']
+
+
+def get_relation_tags(*user_ids):
+    return [f'relations:{user_id}' for user_id in user_ids]
+
+
+# ----- SUBSCRIBERS -----
+
+_caches = weakref.WeakSet()
+_handlers = []
+
+
+def register_cache(cache):
+    _caches.add(cache)
+    start_subscriber()
+    return cache
+
+
+def register_handler(handler):
+    _handlers.append(handler)
+    start_subscriber()
+
+
+def dispatch(tags):
+    tags = set(tags)
+
+    for cache in list(_caches):
+        if FLUSH_ALL in tags:
+            cache.clear()
+        else:
+            cache.invalidate(tags)
+    for handler in _handlers:
+        handler(tags)
+
+
+# ----- OUTBOX -----
+
+def emit(tags):
+    # Same transaction as the change, so an event exists if and only if the
+    # change committed. This process evicts right away, others via the tailer.
+    if not transaction.get_connection(router.db_for_write(ChangeEvent)).in_atomic_block:
+        raise TransactionManagementError('emit() must run in the transaction of the change it reports')
+
+    tags = sorted(set(tags))
+    ChangeEvent.objects.create(tags=tags)
+    transaction.on_commit(lambda: dispatch(tags))
+
+
+# ----- TRANSPORTS -----
+
+class Transport(abc.ABC):
+    poll_interval = 1.0
+    # False when subscribers read the outbox themselves and the tailer has
+    # nothing to publish
+    publishes = True
+
+    @abc.abstractmethod
+    def publish(self, message):
+        pass
+
+    @abc.abstractmethod
+    def listen(self, callback, stop):
+        pass
+
+
+class DatabaseTransport(Transport):
+    # Subscribers poll the outbox table themselves; the tailer only prunes it.
+    # Ids are taken at insert but rows show up at commit, so a lower id can
+    # appear after a higher one: every poll reads the rows created in the last
+    # INVALIDATION_POLL_OVERLAP seconds again and skips the ids already seen.
+    # A transaction open for longer than that can still be missed.
+
+    publishes = False
+
+    def publish(self, message):
+        # The outbox rows are the messages
+        pass
+
+    def listen(self, callback, stop):
+        overlap = datetime.timedelta(seconds=getattr(settings, 'INVALIDATION_POLL_OVERLAP', 10))
+        since = timezone.now()
+        # What is already there was committed before this process started
+        seen = dict(ChangeEvent.objects.filter(created_at__gte=since - overlap).values_list('pk', 'created_at'))
+
+        while not stop.wait(self.poll_interval):
+            close_old_connections()
+            rows = list(ChangeEvent.objects.filter(
+                created_at__gte=since - overlap,
+            ).order_by('pk').values_list('pk', 'created_at', 'tags'))
+
+            new = [(pk, tags) for pk, created_at, tags in rows if pk not in seen]
+            seen = {pk: created_at for pk, created_at, tags in rows}
+            if rows:
+                since = max(seen.values())
+            if new:
+                callback({'id': new[-1][0], 'tags': [tag for pk, tags in new for tag in tags]})
+
+
+class FileTransport(Transport):
+    # Stand-in for a log-based broker: the tailer appends JSON lines to a shared
+    # file and each process follows it from its own offset.
+
+    publishes = True
+
+    def __init__(self, path=None):
+        self.path = path or getattr(settings, 'INVALIDATION_FILE', os.path.join(settings.BASE_DIR, 'invalidation.log'))
+
+    def publish(self, message):
+        with open(self.path, 'a') as file:
+            file.write(json.dumps(message) + '\n')
+
+    def listen(self, callback, stop):
+        offset = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+        while not stop.wait(self.poll_interval):
+            if not os.path.exists(self.path):
+                continue
+            if os.path.getsize(self.path) < offset:
+                offset = 0
+
+            with open(self.path) as file:
+                file.seek(offset)
+                for line in iter(file.readline, ''):
+                    if not line.endswith('\n'):
+                        break
+                    offset += len(line.encode())
+                    callback(json.loads(line))
+
+
+class UnixSocketTransport(Transport):
+    # Every process binds a datagram socket in a shared directory; the tailer
+    # sends each message to all of them and removes sockets nobody reads.
+
+    publishes = True
+
+    def __init__(self, directory=None):
+        self.directory = directory or getattr(settings, 'INVALIDATION_SOCKET_DIR', '/tmp/django-invalidation')
+
+    def publish(self, message):
+        data = json.dumps(message).encode()
+        sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+
+        try:
+            for path in glob.glob(os.path.join(self.directory, '*.sock')):
+                try:
+                    sender.sendto(data, path)
+                except (ConnectionRefusedError, FileNotFoundError):
+                    # Its process is gone; another publisher may clean up first
+                    with contextlib.suppress(FileNotFoundError):
+                        os.unlink(path)
+                except OSError:
+                    logger.warning('Could not deliver invalidation to %s', path)
+        finally:
+            sender.close()
+
+    def listen(self, callback, stop):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f'{os.getpid()}.sock')
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(path)
+
+        receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        receiver.bind(path)
+        receiver.settimeout(self.poll_interval)
+
+        try:
+            while not stop.is_set():
+                try:
+                    data = receiver.recv(65536)
+                except socket.timeout:
+                    continue
+                callback(json.loads(data))
+        finally:
+            receiver.close()
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(path)
+
+
+_transport = None
+
+
+def get_transport():
+    global _transport
+
+    if _transport is None:
+        _transport = import_string(getattr(settings, 'INVALIDATION_TRANSPORT', 'accounts.invalidation.DatabaseTransport'))()
+    return _transport
+
+
+# ----- SUBSCRIBER THREAD -----
+
+_subscriber = None
+_subscriber_lock = threading.Lock()
+_subscribe = False
+_stop = threading.Event()
+
+
+def handle_message(message):
+    try:
+        dispatch(message['tags'])
+    except Exception:
+        logger.exception('Invalidation message %s failed', message.get('id'))
+
+
+def enable_subscriber():
+    global _subscribe
+
+    _subscribe = True
+    start_subscriber()
+
+
+def start_subscriber():
+    # Only in processes that called enable_subscriber() (see utils.startup),
+    # or in all of them with INVALIDATION_SUBSCRIBE
+    global _subscriber
+
+    if not (_subscribe or getattr(settings, 'INVALIDATION_SUBSCRIBE', False)):
+        return
+
+    with _subscriber_lock:
+        if _subscriber is None or not _subscriber.is_alive():
+            _stop.clear()
+            _subscriber = threading.Thread(
+                target=get_transport().listen,
+                args=(handle_message, _stop),
+                name='invalidation-subscriber',
+                daemon=True,
+            )
+            _subscriber.start()
+
+
+def stop_subscriber():
+    _stop.set()
+
+
+# ----- TAILER -----
+
+def tail_outbox(batch_size=1000, max_tags=500):
+    # Publishes one compact message per batch of outbox rows, then removes
+    # them. Returns the number of rows consumed.
+    transport = get_transport()
+
+    if not transport.publishes:
+        retention = getattr(settings, 'INVALIDATION_OUTBOX_RETENTION', 3600)
+        cutoff = timezone.now() - datetime.timedelta(seconds=retention)
+        stale = list(ChangeEvent.objects.filter(created_at__lt=cutoff).order_by('pk').values_list('pk', flat=True)[:batch_size])
+        ChangeEvent.objects.filter(pk__in=stale).delete()
+        return 0
+
+    rows = list(ChangeEvent.objects.order_by('pk').values_list('pk', 'tags')[:batch_size])
+    if not rows:
+        return 0
+
+    tags = sorted({tag for pk, row_tags in rows for tag in row_tags})
+    if len(tags) > max_tags:
+        tags = [FLUSH_ALL]
+
+    transport.publish({'id': rows[-1][0], 'tags': tags})
+    # Not pk__lte: a lower id may commit after this read
+    ChangeEvent.objects.filter(pk__in=[pk for pk, row_tags in rows]).delete()
+    return len(rows)
+
+
+def run_tailer(interval=None, stop=None):
+    interval = getattr(settings, 'INVALIDATION_TAIL_INTERVAL', 0.5) if interval is None else interval
+    stop = stop or threading.Event()
+
+    while not stop.is_set():
+        consumed = tail_outbox()
+        if not consumed:
+            stop.wait(interval)
@@ -0,0 +1,210 @@
+import datetime
+import logging
+import random
+import threading
+import uuid
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, close_old_connections, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+
+
+logger = logging.getLogger(__name__)
+
+
+# ----- REGISTRY -----
+
+class JobType:
+    # expires: seconds after which a job that hasn't succeeded is dropped
+    # instead of run. sensitive: the payload (e.g. a one time code) is
+    # cleared when the job fails for good, the row only keeps the error.
+    def __init__(self, func, batch_size=1, max_attempts=5, priority=0, expires=None, sensitive=False):
+        self.func = func
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.priority = priority
+        self.expires = expires
+        self.sensitive = sensitive
+
+    def is_expired(self, job, now):
+        return self.expires is not None and job.created_at + datetime.timedelta(seconds=self.expires) <= now
+
+    def run(self, payloads):
+        # Batched handlers take the list of payloads, others one payload's kwargs
+        if self.batch_size > 1:
+            self.func(payloads)
+        else:
+            self.func(**payloads[0])
+
+
+_registry = {}
+
+
+def register(name, batch_size=1, max_attempts=5, priority=0, expires=None, sensitive=False):
+    def decorator(func):
+        _registry[name] = JobType(func, batch_size, max_attempts, priority, expires, sensitive)
+        return func
+    return decorator
+
+
+# ----- QUEUE -----
+
+def enqueue(name, payload=None, priority=None, delay=0, key=None):
+    # In the caller's transaction, so the job exists if and only if the work
+    # that asked for it committed. Returns None when a job with key is still
+    # waiting to be claimed.
+    job = Job(
+        name=name,
+        payload=payload or {},
+        priority=_registry[name].priority if priority is None else priority,
+        run_at=timezone.now() + datetime.timedelta(seconds=delay),
+        key=key,
+    )
+
+    try:
+        with transaction.atomic():
+            job.save(force_insert=True)
+    except IntegrityError:
+        if key is None:
+            raise
+        return None
+
+    transaction.on_commit(start_worker_in_background)
+    return job
+
+
+def claim_jobs(limit, lease):
+    # Takes up to limit due jobs, highest priority first, by pushing their
+    # run_at out by the lease under a fresh token. Returns (token, jobs).
+    token = uuid.uuid4().hex
+    now = timezone.now()
+    due = Job.objects.filter(failed_at=None, run_at__lte=now).order_by('-priority', 'run_at')
+    # The key is released, so the job may queue its own follow-up
+    claim = {'locked_by': token, 'run_at': now + datetime.timedelta(seconds=lease), 'attempts': F('attempts') + 1, 'key': None}
+
+    if connections[Job.objects.db].features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            pks = list(due.select_for_update(skip_locked=True).values_list('pk', flat=True)[:limit])
+            Job.objects.filter(pk__in=pks).update(**claim)
+    else:
+        # SQLite: a single UPDATE holds the write lock from the subquery to
+        # the last row, so two workers can't claim the same job
+        Job.objects.filter(pk__in=due.values('pk')[:limit]).update(**claim)
+
+    return token, list(Job.objects.filter(locked_by=token).order_by('-priority', 'run_at'))
+
+
+def get_retry_delay(attempts):
+    base = getattr(settings, 'JOBS_RETRY_DELAY', 10)
+    delay = min(base * 2 ** (attempts - 1), getattr(settings, 'JOBS_RETRY_MAX_DELAY', 3600))
+    return delay + random.uniform(0, delay / 2)
+
+
+def retry_jobs(token, jobs, job_type, error, final=False):
+    now = timezone.now()
+
+    for job in jobs:
+        if final or job_type is None or job.attempts >= job_type.max_attempts:
+            update = {'failed_at': now}
+            if job_type is not None and job_type.sensitive:
+                update['payload'] = {}
+        else:
+            update = {'run_at': now + datetime.timedelta(seconds=get_retry_delay(job.attempts))}
+        Job.objects.filter(pk=job.pk, locked_by=token).update(locked_by='', last_error=error, **update)
+
+
+def run_jobs(limit=None, lease=None):
+    # Runs one claimed batch and returns the number of jobs it held. A job is
+    # only deleted after its handler returned: delivery is at least once, and
+    # handlers open their own (short) transactions.
+    limit = limit or getattr(settings, 'JOBS_BATCH_SIZE', 50)
+    lease = lease or getattr(settings, 'JOBS_LEASE_SECONDS', 300)
+    token, jobs = claim_jobs(limit, lease)
+
+    groups = defaultdict(list)
+    for job in jobs:
+        groups[job.name].append(job)
+
+    for name, group in groups.items():
+        job_type = _registry.get(name)
+        if job_type is None:
+            retry_jobs(token, group, None, f'No handler registered for {name}')
+            continue
+
+        now = timezone.now()
+        expired = [job for job in group if job_type.is_expired(job, now)]
+        if expired:
+            retry_jobs(token, expired, job_type, 'Expired', final=True)
+            group = [job for job in group if job not in expired]
+
+        for start in range(0, len(group), job_type.batch_size):
+            batch = group[start:start + job_type.batch_size]
+            try:
+                job_type.run([job.payload for job in batch])
+            except Exception as error:
+                logger.exception('Job %s failed', name)
+                retry_jobs(token, batch, job_type, repr(error))
+            else:
+                Job.objects.filter(pk__in=[job.pk for job in batch], locked_by=token).delete()
+    return len(jobs)
+
+
+# ----- WORKERS -----
+
+def run_worker(stop=None, wake=None, interval=None):
+    interval = getattr(settings, 'JOBS_POLL_INTERVAL', 1.0) if interval is None else interval
+    stop = stop or threading.Event()
+    wake = wake or threading.Event()
+
+    while not stop.is_set():
+        close_old_connections()
+        try:
+            ran = run_jobs()
+        except DatabaseError:
+            logger.exception('Claiming jobs failed')
+            ran = 0
+
+        if not ran:
+            wake.wait(interval)
+            wake.clear()
+
+
+_worker = None
+_worker_lock = threading.Lock()
+_run_in_process = False
+_stop = threading.Event()
+_wake = threading.Event()
+
+
+def enable_worker():
+    global _run_in_process
+
+    _run_in_process = True
+    return start_worker_in_background()
+
+
+def start_worker_in_background():
+    # A worker thread in this process, woken by every enqueue. Only in
+    # processes that called enable_worker() (see utils.startup), or in all of
+    # them with JOBS_RUN_IN_PROCESS; elsewhere jobs wait for a worker
+    global _worker
+
+    if not (_run_in_process or getattr(settings, 'JOBS_RUN_IN_PROCESS', False)):
+        return False
+
+    _wake.set()
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _stop.clear()
+            _worker = threading.Thread(target=run_worker, args=(_stop, _wake), name='job-worker', daemon=True)
+            _worker.start()
+    return True
+
+
+def stop_worker():
+    _stop.set()
+    _wake.set()
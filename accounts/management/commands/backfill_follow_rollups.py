@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from accounts.rollups import backfill_follower_rollups
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily follower rollups from the existing Relation table, in chunks of users.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        def progress(processed, rows):
+            self.stdout.write(f'{processed} users processed ({rows} rollup rows in the last chunk)')
+
+        processed = backfill_follower_rollups(options['chunk_size'], progress if options['verbosity'] > 1 else None)
+        self.stdout.write(self.style.SUCCESS(
+            f'Backfilled follower rollups for {processed} users. Unfollows that happened before '
+            f'incremental tracking started cannot be recovered.'
+        ))
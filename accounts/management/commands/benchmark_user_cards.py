@@ -0,0 +1,72 @@
+import time
+import tracemalloc
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from accounts.cards import get_user_cards
+
+
+User = get_user_model()
+
+
+class Rollback(Exception):
+    pass
+
+
+def measure(load, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        load()
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    rows = load()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(rows), elapsed / repeat, peak
+
+
+class Command(BaseCommand):
+    help = 'Compare loading a page of users as model instances and as lean user cards.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page-size', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=0, help='Create this many throwaway users first (rolled back).')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                if options['seed']:
+                    User.objects.bulk_create(
+                        User(
+                            username=f'benchuser{index}',
+                            email=f'benchuser{index}@example.com',
+                            first_name='Bench',
+                            last_name='User',
+                            phone_number=f'+1202555{index:07d}'[:15],
+                            password='!',
+                        )
+                        for index in range(options['seed'])
+                    )
+                self.run(options['page_size'], options['repeat'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, page_size, repeat):
+        queryset = User.objects.filter(is_active=True).order_by('-followers_count', 'pk')
+        results = {
+            'models': measure(lambda: list(queryset[:page_size]), repeat),
+            'cards': measure(lambda: list(get_user_cards(queryset)[:page_size]), repeat),
+        }
+
+        self.stdout.write(f"{'mode':<8} {'rows':>6} {'ms/page':>9} {'rows/s':>10} {'peak KB':>9}")
+        for mode, (rows, seconds, peak) in results.items():
+            self.stdout.write(f'{mode:<8} {rows:>6} {seconds * 1000:>9.2f} {rows / seconds:>10.0f} {peak / 1024:>9.1f}')
+
+        models, cards = results['models'], results['cards']
+        if cards[1] and cards[2]:
+            self.stdout.write(f'cards are {models[1] / cards[1]:.1f}x faster and use {models[2] / cards[2]:.1f}x less peak memory')
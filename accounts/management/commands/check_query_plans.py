@@ -0,0 +1,104 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from accounts import views
+
+
+User = get_user_model()
+
+PROBLEMS = {
+    'scan': 'full scan',
+    'sort': 'temporary B-tree',
+}
+
+
+def get_checks(username, search):
+    # (name, view, kwargs, query string)
+    return [
+        ('people list', views.UserListView, {}, {}),
+        ('people search', views.UserListView, {}, {'search': search}),
+        ('user detail', views.UserDetailView, {'username': username}, {}),
+        ('follower list', views.UserFollowerListView, {'username': username}, {}),
+        ('following list', views.UserFollowingListView, {'username': username}, {}),
+        ('follower search', views.UserFollowerListView, {'username': username}, {'search': search}),
+        ('following search', views.UserFollowingListView, {'username': username}, {'search': search}),
+    ]
+
+
+def get_plan_problems(plan, limited=False):
+    problems = set()
+    # Reading back a subquery's own (bounded) result isn't a table scan
+    subqueries = {'CONSTANT ROW'} | {
+        detail.split(' ', 1)[1] for detail in plan if detail.startswith(('CO-ROUTINE ', 'MATERIALIZE '))
+    }
+    # Without a sort, a LIMIT stops an index walk at the end of the page
+    sorted_ = any(detail.startswith('USE TEMP B-TREE') for detail in plan)
+
+    for detail in plan:
+        if detail.startswith('SCAN ') and detail[5:] not in subqueries:
+            if not (limited and not sorted_ and ' USING ' in detail and ' INDEX ' in detail):
+                problems.add('scan')
+        elif detail.startswith('USE TEMP B-TREE'):
+            problems.add('sort')
+    return problems
+
+
+def explain(sql):
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+        return [row[-1] for row in cursor.fetchall()]
+
+
+class Command(BaseCommand):
+    help = 'Run EXPLAIN QUERY PLAN on the queries of the user list, detail and search views and fail on full scans or temporary sorts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', help='User whose pages are checked (default: the first one).')
+        parser.add_argument('--search', help='Search term (default: the start of the username).')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('EXPLAIN QUERY PLAN is SQLite specific')
+
+        user = User.objects.filter(username=options['username']) if options['username'] else User.objects.order_by('pk')
+        user = user.first()
+        if user is None:
+            raise CommandError('No user to check the pages of')
+
+        search = options['search'] or user.username[:3]
+        factory = RequestFactory()
+        failures = 0
+
+        for name, view, kwargs, query in get_checks(user.username, search):
+            # Twice: a search misses the result cache, then hits it
+            with CaptureQueriesContext(connection) as captured:
+                for _ in range(2):
+                    request = factory.get('/', query)
+                    request.user = user
+                    view.as_view()(request, **kwargs)
+
+            statements = dict.fromkeys(
+                executed['sql'] for executed in captured.captured_queries if executed['sql'].startswith('SELECT')
+            )
+            for sql in statements:
+                plan = explain(sql)
+                problems = get_plan_problems(plan, ' LIMIT ' in sql)
+
+                if not problems:
+                    status = self.style.SUCCESS('OK')
+                else:
+                    failures += 1
+                    status = self.style.ERROR(', '.join(PROBLEMS[problem] for problem in sorted(problems)))
+
+                self.stdout.write(f'{name}: {status}')
+                if problems or options['verbosity'] > 1:
+                    self.stdout.write(f'  {sql}')
+                    for detail in plan:
+                        self.stdout.write(f'    {detail}')
+
+        if failures:
+            raise CommandError(f'{failures} queries fall back to a full scan or a temporary B-tree')
+        self.stdout.write(self.style.SUCCESS('All query plans use indexes'))
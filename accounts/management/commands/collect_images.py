@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from accounts.images import adopt_legacy_images, collect_image_garbage
+
+
+class Command(BaseCommand):
+    help = 'Delete profile image files that are no longer referenced by any user.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-seconds', type=int, default=None, help='Only files unreferenced for at least this long.')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--dry-run', action='store_true')
+        parser.add_argument('--adopt-legacy', action='store_true', help='First move images with pre content addressed names into the new layout.')
+
+    def handle(self, *args, **options):
+        if options['adopt_legacy']:
+            adopted = adopt_legacy_images()
+            self.stdout.write(f'Adopted {adopted} legacy images')
+
+        stats = collect_image_garbage(options['grace_seconds'], options['batch_size'], options['dry_run'])
+        verb = 'Would delete' if options['dry_run'] else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {stats['deleted']} unreferenced and {stats['orphans']} orphaned files ({stats['bytes'] / 1024:.1f} KB)"
+        ))
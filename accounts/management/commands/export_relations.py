@@ -0,0 +1,45 @@
+import sys
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.exports import EXPORT_DIRECTIONS, EXPORT_FORMATS, iter_export
+
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Stream the follower or following list of a user as NDJSON or CSV.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('--direction', choices=list(EXPORT_DIRECTIONS), default='followers')
+        parser.add_argument('--format', dest='export_format', choices=list(EXPORT_FORMATS), default='ndjson')
+        parser.add_argument('--cursor', type=int, default=0, help='Resume after this relation id.')
+        parser.add_argument('--chunk-size', type=int, default=None)
+        parser.add_argument('--gzip', action='store_true')
+        parser.add_argument('--output', help='Write to this file instead of stdout.')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['username']} does not exist")
+
+        chunks = iter_export(
+            user,
+            options['direction'],
+            options['export_format'],
+            options['cursor'],
+            options['chunk_size'],
+            options['gzip'],
+        )
+
+        if options['output']:
+            with open(options['output'], 'wb') as output:
+                output.writelines(chunks)
+        else:
+            sys.stdout.flush()
+            sys.stdout.buffer.writelines(chunks)
+            sys.stdout.buffer.flush()
@@ -0,0 +1,54 @@
+import csv
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.importer import AccountImporter, read_rows
+
+
+class Command(BaseCommand):
+    help = 'Import users and follow edges from CSV or JSONL files in validated, batched writes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', help='CSV/JSONL with username, email, first_name, last_name, phone_number and password or password_hash.')
+        parser.add_argument('--relations', help='CSV/JSONL with from_user and to_user usernames.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--workers', type=int, default=None, help='Password hashing processes, defaults to the CPU count.')
+        parser.add_argument('--errors', help='Write per-row errors to this CSV file instead of stderr.')
+
+    def handle(self, *args, **options):
+        if not options['users'] and not options['relations']:
+            raise CommandError('Pass --users and/or --relations')
+
+        errors_file = open(options['errors'], 'w', newline='') if options['errors'] else None
+        error_writer = csv.writer(errors_file or sys.stderr)
+        error_writer.writerow(['kind', 'line', 'message'])
+        started = time.monotonic()
+
+        def on_progress(kind, stats):
+            elapsed = time.monotonic() - started
+            done = stats[f'{kind}_created']
+            self.stdout.write(f'{kind}: {done} created, {stats[f"{kind[:-1]}_errors"]} errors, {done / elapsed:.0f}/s')
+
+        try:
+            with AccountImporter(
+                batch_size=options['batch_size'],
+                workers=options['workers'],
+                on_error=lambda kind, line, message: error_writer.writerow([kind, line, message]),
+                on_progress=on_progress,
+            ) as importer:
+                if options['users']:
+                    importer.import_users(read_rows(options['users']))
+                if options['relations']:
+                    importer.import_relations(read_rows(options['relations']))
+        finally:
+            if errors_file:
+                errors_file.close()
+
+        stats = importer.stats
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {stats['users_created']} users and {stats['relations_created']} relations "
+            f"({stats['user_errors']} user errors, {stats['relation_errors']} relation errors, "
+            f"{stats['relations_skipped']} existing relations skipped) in {time.monotonic() - started:.1f}s"
+        ))
@@ -0,0 +1,92 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+from django.urls import Resolver404, resolve
+
+from utils.memory import (
+    compare_snapshots,
+    get_rss,
+    measure_allocations,
+    request_memory_stats,
+    start_tracking,
+    stop_tracking,
+    take_snapshot,
+)
+
+
+User = get_user_model()
+
+
+def format_size(size):
+    for unit in ('B', 'KB', 'MB'):
+        if abs(size) < 1024:
+            return f'{size:+.0f} {unit}' if unit == 'B' else f'{size:+.1f} {unit}'
+        size /= 1024
+    return f'{size:+.1f} GB'
+
+
+class Command(BaseCommand):
+    help = 'Render pages repeatedly under tracemalloc and report what stays allocated, by module and allocation site.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', action='append', dest='urls', help='Path to request (repeatable, default: the people list).')
+        parser.add_argument('--repeat', type=int, default=20, help='Requests per path after the warm-up one.')
+        parser.add_argument('--username', help='User making the requests (default: the first staff user).')
+        parser.add_argument('--frames', type=int, default=1, help='Traceback frames kept per allocation.')
+        parser.add_argument('--limit', type=int, default=20, help='Allocation sites to show.')
+
+    def handle(self, *args, **options):
+        urls = options['urls'] or ['/accounts/']
+        users = User.objects.filter(username=options['username']) if options['username'] else User.objects.order_by('-is_staff', 'pk')
+        user = users.first()
+        if user is None:
+            raise CommandError('No user to make the requests as')
+
+        factory = RequestFactory()
+        try:
+            views = [(url, resolve(url.split('?')[0])) for url in urls]
+        except Resolver404 as error:
+            raise CommandError(f'Unknown path: {error}')
+
+        def get(url, match):
+            request = factory.get(url)
+            request.user = user
+            request.resolver_match = match
+            return match.func(request, *match.args, **match.kwargs)
+
+        rss = get_rss()
+        start_tracking(options['frames'])
+        try:
+            # One-time costs (template compilation, lazy imports, caches
+            # filling up) go into the baseline instead of the growth
+            for url, match in views:
+                get(url, match)
+            baseline = take_snapshot()
+
+            for _ in range(options['repeat']):
+                for url, match in views:
+                    response, peak, retained = measure_allocations(get, url, match)
+                    request_memory_stats.record(url, peak, retained)
+
+            report = compare_snapshots(take_snapshot(), baseline, options['limit'])
+            view_stats = request_memory_stats.get_report(len(views))
+        finally:
+            stop_tracking()
+
+        self.stdout.write(self.style.MIGRATE_HEADING(f"Growth over {options['repeat']} rounds, by module"))
+        for group in report['groups']:
+            self.stdout.write(f"  {group['group']:<24} {format_size(group['size']):>12} {group['count']:+8} blocks")
+
+        self.stdout.write(self.style.MIGRATE_HEADING('Top allocation sites'))
+        for site in report['top']:
+            self.stdout.write(f"  {format_size(site['size']):>12} {site['count']:+8}  {site['site']} ({site['group']})")
+
+        self.stdout.write(self.style.MIGRATE_HEADING('Per request'))
+        for view in view_stats:
+            self.stdout.write(
+                f"  {view['view']:<40} peak {format_size(view['peak_max'])} max, "
+                f"retained {format_size(view['retained_total'] / view['requests'])} avg"
+            )
+
+        if rss is not None:
+            self.stdout.write(f'RSS {format_size(get_rss() - rss)} while running')
@@ -0,0 +1,93 @@
+import json
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+BOOT_SCRIPT = '''
+import json, resource, sys
+import {module}
+from utils.startup import startup_report, warm_up
+
+if not startup_report:
+    warm_up()
+
+rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+try:
+    with open('/proc/self/status') as status:
+        rss_kb = next(int(line.split()[1]) for line in status if line.startswith('VmRSS:'))
+except (OSError, StopIteration):
+    pass
+
+print(json.dumps({{
+    'report': startup_report,
+    'rss_kb': rss_kb,
+    'loaded_lazy_modules': [name for name in {lazy_modules!r} if name in sys.modules],
+}}))
+'''
+
+
+def parse_importtime(output):
+    modules = []
+
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules.append((name.strip(), int(self_us), int(cumulative_us)))
+    return modules
+
+
+class Command(BaseCommand):
+    help = 'Boot a fresh worker and report per-module import time, RSS and warm-up timings.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--module', default='config.wsgi', help='Entry point to import, e.g. config.asgi.')
+        parser.add_argument('--top', type=int, default=25)
+        parser.add_argument('--sort', choices=['cumulative', 'self'], default='cumulative')
+        parser.add_argument('--fail-over-budget', action='store_true')
+
+    def handle(self, *args, **options):
+        lazy_modules = getattr(settings, 'STARTUP_LAZY_MODULES', [])
+        script = BOOT_SCRIPT.format(module=options['module'], lazy_modules=lazy_modules)
+
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', script],
+            capture_output=True,
+            text=True,
+            cwd=settings.BASE_DIR,
+            env=dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'config.settings')),
+        )
+        if result.returncode:
+            raise CommandError(result.stderr[-2000:])
+
+        boot = json.loads(result.stdout.strip().splitlines()[-1])
+        modules = parse_importtime(result.stderr)
+        column = 2 if options['sort'] == 'cumulative' else 1
+
+        self.stdout.write(f"{'self ms':>9} {'cumul ms':>9}  module")
+        for name, self_us, cumulative_us in sorted(modules, key=lambda module: -module[column])[:options['top']]:
+            self.stdout.write(f'{self_us / 1000:>9.2f} {cumulative_us / 1000:>9.2f}  {name}')
+
+        report = boot['report']
+        import_ms = sum(module[1] for module in modules) / 1000
+        self.stdout.write('')
+        self.stdout.write(f'Modules imported: {len(modules)} ({import_ms:.1f}ms)')
+        self.stdout.write(f"RSS after boot: {boot['rss_kb'] / 1024:.1f}MB")
+        for step in ['templates', 'url_resolvers', 'availability_index']:
+            if step in report:
+                self.stdout.write(f"Warm-up {step}: {report[step]['count']} in {report[step]['ms']}ms")
+        self.stdout.write(f"Time to ready: {report['ready_ms']}ms")
+
+        for name in boot['loaded_lazy_modules']:
+            self.stdout.write(self.style.WARNING(f'{name} was imported during boot, it should load on first use'))
+
+        budget = getattr(settings, 'STARTUP_BUDGET_MS', None)
+        if budget and report['ready_ms'] > budget:
+            message = f"Time to ready {report['ready_ms']}ms is over the {budget}ms budget"
+            if options['fail_over_budget']:
+                raise CommandError(message)
+            self.stdout.write(self.style.WARNING(message))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from utils.sessions import purge_expired_sessions
+
+
+class Command(BaseCommand):
+    help = 'Delete expired sessions in small batches instead of one long DELETE.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--max-batches', type=int, default=None)
+        parser.add_argument('--max-seconds', type=float, default=None)
+        parser.add_argument('--pause', type=float, default=None, help='Seconds to sleep between batches.')
+
+    def handle(self, *args, **options):
+        def progress(stats):
+            self.stdout.write(f"{stats['purged']} purged in {stats['batches']} batches")
+
+        stats = purge_expired_sessions(
+            options['batch_size'],
+            options['max_batches'],
+            options['max_seconds'],
+            options['pause'],
+            progress if options['verbosity'] > 1 else None,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Purged {stats['purged']} expired sessions in {stats['batches']} batches, "
+            f"{stats['lock_seconds'] * 1000:.1f}ms holding the write lock "
+            f"(longest batch {stats['max_lock_seconds'] * 1000:.1f}ms, {stats['elapsed_seconds']:.1f}s total)"
+        ))
@@ -0,0 +1,50 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.relations import copy_edges, count_edges, prune_edges, repair_edges
+from accounts.sharding import get_relation_shards, get_next_relation_shards
+
+
+class Command(BaseCommand):
+    help = 'Copy follow edges into the RELATION_SHARDS_NEXT layout while the site keeps running, prune after the cutover, or repair the current layout.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--prune', action='store_true',
+            help='After switching RELATION_SHARDS, delete the copies every database holds that the layout places elsewhere.',
+        )
+        parser.add_argument(
+            '--repair', action='store_true',
+            help='Restore missing mirrors and delete stale copies in RELATION_SHARDS, e.g. after a write failed between two databases.',
+        )
+
+    def handle(self, *args, **options):
+        current, target = get_relation_shards(), get_next_relation_shards()
+
+        def progress(db, count):
+            if options['verbosity'] > 1:
+                self.stdout.write(f'{db}: {count}')
+
+        if options['repair']:
+            repaired = repair_edges(current, options['batch_size'], progress)
+            self.stdout.write(self.style.SUCCESS(f'Repaired {current or ["default"]}: deleted {repaired} stale copies'))
+            return
+
+        if options['prune']:
+            databases = list(settings.DATABASES)
+            pruned = prune_edges(current, databases, options['batch_size'], progress)
+            self.stdout.write(self.style.SUCCESS(f'Pruned {pruned} misplaced edges from {", ".join(databases)}'))
+            return
+
+        if target is None:
+            raise CommandError('Set RELATION_SHARDS_NEXT to the new layout (and deploy it) before copying')
+
+        copied = copy_edges(current, target, options['batch_size'], progress)
+        source_count, target_count = count_edges(current), count_edges(target)
+        self.stdout.write(self.style.SUCCESS(
+            f'Copied {copied} edges from {current or ["default"]} to {target or ["default"]}: '
+            f'{source_count} edges in the source layout, {target_count} in the target'
+        ))
+        if source_count != target_count:
+            self.stderr.write('Counts differ, writes may still be in flight: run the copy again before the cutover')
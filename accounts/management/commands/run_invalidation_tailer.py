@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from accounts.invalidation import get_transport, run_tailer, tail_outbox
+
+
+class Command(BaseCommand):
+    help = 'Fan committed cache invalidation events out of the outbox to every process.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=None, help='Seconds to wait when the outbox is empty.')
+        parser.add_argument('--once', action='store_true', help='Drain the outbox once and exit.')
+
+    def handle(self, *args, **options):
+        transport = type(get_transport()).__name__
+
+        if options['once']:
+            consumed = 0
+            while batch := tail_outbox():
+                consumed += batch
+            self.stdout.write(self.style.SUCCESS(f'Published {consumed} events through {transport}'))
+            return
+
+        self.stdout.write(f'Tailing the invalidation outbox through {transport}')
+        try:
+            run_tailer(options['interval'])
+        except KeyboardInterrupt:
+            pass
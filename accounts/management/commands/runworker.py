@@ -0,0 +1,41 @@
+import threading
+
+from django.core.management.base import BaseCommand
+
+from accounts.jobs import run_jobs, run_worker
+from utils.startup import start_background_threads
+
+
+class Command(BaseCommand):
+    help = 'Run deferred jobs from the job table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=1, help='Worker threads in this process.')
+        parser.add_argument('--interval', type=float, default=None, help='Seconds to wait when no job is due.')
+        parser.add_argument('--once', action='store_true', help='Run the jobs due now and exit.')
+
+    def handle(self, *args, **options):
+        if options['once']:
+            ran = 0
+            while batch := run_jobs():
+                ran += batch
+            self.stdout.write(self.style.SUCCESS(f'Ran {ran} jobs'))
+            return
+
+        # Its own worker threads are below
+        start_background_threads(jobs=False)
+        stop = threading.Event()
+        threads = [
+            threading.Thread(target=run_worker, args=(stop, None, options['interval']), name=f'job-worker-{index}', daemon=True)
+            for index in range(options['threads'])
+        ]
+        for thread in threads:
+            thread.start()
+
+        self.stdout.write(f"Running jobs in {options['threads']} threads")
+        try:
+            while any(thread.is_alive() for thread in threads):
+                for thread in threads:
+                    thread.join(1)
+        except KeyboardInterrupt:
+            stop.set()
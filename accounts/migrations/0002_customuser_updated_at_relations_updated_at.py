@@ -0,0 +1,24 @@
+# Generated by Django 5.2.7 on 2026-10-19 09:40
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='relations_updated_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.7 on 2026-10-19 09:50
+
+import django.core.validators
+import utils.paths
+import utils.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0005_relation_sharding'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('refcount', models.IntegerField(default=0)),
+                ('released_at', models.DateTimeField(blank=True, db_index=True, null=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='customuser',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=utils.storage.get_profile_image_storage, upload_to=utils.paths.get_user_profile_image_upload_path, validators=[django.core.validators.FileExtensionValidator(allowed_extensions=['png', 'jpg', 'jpeg', 'gif'])]),
+        ),
+    ]
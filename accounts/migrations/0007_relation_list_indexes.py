@@ -0,0 +1,42 @@
+# Generated by Django 5.2.7 on 2026-10-19 09:54
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0006_content_addressed_images'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='relation',
+            name='from_user',
+            field=models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='following', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='relation',
+            name='to_user',
+            field=models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='followers', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='relationmirror',
+            name='from_user',
+            field=models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='relation',
+            index=models.Index(fields=['to_user', '-created_at'], name='accounts_relation_to_created'),
+        ),
+        migrations.AddIndex(
+            model_name='relation',
+            index=models.Index(fields=['from_user', '-created_at'], name='accounts_relation_from_created'),
+        ),
+        migrations.AddIndex(
+            model_name='relationmirror',
+            index=models.Index(fields=['from_user', '-created_at'], name='accounts_mirror_from_created'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-19 10:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0008_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='last_seen',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
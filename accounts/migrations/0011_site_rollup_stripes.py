@@ -0,0 +1,27 @@
+# Generated by Django 5.2.7 on 2026-10-19 10:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0010_relation_bulk_user_delete'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sitefollowrollup',
+            name='stripe',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='sitefollowrollup',
+            name='day',
+            field=models.DateField(),
+        ),
+        migrations.AlterUniqueTogether(
+            name='sitefollowrollup',
+            unique_together={('day', 'stripe')},
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.7 on 2026-10-19 10:16
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0011_site_rollup_stripes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BulkRelation',
+            fields=[
+            ],
+            options={
+                'proxy': True,
+                'indexes': [],
+                'constraints': [],
+            },
+            bases=('accounts.relation',),
+        ),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 5.2.7 on 2026-10-19 10:44
+
+from collections import Counter
+
+import django.db.models.functions.text
+from django.conf import settings
+from django.db import migrations, models
+
+
+def count_followers(apps, schema_editor):
+    # From the edges on every database of the current layout: once sharded,
+    # the default database's relation table is no longer written
+    CustomUser = apps.get_model('accounts', 'CustomUser')
+    Relation = apps.get_model('accounts', 'Relation')
+    db = schema_editor.connection.alias
+    databases = list(getattr(settings, 'RELATION_SHARDS', [])) or [db]
+
+    last_pk = 0
+    while True:
+        user_ids = list(CustomUser.objects.using(db).filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:1000])
+        if not user_ids:
+            break
+        last_pk = user_ids[-1]
+
+        counts = Counter()
+        for edges_db in databases:
+            counts.update(dict(
+                Relation.objects.using(edges_db).filter(to_user_id__in=user_ids).order_by().values('to_user_id').annotate(
+                    count=models.Count('id'),
+                ).values_list('to_user_id', 'count')
+            ))
+        CustomUser.objects.using(db).bulk_update(
+            [CustomUser(pk=pk, followers_count=counts[pk]) for pk in user_ids if counts[pk]],
+            ['followers_count'],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0012_bulk_relation'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='followers_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_followers, migrations.RunPython.noop, hints={'model_name': 'customuser'}),
+        migrations.AddIndex(
+            model_name='customuser',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['-followers_count', 'id'], name='accounts_user_rank'),
+        ),
+        migrations.AddIndex(
+            model_name='customuser',
+            index=models.Index(django.db.models.functions.text.Lower('username'), name='accounts_user_username_lower'),
+        ),
+        migrations.AddIndex(
+            model_name='customuser',
+            index=models.Index(django.db.models.functions.text.Lower('email'), name='accounts_user_email_lower'),
+        ),
+        migrations.AddIndex(
+            model_name='customuser',
+            index=models.Index(django.db.models.functions.text.Lower('first_name'), name='accounts_user_first_lower'),
+        ),
+        migrations.AddIndex(
+            model_name='customuser',
+            index=models.Index(django.db.models.functions.text.Lower('last_name'), name='accounts_user_last_lower'),
+        ),
+    ]
@@ -1,16 +1,55 @@
-from django.db import models
-from django.urls import reverse
+from django.db import models, transaction
+from django.db.models.functions import Lower
+from django.utils import timezone
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser
 from django.core.validators import FileExtensionValidator
 from phonenumber_field.modelfields import PhoneNumberField
 
+from utils.activity import is_recently_seen
 from utils.paths import get_user_profile_image_upload_path
+from utils.storage import get_profile_image_storage
 from utils.validators import UsernameValidator, NameValidator
+from utils.url_builder import get_url_builder
+from .sharding import EdgeUserList, get_shard, is_relation_sharded
 
 
 User = settings.AUTH_USER_MODEL
 
+account_urls = get_url_builder('accounts', 'accounts.urls')
+
+
+class UserUrls:
+    # attribute -> (URL name, whether it takes the username)
+    routes = {
+        'detail': ('accounts:user-detail', True),
+        'update': ('accounts:user-update', False),
+        'delete': ('accounts:user-delete', False),
+        'profile_image_delete': ('accounts:user-profile-image-delete', False),
+        'follow': ('accounts:user-follow', True),
+        'unfollow': ('accounts:user-unfollow', True),
+        'events': ('accounts:user-events', True),
+        'follower_list': ('accounts:user-follower-list', True),
+        'following_list': ('accounts:user-following-list', True),
+        'follower_export': ('accounts:user-follower-export', True),
+        'following_export': ('accounts:user-following-export', True),
+    }
+
+    __slots__ = ['user']
+
+    def __init__(self, user):
+        self.user = user
+
+    def __getattr__(self, attr):
+        try:
+            name, with_username = self.routes[attr]
+        except KeyError:
+            raise AttributeError(attr)
+        
+        if with_username:
+            return account_urls.build(name, self.user.username)
+        return account_urls.build(name)
+
 
 class CustomUser(AbstractUser):
     username = models.CharField(
@@ -44,10 +83,18 @@ class CustomUser(AbstractUser):
     )
     image = models.ImageField(
         upload_to=get_user_profile_image_upload_path,
+        storage=get_profile_image_storage,
         blank=True,
         null=True,
         validators=[FileExtensionValidator(allowed_extensions=['png', 'jpg', 'jpeg', 'gif'])],
     )
+    updated_at = models.DateTimeField(auto_now=True)
+    relations_updated_at = models.DateTimeField(default=timezone.now)
+    # Written in batches by utils.activity, up to a flush interval behind
+    last_seen = models.DateTimeField(null=True, blank=True)
+    # Kept with every follow and unfollow by accounts.rollups, ranks the
+    # people list without counting edges
+    followers_count = models.IntegerField(default=0, editable=False)
 
     REQUIRED_FIELDS = ['email', 'first_name', 'last_name', 'phone_number']
 
@@ -55,61 +102,247 @@ class CustomUser(AbstractUser):
         ordering = ['username']
         verbose_name = 'User'
         verbose_name_plural = 'Users'
+        indexes = [
+            # The people list, walked in rank order a page at a time
+            models.Index(fields=['-followers_count', 'id'], condition=models.Q(is_active=True), name='accounts_user_rank'),
+            # Prefix searches, see accounts.search.get_search_filter
+            models.Index(Lower('username'), name='accounts_user_username_lower'),
+            models.Index(Lower('email'), name='accounts_user_email_lower'),
+            models.Index(Lower('first_name'), name='accounts_user_first_lower'),
+            models.Index(Lower('last_name'), name='accounts_user_last_lower'),
+        ]
     
     def __str__(self):
         return self.username
+
+    def save(self, *args, **kwargs):
+        # The post_save receivers write the invalidation outbox row, which
+        # must commit with the change itself (see accounts.invalidation.emit)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
     
     # ----- URLS -----
 
+    @property
+    def urls(self):
+        return UserUrls(self)
+
     def get_absolute_url(self):
-        return reverse('accounts:user-detail', args=[self.username])
+        return self.urls.detail
     
     def get_update_url(self):
-        return reverse('accounts:user-update')
+        return self.urls.update
     
     def get_delete_url(self):
-        return reverse('accounts:user-delete')
+        return self.urls.delete
     
     def get_profile_image_delete_url(self):
-        return reverse('accounts:user-profile-image-delete')
+        return self.urls.profile_image_delete
     
     def get_follow_url(self):
-        return reverse('accounts:user-follow', args=[self.username])
+        return self.urls.follow
     
     def get_unfollow_url(self):
-        return reverse('accounts:user-unfollow', args=[self.username])
+        return self.urls.unfollow
+    
+    def get_events_url(self):
+        return self.urls.events
     
     def get_follower_list_url(self):
-        return reverse('accounts:user-follower-list', args=[self.username])
+        return self.urls.follower_list
     
     def get_following_list_url(self):
-        return reverse('accounts:user-following-list', args=[self.username])
+        return self.urls.following_list
+
+    def get_follower_export_url(self):
+        return self.urls.follower_export
+
+    def get_following_export_url(self):
+        return self.urls.following_export
 
     # ----- COUNTS -----
 
     def get_followers_count(self):
-        return self.followers.count()
+        return Relation.objects.followers_of(self.pk).count()
     
     def get_following_count(self):
-        return self.following.count()
+        return Relation.objects.following_of(self.pk).count()
+
+    @property
+    def is_online(self):
+        return is_recently_seen(self.last_seen)
+
+    def get_mutual_connections(self, viewer):
+        # Users viewer follows who follow this user, see accounts.mutuals
+        from .mutuals import get_mutual_connections
+        return get_mutual_connections(viewer.pk, self.pk)
 
     # ----- LISTS -----
 
+    # Newest follow first, walking the (user, -created_at) edge indexes and
+    # joining users by primary key. Edges on a shard can't be joined, a page
+    # of them is read first and then its users (see EdgeUserList).
+
     def get_follower_list(self):
-        return CustomUser.objects.filter(following__to_user=self)
+        if is_relation_sharded():
+            return EdgeUserList(Relation.objects.followers_of(self.pk), 'from_user_id', CustomUser.objects.filter(is_active=True))
+        return CustomUser.objects.filter(following__to_user_id=self.pk, is_active=True).order_by('-following__created_at')
 
     def get_following_list(self):
-        return CustomUser.objects.filter(followers__from_user=self)
+        if is_relation_sharded():
+            return EdgeUserList(Relation.objects.following_of(self.pk), 'to_user_id', CustomUser.objects.filter(is_active=True))
+        return CustomUser.objects.filter(followers__from_user_id=self.pk, is_active=True).order_by('-followers__created_at')
+
+
+class RelationManager(models.Manager):
+    # Follower side edges live on the shard of to_user, their mirrors on the
+    # shard of from_user; unsharded, both directions read this table.
+
+    def followers_of(self, user_id):
+        return self.using(get_shard(user_id)).filter(to_user_id=user_id)
+
+    def following_of(self, user_id):
+        if is_relation_sharded():
+            return RelationMirror.objects.using(get_shard(user_id)).filter(from_user_id=user_id)
+        return self.filter(from_user_id=user_id)
+
+    def between(self, from_user_id, to_user_id):
+        return self.followers_of(to_user_id).filter(from_user_id=from_user_id)
+
+    def create(self, **kwargs):
+        # Model.save() routes by the instance (QuerySet.create() can't)
+        relation = self.model(**kwargs)
+        relation.save(force_insert=True)
+        return relation
 
 
 class Relation(models.Model):
-    from_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='following')
-    to_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='followers')
-    created_at = models.DateTimeField(auto_now_add=True)
+    # No database level foreign keys: on a shard the users table is elsewhere.
+    # No single column indexes either, both are prefixes of the ones below.
+    # Deleting a user removes its edges in bulk (accounts.signals.user_deleting)
+    # instead of a per-edge cascade.
+    from_user = models.ForeignKey(User, on_delete=models.DO_NOTHING, related_name='following', db_constraint=False, db_index=False)
+    to_user = models.ForeignKey(User, on_delete=models.DO_NOTHING, related_name='followers', db_constraint=False, db_index=False)
+    # Not auto_now_add: edges copied between shards keep their follow time
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+
+    objects = RelationManager()
 
     class Meta:
         ordering = ['-created_at']
         unique_together = ['from_user', 'to_user']
+        # Follower/following lists read a user's edges newest first
+        indexes = [
+            models.Index(fields=['to_user', '-created_at'], name='accounts_relation_to_created'),
+            models.Index(fields=['from_user', '-created_at'], name='accounts_relation_from_created'),
+        ]
     
     def __str__(self):
         return f"{self.from_user} followed {self.to_user}"
+
+    def save(self, *args, **kwargs):
+        # Same as CustomUser.save(), with the copies on the shards in the same
+        # transactions (see accounts.relations.edge_transaction)
+        from .relations import edge_transaction
+        with edge_transaction([self], using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        from .relations import edge_transaction
+        with edge_transaction([self], using=kwargs.get('using')):
+            return super().delete(*args, **kwargs)
+
+
+class BulkRelation(Relation):
+    # The Relation table without its signal receivers, for accounts.relations'
+    # bulk writes: they do the bookkeeping once per batch, and deletes through
+    # it are a single DELETE instead of loading and signalling every row.
+    class Meta:
+        proxy = True
+
+
+class RelationMirror(models.Model):
+    from_user = models.ForeignKey(User, on_delete=models.DO_NOTHING, related_name='+', db_constraint=False, db_index=False)
+    to_user = models.ForeignKey(User, on_delete=models.DO_NOTHING, related_name='+', db_constraint=False)
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        ordering = ['-created_at']
+        unique_together = ['from_user', 'to_user']
+        indexes = [
+            models.Index(fields=['from_user', '-created_at'], name='accounts_mirror_from_created'),
+        ]
+
+    def __str__(self):
+        return f"{self.from_user_id} follows {self.to_user_id}"
+
+
+class FollowerRollup(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='follower_rollups')
+    day = models.DateField()
+    gained = models.PositiveIntegerField(default=0)
+    lost = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ['user', 'day']
+
+    def __str__(self):
+        return f"{self.user_id} {self.day}: +{self.gained} -{self.lost}"
+
+
+class SiteFollowRollup(models.Model):
+    # A day's counts are spread over SITE_ROLLUP_STRIPES rows, summed when
+    # read, so concurrent follows don't all wait on the same row lock
+    day = models.DateField()
+    stripe = models.PositiveSmallIntegerField(default=0)
+    gained = models.PositiveIntegerField(default=0)
+    lost = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ['day', 'stripe']
+
+    def __str__(self):
+        return f"{self.day}/{self.stripe}: +{self.gained} -{self.lost}"
+
+
+class ChangeEvent(models.Model):
+    tags = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.pk}: {', '.join(self.tags)}"
+
+
+class StoredFile(models.Model):
+    # Reference count of a content addressed file (see accounts.images);
+    # files at zero for a while are removed by the background sweep.
+    name = models.CharField(max_length=255, unique=True)
+    refcount = models.IntegerField(default=0)
+    released_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.refcount})"
+
+
+class Job(models.Model):
+    # Deferred work, see accounts.jobs. A claimed job's run_at is pushed out
+    # by the lease, so a worker that dies leaves it to be claimed again.
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    priority = models.SmallIntegerField(default=0)
+    # At most one pending job per key (e.g. a sweep that covers everything)
+    key = models.CharField(max_length=200, unique=True, null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=32, blank=True)
+    last_error = models.TextField(blank=True)
+    failed_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-priority', 'run_at'], condition=models.Q(failed_at=None), name='accounts_job_ready'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.pk}"
@@ -0,0 +1,102 @@
+import threading
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+
+from utils.cache import TaggedCache
+from .models import Relation
+from .invalidation import register_cache, get_relation_tags
+
+
+User = get_user_model()
+
+
+class MutualConnections:
+    # "Followed by alice, bob and 12 others you follow": a sample of the users
+    # the viewer follows who follow the target, and how many there are. When
+    # the probe hit its cap, count is a lower bound and exact is False.
+
+    def __init__(self, usernames, count, exact):
+        self.usernames = usernames
+        self.count = count
+        self.exact = exact
+
+    def __bool__(self):
+        return bool(self.count)
+
+    @property
+    def others(self):
+        return self.count - len(self.usernames)
+
+
+def get_bounded_count(queryset, limit):
+    # COUNT over at most limit rows, however many there are
+    return queryset.order_by().values('pk')[:limit].count()
+
+
+def find_mutual_ids(viewer_id, target_id, max_probe, chunk_size=500):
+    # Walks the smaller of the viewer's following and the target's followers
+    # and probes each chunk of ids against the other side's (from_user,
+    # to_user) unique index. Returns (ids, exact).
+    following = Relation.objects.following_of(viewer_id)
+    followers = Relation.objects.followers_of(target_id)
+
+    if get_bounded_count(following, max_probe + 1) <= get_bounded_count(followers, max_probe + 1):
+        side = following.values_list('to_user_id', flat=True)
+
+        def probe(ids):
+            return followers.filter(from_user_id__in=ids).values_list('from_user_id', flat=True)
+    else:
+        side = followers.values_list('from_user_id', flat=True)
+
+        def probe(ids):
+            return following.filter(to_user_id__in=ids).values_list('to_user_id', flat=True)
+
+    ids, probed = [], 0
+    while probed < max_probe:
+        size = min(chunk_size, max_probe - probed)
+        chunk = list(side[probed:probed + size])
+
+        found = set(probe(chunk)) if chunk else set()
+        # Deactivated accounts wait for the delete_users job with their edges
+        if found:
+            found -= set(User.objects.filter(pk__in=found, is_active=False).values_list('pk', flat=True))
+        # Keep the walk's order (newest edge first) for the sample
+        ids.extend(user_id for user_id in chunk if user_id in found)
+        probed += len(chunk)
+        if len(chunk) < size:
+            return ids, True
+    return ids, not side[probed:probed + 1].exists()
+
+
+_mutuals_cache = None
+_mutuals_cache_lock = threading.Lock()
+
+
+def get_mutuals_cache():
+    global _mutuals_cache
+
+    with _mutuals_cache_lock:
+        if _mutuals_cache is None:
+            _mutuals_cache = register_cache(TaggedCache(
+                max_entries=getattr(settings, 'MUTUALS_CACHE_MAX_ENTRIES', 10_000),
+                timeout=getattr(settings, 'MUTUALS_CACHE_TIMEOUT', 600),
+            ))
+    return _mutuals_cache
+
+
+def get_mutual_connections(viewer_id, target_id, sample_size=None):
+    sample_size = sample_size or getattr(settings, 'MUTUALS_SAMPLE_SIZE', 2)
+    cache = get_mutuals_cache()
+    key = (viewer_id, target_id, sample_size)
+
+    mutuals = cache.get(key)
+    if mutuals is None:
+        ids, exact = find_mutual_ids(viewer_id, target_id, getattr(settings, 'MUTUALS_MAX_PROBE', 5000))
+        names = dict(User.objects.filter(pk__in=ids[:sample_size]).values_list('pk', 'username'))
+        mutuals = MutualConnections([names[pk] for pk in ids[:sample_size] if pk in names], len(ids), exact)
+
+        # Either side following or unfollowing anyone, or a sampled user renamed
+        tags = get_relation_tags(viewer_id, target_id) + [f'user:{pk}' for pk in names]
+        cache.set(key, mutuals, tags=tags)
+    return mutuals
@@ -0,0 +1,441 @@
+from collections import defaultdict
+from functools import partial
+
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from .models import Relation, BulkRelation, RelationMirror
+from .events import publish_relation_event
+from .rollups import record_follows, record_unfollows
+from .invalidation import emit, get_relation_tags
+from .sharding import atomic, get_shard, get_databases, get_write_layouts, is_relation_sharded
+
+
+User = get_user_model()
+
+
+def touch_relations(*user_ids, batch_size=500):
+    now = timezone.now()
+    user_ids = list(user_ids)
+
+    for start in range(0, len(user_ids), batch_size):
+        User.objects.filter(pk__in=user_ids[start:start + batch_size]).update(relations_updated_at=now)
+
+
+def touch_relation_lists(user_id, batch_size=500):
+    # Job behind accounts.signals.user_changed: the users whose lists show
+    # user_id, walked in keyset batches of its edges
+    for edges, field in [(Relation.objects.followers_of(user_id), 'from_user_id'), (Relation.objects.following_of(user_id), 'to_user_id')]:
+        last_pk = 0
+
+        while True:
+            rows = list(edges.filter(pk__gt=last_pk).order_by('pk').values_list('pk', field)[:batch_size])
+            if not rows:
+                break
+            last_pk = rows[-1][0]
+            touch_relations(*[other_id for pk, other_id in rows], batch_size=batch_size)
+
+
+# ----- EDGE STORAGE -----
+
+def get_edge_targets(relation, layouts):
+    for shards in layouts:
+        yield BulkRelation, get_shard(relation.to_user_id, shards)
+        if shards:
+            yield RelationMirror, get_shard(relation.from_user_id, shards)
+
+
+def get_primary_target(relation):
+    # The follower side copy in the current layout, the one reads trust
+    return BulkRelation, get_shard(relation.to_user_id)
+
+
+def edge_transaction(relations, using=None):
+    # One transaction on every database the edges are written to, entered so
+    # that they commit primary copies first, then the mirrors and next layout
+    # copies, then default (rollups, relations_updated_at, the outbox). There
+    # is no two-phase commit across them: a failed commit keeps the earlier
+    # ones, at worst an edge without its mirror or without its bookkeeping,
+    # never an invalidation before the edge it announces. `manage.py
+    # reshard_relations --repair` puts the copies back in line.
+    primary = {using or get_primary_target(relation)[1] for relation in relations}
+    copies = {db for relation in relations for model, db in get_edge_targets(relation, get_write_layouts())}
+    return atomic([DEFAULT_DB_ALIAS, *(copies - primary), *primary])
+
+
+def group_edges(relations, layouts=None, exclude=()):
+    # (model, database) -> {(from_user_id, to_user_id): relation}, over every
+    # layout being written to. `exclude` holds the copies the caller wrote.
+    groups = defaultdict(dict)
+
+    for relation in relations:
+        for target in get_edge_targets(relation, get_write_layouts() if layouts is None else layouts):
+            if target not in exclude:
+                groups[target][(relation.from_user_id, relation.to_user_id)] = relation
+    return groups
+
+
+def save_edges(relations, layouts=None, exclude=()):
+    for (model, db), edges in group_edges(relations, layouts, exclude).items():
+        model.objects.using(db).bulk_create([
+            model(from_user_id=from_id, to_user_id=to_id, created_at=relation.created_at)
+            for (from_id, to_id), relation in edges.items()
+        ], ignore_conflicts=True)
+
+
+def get_pairs_filter(pairs):
+    # (from_user_id, to_user_id) pairs as one to_user_id IN (...) per follower
+    to_user_ids = defaultdict(list)
+    for from_id, to_id in pairs:
+        to_user_ids[from_id].append(to_id)
+
+    query = Q()
+    for from_id, to_ids in to_user_ids.items():
+        query |= Q(from_user_id=from_id, to_user_id__in=to_ids)
+    return query
+
+
+def delete_edges(relations, layouts=None, exclude=(), batch_size=500):
+    for (model, db), edges in group_edges(relations, layouts, exclude).items():
+        keys = list(edges)
+        for start in range(0, len(keys), batch_size):
+            # Neither model has receivers: one DELETE per batch
+            model.objects.using(db).filter(get_pairs_filter(keys[start:start + batch_size])).delete()
+
+
+def group_primary_edges(relations):
+    groups = defaultdict(list)
+    for relation in relations:
+        groups[get_primary_target(relation)].append(relation)
+    return groups
+
+
+def insert_new_edges(relations, batch_size=500):
+    # One INSERT OR IGNORE per batch of primary copies on each database, then
+    # the rows carrying these relations' created_at are read back: those are
+    # the new ones, a pair followed concurrently is skipped, not counted twice
+    inserted = []
+
+    for (model, db), group in group_primary_edges(relations).items():
+        for start in range(0, len(group), batch_size):
+            batch = group[start:start + batch_size]
+            model.objects.using(db).bulk_create([
+                model(from_user_id=relation.from_user_id, to_user_id=relation.to_user_id, created_at=relation.created_at)
+                for relation in batch
+            ], ignore_conflicts=True)
+
+            rows = set(model.objects.using(db).filter(
+                get_pairs_filter((relation.from_user_id, relation.to_user_id) for relation in batch),
+            ).order_by().values_list('from_user_id', 'to_user_id', 'created_at'))
+            inserted.extend(
+                relation for relation in batch
+                if (relation.from_user_id, relation.to_user_id, relation.created_at) in rows
+            )
+
+    save_edges(inserted, exclude={get_primary_target(relation) for relation in inserted})
+    return inserted
+
+
+def delete_existing_edges(relations, batch_size=500):
+    # Per batch of primary copies on each database, the pairs still there are
+    # locked and read, then deleted in one DELETE: a pair unfollowed
+    # concurrently is only counted once
+    deleted = []
+
+    for (model, db), group in group_primary_edges(relations).items():
+        for start in range(0, len(group), batch_size):
+            batch = group[start:start + batch_size]
+
+            with transaction.atomic(using=db):
+                rows = {
+                    (from_id, to_id): pk
+                    for pk, from_id, to_id in model.objects.using(db).select_for_update().filter(
+                        get_pairs_filter((relation.from_user_id, relation.to_user_id) for relation in batch),
+                    ).order_by().values_list('pk', 'from_user_id', 'to_user_id')
+                }
+                model.objects.using(db).filter(pk__in=rows.values()).delete()
+
+            deleted.extend(
+                relation for relation in batch
+                if (relation.from_user_id, relation.to_user_id) in rows
+            )
+
+    delete_edges(deleted, exclude={get_primary_target(relation) for relation in deleted})
+    return deleted
+
+
+def get_existing_pairs(pairs, shards=None):
+    by_db = defaultdict(set)
+    for from_id, to_id in pairs:
+        by_db[get_shard(to_id, shards)].add((from_id, to_id))
+
+    existing = set()
+    for db, group in by_db.items():
+        existing.update(Relation.objects.using(db).filter(
+            from_user_id__in={from_id for from_id, to_id in group},
+            to_user_id__in={to_id for from_id, to_id in group},
+        ).order_by().values_list('from_user_id', 'to_user_id'))
+    return existing
+
+
+def iter_user_edges(user_id, batch_size=500):
+    # Every edge of user_id, both directions, in keyset batches of Relations
+    # along the (user, -created_at) indexes
+    for edges in (Relation.objects.followers_of(user_id), Relation.objects.following_of(user_id)):
+        edges = edges.order_by('-created_at', '-pk')
+        last = None
+
+        while True:
+            batch = edges
+            if last is not None:
+                batch = batch.filter(Q(created_at__lt=last[0]) | Q(created_at=last[0], pk__lt=last[1]))
+            rows = list(batch.values_list('created_at', 'pk', 'from_user_id', 'to_user_id')[:batch_size])
+            if not rows:
+                break
+            last = rows[-1][:2]
+            yield [
+                Relation(from_user_id=from_id, to_user_id=to_id, created_at=created_at)
+                for created_at, pk, from_id, to_id in rows
+            ]
+
+
+def get_remote_targets(relations):
+    return {(model, db) for model, db in group_edges(relations) if db != DEFAULT_DB_ALIAS}
+
+
+def delete_user_edges(user_id, batch_size=500):
+    # Every edge of a user being deleted, both copies in every layout being
+    # written to, with the bookkeeping (and events) done once per batch.
+    remote = False
+
+    for relations in iter_user_edges(user_id, batch_size):
+        record_bulk_unfollows(relations)
+        targets = get_remote_targets(relations)
+        delete_edges(relations, exclude=targets)
+        remote = remote or bool(targets)
+
+    # Copies on a shard go once the deletion committed: a failure there leaves
+    # edges to a missing user, which the lists skip and --repair removes, and
+    # never a user whose edges are gone
+    if remote:
+        transaction.on_commit(partial(delete_remote_user_edges, user_id, batch_size), robust=True)
+
+
+def delete_remote_user_edges(user_id, batch_size=500):
+    for relations in iter_user_edges(user_id, batch_size):
+        local = set(group_edges(relations)) - get_remote_targets(relations)
+        delete_edges(relations, exclude=local)
+
+
+# Bulk writes skip the per-instance Relation signals, these do the same
+# bookkeeping once per batch.
+
+def get_user_ids(relations):
+    return {user_id for relation in relations for user_id in (relation.from_user_id, relation.to_user_id)}
+
+
+def record_bulk_follows(relations):
+    user_ids = get_user_ids(relations)
+    touch_relations(*user_ids)
+    emit(get_relation_tags(*user_ids))
+    record_follows(relations)
+    transaction.on_commit(lambda: [publish_relation_event('follow', relation) for relation in relations])
+
+
+def record_bulk_unfollows(relations):
+    user_ids = get_user_ids(relations)
+    touch_relations(*user_ids)
+    emit(get_relation_tags(*user_ids))
+    record_unfollows(relations)
+    transaction.on_commit(lambda: [publish_relation_event('unfollow', relation) for relation in relations])
+
+
+def resolve_targets(user, usernames):
+    # One query; the viewer is excluded in SQL rather than checked per target
+    targets = {
+        target.username: target
+        for target in User.objects.filter(username__in=usernames).exclude(pk=user.pk).order_by()
+    }
+    results = {}
+
+    for username in usernames:
+        if username == user.username:
+            results[username] = 'self'
+        elif username not in targets:
+            results[username] = 'not_found'
+    return targets, results
+
+
+def bulk_follow(user, usernames):
+    targets, results = resolve_targets(user, usernames)
+    following = set(Relation.objects.following_of(user.pk).filter(
+        to_user_id__in=[target.pk for target in targets.values()],
+    ).values_list('to_user_id', flat=True))
+
+    now = timezone.now()
+    relations = []
+    for username, target in targets.items():
+        if target.pk in following:
+            results[username] = 'already_following'
+        else:
+            relations.append(Relation(from_user=user, to_user=target, created_at=now))
+
+    if relations:
+        with edge_transaction(relations):
+            inserted = insert_new_edges(relations)
+            if inserted:
+                record_bulk_follows(inserted)
+
+        inserted = {relation.to_user_id for relation in inserted}
+        for relation in relations:
+            results[relation.to_user.username] = 'followed' if relation.to_user_id in inserted else 'already_following'
+    return {username: results[username] for username in usernames}
+
+
+def bulk_unfollow(user, usernames):
+    targets, results = resolve_targets(user, usernames)
+    relations = list(Relation.objects.following_of(user.pk).filter(
+        to_user_id__in=[target.pk for target in targets.values()],
+    ).order_by().only('pk', 'from_user_id', 'to_user_id', 'created_at'))
+    targets_by_pk = {target.pk: target for target in targets.values()}
+    for relation in relations:
+        relation.from_user = user
+        relation.to_user = targets_by_pk[relation.to_user_id]
+
+    if relations:
+        with edge_transaction(relations):
+            relations = delete_existing_edges(relations)
+            if relations:
+                record_bulk_unfollows(relations)
+
+    unfollowed = {relation.to_user_id for relation in relations}
+    for username, target in targets.items():
+        results[username] = 'unfollowed' if target.pk in unfollowed else 'not_following'
+    return {username: results[username] for username in usernames}
+
+
+# ----- RESHARDING -----
+
+def copy_edges(source, target, batch_size=1000, progress=None):
+    # Online copy of every edge from the source layout into the target one,
+    # in keyset batches over the follower side. Meanwhile follows and
+    # unfollows are written to both layouts (RELATION_SHARDS_NEXT), so the
+    # only race left is an unfollow between reading a batch and writing it:
+    # every batch is rechecked against the source afterwards.
+    copied = 0
+
+    for db in get_databases(source):
+        last_pk = 0
+
+        while True:
+            relations = list(Relation.objects.using(db).filter(pk__gt=last_pk).order_by('pk')[:batch_size])
+            if not relations:
+                break
+            last_pk = relations[-1].pk
+            # Copies a reused database already got from this run aren't its own
+            relations = [relation for relation in relations if get_shard(relation.to_user_id, source) == db]
+
+            save_edges(relations, [target])
+            live = set(Relation.objects.using(db).filter(
+                pk__in=[relation.pk for relation in relations],
+            ).values_list('pk', flat=True))
+            gone = [relation for relation in relations if relation.pk not in live]
+            if gone:
+                delete_edges(gone, [target])
+
+            copied += len(relations) - len(gone)
+            if progress:
+                progress(db, copied)
+    return copied
+
+
+def is_placed(model, user_id, db, shards):
+    if model is RelationMirror and not is_relation_sharded(shards):
+        return False
+    return get_shard(user_id, shards) == db
+
+
+def prune_edges(shards, databases, batch_size=1000, progress=None):
+    # After the cutover: drop every copy the given databases hold that the
+    # layout places elsewhere, including the unsharded table on default.
+    pruned = 0
+
+    for db in databases:
+        for model, shard_key in [(BulkRelation, 'to_user_id'), (RelationMirror, 'from_user_id')]:
+            last_pk = 0
+
+            while True:
+                rows = list(model.objects.using(db).filter(pk__gt=last_pk).order_by('pk').values_list('pk', shard_key)[:batch_size])
+                if not rows:
+                    break
+                last_pk = rows[-1][0]
+
+                misplaced = [pk for pk, user_id in rows if not is_placed(model, user_id, db, shards)]
+                if misplaced:
+                    model.objects.using(db).filter(pk__in=misplaced).delete()
+                    pruned += len(misplaced)
+                if progress:
+                    progress(db, pruned)
+    return pruned
+
+
+def repair_edges(shards, batch_size=1000, progress=None):
+    # Puts the copies of a layout back in line after a commit failed halfway
+    # (see edge_transaction): edges of deleted users go, every follower side
+    # edge gets its mirror and mirrors without one are dropped. Returns the
+    # number of copies deleted.
+    repaired = 0
+
+    for db in get_databases(shards):
+        last_pk = 0
+
+        while True:
+            relations = list(BulkRelation.objects.using(db).filter(pk__gt=last_pk).order_by('pk')[:batch_size])
+            if not relations:
+                break
+            last_pk = relations[-1].pk
+
+            users = set(User.objects.filter(pk__in=get_user_ids(relations)).values_list('pk', flat=True))
+            orphans = [relation for relation in relations if not {relation.from_user_id, relation.to_user_id} <= users]
+            if orphans:
+                delete_edges(orphans, [shards])
+                repaired += len(orphans)
+
+            orphan_pks = {relation.pk for relation in orphans}
+            save_edges([relation for relation in relations if relation.pk not in orphan_pks], [shards], exclude={(BulkRelation, db)})
+            if progress:
+                progress(db, repaired)
+
+    if not is_relation_sharded(shards):
+        return repaired
+
+    for db in dict.fromkeys(shards):
+        last_pk = 0
+
+        while True:
+            rows = list(RelationMirror.objects.using(db).filter(pk__gt=last_pk).order_by('pk').values_list('pk', 'from_user_id', 'to_user_id')[:batch_size])
+            if not rows:
+                break
+            last_pk = rows[-1][0]
+
+            live = get_existing_pairs({(from_id, to_id) for pk, from_id, to_id in rows}, shards)
+            stale = [pk for pk, from_id, to_id in rows if (from_id, to_id) not in live]
+            if stale:
+                RelationMirror.objects.using(db).filter(pk__in=stale).delete()
+                repaired += len(stale)
+            if progress:
+                progress(db, repaired)
+    return repaired
+
+
+def count_edges(shards):
+    # Follower side edges the layout places where they are, so a layout that
+    # reuses databases of the old one isn't counted twice before the prune
+    total = 0
+
+    for db in get_databases(shards):
+        rows = Relation.objects.using(db).order_by().values_list('to_user_id').annotate(count=Count('id'))
+        total += sum(count for user_id, count in rows if get_shard(user_id, shards) == db)
+    return total
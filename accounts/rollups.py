@@ -0,0 +1,237 @@
+import datetime
+import random
+import threading
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Relation, FollowerRollup, SiteFollowRollup
+from .sharding import get_databases
+
+
+User = get_user_model()
+
+# Users in the middle of being deleted: their cascaded relations must not
+# recreate rollup rows the deletion is about to remove.
+_deleting = threading.local()
+
+
+def get_deleting_user_ids():
+    if not hasattr(_deleting, 'ids'):
+        _deleting.ids = set()
+    return _deleting.ids
+
+
+def increment(model, lookup, field, amount=1):
+    if model.objects.filter(**lookup).update(**{field: F(field) + amount}):
+        return
+
+    try:
+        with transaction.atomic():
+            model.objects.create(**lookup, **{field: amount})
+    except IntegrityError:
+        model.objects.filter(**lookup).update(**{field: F(field) + amount})
+
+
+def increment_site(day, field, amount):
+    # A random stripe of the day's rows, see SiteFollowRollup
+    stripe = random.randrange(max(getattr(settings, 'SITE_ROLLUP_STRIPES', 8), 1))
+    increment(SiteFollowRollup, {'day': day, 'stripe': stripe}, field, amount)
+
+
+def increment_followers(day, field, counts, batch_size=500):
+    # {user_id: amount} on one day: the missing rows are inserted at zero,
+    # then one UPDATE per distinct amount (nearly always just 1) and batch
+    if len(counts) == 1:
+        [(user_id, amount)] = counts.items()
+        increment(FollowerRollup, {'user_id': user_id, 'day': day}, field, amount)
+        return
+
+    FollowerRollup.objects.bulk_create(
+        [FollowerRollup(user_id=user_id, day=day) for user_id in counts],
+        batch_size=batch_size,
+        ignore_conflicts=True,
+    )
+
+    by_amount = defaultdict(list)
+    for user_id, amount in counts.items():
+        by_amount[amount].append(user_id)
+
+    for amount, user_ids in by_amount.items():
+        for start in range(0, len(user_ids), batch_size):
+            FollowerRollup.objects.filter(
+                user_id__in=user_ids[start:start + batch_size],
+                day=day,
+            ).update(**{field: F(field) + amount})
+
+
+def update_followers_counts(counts, sign, batch_size=500):
+    # CustomUser.followers_count of {user_id: amount}, one UPDATE per distinct
+    # amount and batch
+    by_amount = defaultdict(list)
+    for user_id, amount in counts.items():
+        by_amount[amount].append(user_id)
+
+    for amount, user_ids in by_amount.items():
+        for start in range(0, len(user_ids), batch_size):
+            User.objects.filter(pk__in=user_ids[start:start + batch_size]).update(
+                followers_count=F('followers_count') + sign * amount,
+            )
+
+
+def record_follows(relations):
+    gained = defaultdict(Counter)
+    for relation in relations:
+        gained[timezone.localdate(relation.created_at)][relation.to_user_id] += 1
+
+    for day, counts in gained.items():
+        increment_followers(day, 'gained', counts)
+        increment_site(day, 'gained', counts.total())
+    update_followers_counts(sum(gained.values(), Counter()), 1)
+
+
+def record_unfollows(relations):
+    day = timezone.localdate()
+    deleting = get_deleting_user_ids()
+    lost = Counter(relation.to_user_id for relation in relations if relation.to_user_id not in deleting)
+
+    if lost:
+        increment_followers(day, 'lost', lost)
+        update_followers_counts(lost, -1)
+    if relations:
+        increment_site(day, 'lost', len(relations))
+
+
+def record_follow(relation):
+    record_follows([relation])
+
+
+def record_unfollow(relation):
+    record_unfollows([relation])
+
+
+# ----- QUERIES -----
+
+def get_period_start(day, period):
+    if period == 'week':
+        return day - datetime.timedelta(days=day.weekday())
+    return day
+
+
+def build_series(rows, start, end, period):
+    buckets = {}
+    day = get_period_start(start, period)
+    step = datetime.timedelta(days=7 if period == 'week' else 1)
+
+    while day <= end:
+        buckets[day] = [0, 0]
+        day += step
+
+    for day, gained, lost in rows:
+        bucket = buckets[get_period_start(day, period)]
+        bucket[0] += gained
+        bucket[1] += lost
+
+    return [
+        {'day': day, 'gained': gained, 'lost': lost, 'net': gained - lost}
+        for day, (gained, lost) in buckets.items()
+    ]
+
+
+def get_follower_series(user, start, end, period='day'):
+    # One range scan over the (user, day) unique index
+    rows = FollowerRollup.objects.filter(
+        user=user,
+        day__range=(start, end),
+    ).order_by('day').values_list('day', 'gained', 'lost')
+    return build_series(rows, start, end, period)
+
+
+def get_site_follow_series(start, end, period='day'):
+    rows = SiteFollowRollup.objects.filter(
+        day__range=(start, end),
+    ).order_by('day').values('day').annotate(
+        gained=Sum('gained'),
+        lost=Sum('lost'),
+    ).values_list('day', 'gained', 'lost')
+    return build_series(rows, start, end, period)
+
+
+# ----- BACKFILL -----
+
+def merge_gained(model, counts, key_fields):
+    # Keep whichever is larger: follows whose relation was deleted since are
+    # only known to the incremental rollups, not to the Relation table.
+    if not counts:
+        return
+
+    lookup = {f'{field}__in': {key[index] for key in counts} for index, field in enumerate(key_fields)}
+    existing = {
+        tuple(getattr(row, field) for field in key_fields): row
+        for row in model.objects.filter(**lookup)
+    }
+
+    to_create, to_update = [], []
+    for key, gained in counts.items():
+        row = existing.get(key)
+        if row is None:
+            to_create.append(model(**dict(zip(key_fields, key)), gained=gained))
+        elif gained > row.gained:
+            row.gained = gained
+            to_update.append(row)
+
+    model.objects.bulk_create(to_create, ignore_conflicts=True)
+    model.objects.bulk_update(to_update, ['gained'])
+
+
+def merge_site_gained(counts):
+    # Same rule over the sum of a day's stripes, topped up on stripe 0
+    totals = dict(
+        SiteFollowRollup.objects.filter(day__in=counts).order_by().values('day').annotate(
+            gained=Sum('gained'),
+        ).values_list('day', 'gained')
+    )
+
+    for day, gained in counts.items():
+        if gained > totals.get(day, 0):
+            increment(SiteFollowRollup, {'day': day, 'stripe': 0}, 'gained', gained - totals.get(day, 0))
+
+
+def backfill_follower_rollups(chunk_size=1000, progress=None):
+    site_counts = Counter()
+    last_pk = 0
+    processed = 0
+
+    while True:
+        user_ids = list(
+            User.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:chunk_size]
+        )
+        if not user_ids:
+            break
+
+        counts = {}
+        for db in get_databases():
+            rows = Relation.objects.using(db).filter(to_user_id__in=user_ids).order_by().annotate(
+                day=TruncDate('created_at'),
+            ).values_list('to_user_id', 'day').annotate(count=Count('id'))
+
+            for user_id, day, count in rows:
+                counts[(user_id, day)] = count
+                site_counts[day] += count
+
+        with transaction.atomic():
+            merge_gained(FollowerRollup, counts, ['user_id', 'day'])
+
+        last_pk = user_ids[-1]
+        processed += len(user_ids)
+        if progress:
+            progress(processed, len(counts))
+
+    with transaction.atomic():
+        merge_site_gained(site_counts)
+    return processed
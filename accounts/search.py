@@ -0,0 +1,159 @@
+import threading
+import unicodedata
+
+from django.conf import settings
+from django.db.models import Q
+from django.db.models.functions import Lower
+from django.db.models.lookups import GreaterThanOrEqual, LessThan
+
+from utils.cache import TaggedCache
+from .invalidation import FLUSH_ALL, register_handler
+from .sharding import EdgeUserList
+
+
+SEARCH_FIELDS = ['username', 'email', 'first_name', 'last_name']
+
+# Scopes: ('all', None), ('followers', user_id), ('following', user_id)
+GLOBAL_SCOPE = ('all', None)
+
+_missing = object()
+
+
+def normalize_query(query):
+    return ' '.join(unicodedata.normalize('NFKC', query).lower().split())
+
+
+def get_search_filter(query):
+    # A prefix of any field, as a range over its Lower() index
+    search_filter = Q()
+    for field in SEARCH_FIELDS:
+        search_filter |= Q(GreaterThanOrEqual(Lower(field), query), LessThan(Lower(field), query + '\U0010ffff'))
+    return search_filter
+
+
+# ----- GENERATIONS -----
+
+class SearchGenerations:
+    # Cache keys embed the generation seen before the search ran: any user
+    # change bumps the global one, a relation change the per-user ones of both
+    # ends, so stale entries are never read again and just age out of the LRU.
+
+    def __init__(self, max_users=100_000):
+        self.max_users = max_users
+        self.generation = 0
+        self.user_generations = {}
+        self.lock = threading.Lock()
+
+    def get(self, user_id=None):
+        with self.lock:
+            return self.generation, self.user_generations.get(user_id, 0)
+
+    def handle(self, tags):
+        with self.lock:
+            if FLUSH_ALL in tags or 'users' in tags:
+                self.generation += 1
+
+            for tag in tags:
+                if tag.startswith('relations:'):
+                    user_id = int(tag.partition(':')[2])
+                    self.user_generations[user_id] = self.user_generations.get(user_id, 0) + 1
+
+            # A global bump invalidates every scope, so the counters can restart
+            if len(self.user_generations) > self.max_users:
+                self.user_generations.clear()
+                self.generation += 1
+
+
+search_generations = SearchGenerations(getattr(settings, 'SEARCH_CACHE_MAX_USERS', 100_000))
+
+_search_cache = None
+_search_cache_lock = threading.Lock()
+
+
+def get_search_cache():
+    global _search_cache
+
+    with _search_cache_lock:
+        if _search_cache is None:
+            _search_cache = TaggedCache(
+                max_entries=getattr(settings, 'SEARCH_CACHE_MAX_ENTRIES', 10_000),
+                timeout=getattr(settings, 'SEARCH_CACHE_TIMEOUT', 300),
+            )
+            register_handler(search_generations.handle)
+    return _search_cache
+
+
+# ----- SEARCH -----
+
+class SearchResults:
+    # A cached search: the matching ids in the list's order. A page loads its
+    # users by primary key and puts them back in that order, so no query sorts.
+    # Implements what get_user_cards and Paginator use of a queryset.
+    ordered = True
+
+    def __init__(self, queryset, ids):
+        self.queryset = queryset
+        self.ids = ids
+
+    def map_users(self, func):
+        return SearchResults(func(self.queryset), self.ids)
+
+    def count(self):
+        return len(self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+
+        ids = self.ids[key]
+        rows = {row.pk: row for row in self.queryset.filter(pk__in=ids).order_by()} if ids else {}
+        return [rows[pk] for pk in ids if pk in rows]
+
+
+def get_matching_ids(queryset, limit):
+    # Up to limit ids of queryset, in its order. The search filter's indexes
+    # can't also give the list's order, so the matches are sorted here.
+    if isinstance(queryset, EdgeUserList):
+        return list(queryset.values_list('pk', flat=True)[:limit])
+
+    ordering = list(queryset.query.order_by or queryset.model._meta.ordering)
+    rows = list(queryset.order_by().values_list('pk', *[field.lstrip('-') for field in ordering])[:limit])
+    for index in reversed(range(len(ordering))):
+        rows.sort(key=lambda row: row[index + 1], reverse=ordering[index].startswith('-'))
+    return [row[0] for row in rows]
+
+
+def search_users(queryset, search, scope=GLOBAL_SCOPE):
+    # Filters queryset (the users of scope) by search. Returns the matches and
+    # their number when it came from the cache, or None. A hit costs the cached
+    # ids plus a pk__in query per page. A ranking read from the cache is as of
+    # the search, a change to the users themselves starts a new generation.
+    query = normalize_query(search)
+    if not query:
+        return queryset, None
+    if not getattr(settings, 'SEARCH_CACHE_ENABLE', True):
+        return queryset.filter(get_search_filter(query)), None
+
+    cache = get_search_cache()
+    key = (scope, query, *search_generations.get(scope[1]))
+    ids = cache.get(key, _missing)
+
+    if ids is _missing:
+        max_results = getattr(settings, 'SEARCH_CACHE_MAX_RESULTS', 1000)
+        ids = get_matching_ids(queryset.filter(get_search_filter(query)), max_results + 1)
+        # Too broad for an IN list, remember to scan instead
+        if len(ids) > max_results:
+            ids = None
+        cache.set(key, ids)
+
+    if ids is None:
+        return queryset.filter(get_search_filter(query)), None
+    if isinstance(queryset, EdgeUserList):
+        return queryset.filter(pk__in=ids), len(ids)
+    return SearchResults(queryset, ids), len(ids)
@@ -0,0 +1,199 @@
+import contextlib
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Q
+
+
+# Sharded model -> the user id column that picks its shard. Relation holds the
+# follower side (keyed by the followed user), RelationMirror the same edges
+# keyed by the follower so a following list is a single-shard read too.
+SHARDED_MODELS = {
+    'accounts.relation': 'to_user_id',
+    'accounts.bulkrelation': 'to_user_id',
+    'accounts.relationmirror': 'from_user_id',
+}
+
+
+def jump_hash(key, buckets):
+    # Jump consistent hash (Lamping & Veach): going from n to n + 1 shards only
+    # moves keys to the new, last shard, so append aliases, never reorder them.
+    bucket, jump = -1, 0
+
+    while jump < buckets:
+        bucket = jump
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        jump = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+def get_relation_shards():
+    return list(getattr(settings, 'RELATION_SHARDS', []))
+
+
+def get_next_relation_shards():
+    # Layout being migrated to: writes go to both until the cutover
+    shards = getattr(settings, 'RELATION_SHARDS_NEXT', None)
+    return None if shards is None else list(shards)
+
+
+def get_write_layouts():
+    layouts = [get_relation_shards()]
+    next_shards = get_next_relation_shards()
+
+    if next_shards is not None and next_shards != layouts[0]:
+        layouts.append(next_shards)
+    return layouts
+
+
+def is_relation_sharded(shards=None):
+    return bool(get_relation_shards() if shards is None else shards)
+
+
+def get_shard(user_id, shards=None):
+    shards = get_relation_shards() if shards is None else shards
+
+    if not shards:
+        return DEFAULT_DB_ALIAS
+    return shards[jump_hash(user_id, len(shards))]
+
+
+def get_databases(shards=None):
+    # Every database holding (follower side) edges in a layout
+    shards = get_relation_shards() if shards is None else shards
+    return list(shards) or [DEFAULT_DB_ALIAS]
+
+
+@contextlib.contextmanager
+def atomic(databases):
+    # A transaction on each database, committed in the reverse order they
+    # are given. There is no two-phase commit: a failure between two commits
+    # keeps the ones already made, see accounts.relations.edge_transaction.
+    with contextlib.ExitStack() as stack:
+        for db in dict.fromkeys(databases):
+            stack.enter_context(transaction.atomic(using=db))
+        yield
+
+
+class EdgeUserList:
+    # The users at the other end of a user's edges when the edges are on a
+    # shard and can't be joined. A page is a LIMIT/OFFSET on the shard's
+    # (user, -created_at) index, then only that page's users by primary key.
+    # Filters on the users (a search) walk the edges in chunks instead.
+    # Implements what search_users, get_user_cards and Paginator use of a
+    # queryset.
+    ordered = True
+    chunk_size = 500
+
+    def __init__(self, edges, field, users, filtered=False):
+        self.edges = edges.order_by('-created_at', '-pk')
+        self.field = field
+        self.users = users
+        self.filtered = filtered
+
+    def clone(self, edges=None, users=None, filtered=None):
+        return EdgeUserList(
+            self.edges if edges is None else edges,
+            self.field,
+            self.users if users is None else users,
+            self.filtered if filtered is None else filtered,
+        )
+
+    def filter(self, *args, **kwargs):
+        # A list of ids (a cached search) narrows the edges on the shard
+        if not args and list(kwargs) == ['pk__in'] and isinstance(kwargs['pk__in'], (list, tuple, set)):
+            return self.clone(edges=self.edges.filter(**{f'{self.field}__in': kwargs['pk__in']}))
+        return self.clone(users=self.users.filter(*args, **kwargs), filtered=True)
+
+    def order_by(self, *fields):
+        # Always newest edge first
+        return self
+
+    def map_users(self, func):
+        return self.clone(users=func(self.users))
+
+    def values_list(self, *fields, **kwargs):
+        return self.map_users(lambda users: users.values_list(*fields, **kwargs))
+
+    def load(self, ids):
+        # The users of ids, in the order of ids
+        if not ids:
+            return []
+        # Rows are instances, cards, or the bare ids of values_list('pk', flat=True)
+        rows = {getattr(row, 'pk', row): row for row in self.users.filter(pk__in=ids).order_by()}
+        return [rows[pk] for pk in ids if pk in rows]
+
+    def iter_edge_chunks(self):
+        # Keyset chunks of the other ends' ids, in list order
+        last = None
+
+        while True:
+            edges = self.edges
+            if last is not None:
+                edges = edges.filter(Q(created_at__lt=last[0]) | Q(created_at=last[0], pk__lt=last[1]))
+            rows = list(edges.values_list('created_at', 'pk', self.field)[:self.chunk_size])
+            if not rows:
+                return
+            last = rows[-1][:2]
+            yield [row[2] for row in rows]
+
+    def count(self):
+        if not self.filtered:
+            return self.edges.count()
+        return sum(self.users.filter(pk__in=ids).count() for ids in self.iter_edge_chunks())
+
+    def __len__(self):
+        return self.count()
+
+    def __iter__(self):
+        for ids in self.iter_edge_chunks():
+            yield from self.load(ids)
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+        if key.step is not None or (key.start or 0) < 0 or (key.stop is not None and key.stop < 0):
+            raise ValueError('Only positive slices without a step are supported')
+
+        start = key.start or 0
+        if not self.filtered:
+            return self.load(list(self.edges.values_list(self.field, flat=True)[start:key.stop]))
+
+        results = []
+        for row in self:
+            if key.stop is not None and len(results) >= key.stop:
+                break
+            results.append(row)
+        return results[start:]
+
+
+class RelationShardRouter:
+    def db_for_read(self, model, **hints):
+        instance = hints.get('instance')
+        shard_key = SHARDED_MODELS.get(model._meta.label_lower)
+
+        if shard_key is not None:
+            if isinstance(instance, model) and getattr(instance, shard_key) is not None:
+                return get_shard(getattr(instance, shard_key))
+            return None
+
+        # Users and everything else behind an edge stay on the default database
+        if instance is not None and instance._meta.label_lower in SHARDED_MODELS:
+            return DEFAULT_DB_ALIAS
+        return None
+
+    db_for_write = db_for_read
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if obj1._meta.label_lower in SHARDED_MODELS or obj2._meta.label_lower in SHARDED_MODELS:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == DEFAULT_DB_ALIAS:
+            return None
+
+        shards = set(get_relation_shards()) | set(get_next_relation_shards() or [])
+        if db in shards:
+            return f'{app_label}.{model_name}' in SHARDED_MODELS
+        return None
@@ -0,0 +1,113 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.signals import user_logged_in
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from utils.activity import activity_tracker
+from .models import Relation, BulkRelation
+from .availability import availability_index
+from .events import publish_relation_event
+from .rollups import get_deleting_user_ids, record_follow, record_unfollow
+from .invalidation import emit, get_user_tags, get_relation_tags
+from .relations import touch_relations, save_edges, delete_edges, delete_user_edges
+from .jobs import enqueue
+from .images import retain, release
+
+
+User = get_user_model()
+
+# Fields rendered on other users' follower/following list pages, and whether
+# the user is listed at all
+LIST_VISIBLE_FIELDS = {'username', 'first_name', 'last_name', 'image', 'is_active'}
+
+
+@receiver(post_save, sender=Relation)
+@receiver(post_delete, sender=Relation)
+def relation_changed(sender, instance, **kwargs):
+    touch_relations(instance.from_user_id, instance.to_user_id)
+    emit(get_relation_tags(instance.from_user_id, instance.to_user_id))
+
+
+@receiver(post_save, sender=Relation)
+def relation_created(sender, instance, created, **kwargs):
+    if created:
+        # The mirror, and both copies in the next layout while resharding
+        save_edges([instance], exclude={(BulkRelation, instance._state.db)})
+        record_follow(instance)
+        transaction.on_commit(lambda: publish_relation_event('follow', instance))
+
+
+@receiver(post_delete, sender=Relation)
+def relation_deleted(sender, instance, **kwargs):
+    delete_edges([instance], exclude={(BulkRelation, instance._state.db)})
+    record_unfollow(instance)
+    transaction.on_commit(lambda: publish_relation_event('unfollow', instance))
+
+
+@receiver(pre_delete, sender=User)
+def user_deleting(sender, instance, **kwargs):
+    # Edges don't cascade (on_delete=DO_NOTHING): both directions go in a few
+    # bulk queries here, without the per-edge Relation receivers above
+    get_deleting_user_ids().add(instance.pk)
+    delete_user_edges(instance.pk)
+
+
+@receiver(pre_save, sender=User)
+def user_saving(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and 'image' not in update_fields:
+        return
+
+    instance._previous_image = User.objects.filter(pk=instance.pk).values_list('image', flat=True).first() if instance.pk else None
+
+
+@receiver(post_save, sender=User)
+def user_image_changed(sender, instance, **kwargs):
+    if not hasattr(instance, '_previous_image'):
+        return
+
+    previous, current = instance._previous_image or '', instance.image.name or ''
+    del instance._previous_image
+    if previous != current:
+        retain(current)
+        release(previous)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, update_fields=None, **kwargs):
+    availability_index.add_user(instance)
+
+    if update_fields is None or set(update_fields) - {'last_login'}:
+        emit(get_user_tags(instance.pk))
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    get_deleting_user_ids().discard(instance.pk)
+    availability_index.mark_stale()
+    release(instance.image.name)
+    emit(get_user_tags(instance.pk) + get_relation_tags(instance.pk))
+
+
+@receiver(post_save, sender=User)
+def user_changed(sender, instance, created, update_fields=None, **kwargs):
+    if created or (update_fields is not None and not LIST_VISIBLE_FIELDS & set(update_fields)):
+        return
+
+    # A profile edit changes the rows shown on every list the user appears in:
+    # a job touches those lists' owners in batches, off the request path
+    enqueue('touch_relation_lists', {'user_id': instance.pk}, key=f'touch_relation_lists:{instance.pk}')
+
+
+if getattr(settings, 'ACTIVITY_BATCH_LAST_LOGIN', True):
+    # Instead of django.contrib.auth's update_last_login, which saves the user
+    # on every login
+    user_logged_in.disconnect(dispatch_uid='update_last_login')
+
+    @receiver(user_logged_in)
+    def user_logged_in_batched(sender, user, **kwargs):
+        user.last_login = timezone.now()
+        activity_tracker.record(user.pk, 'last_login', user.last_login)
+        activity_tracker.record(user.pk, when=user.last_login, previous=user.last_seen)
@@ -0,0 +1,33 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+
+from utils.base import send_sms
+from .jobs import register
+from .images import collect_image_garbage, schedule_next_image_gc
+from .relations import touch_relation_lists
+
+
+User = get_user_model()
+
+
+# The user is waiting for the code, and the payload holds it: a code that
+# can't go out within a few minutes is useless, don't keep retrying or storing it
+register('send_sms', max_attempts=2, priority=10, expires=getattr(settings, 'SMS_JOB_EXPIRES', 300), sensitive=True)(send_sms)
+
+
+# A profile edit, see accounts.signals.user_changed
+register('touch_relation_lists')(touch_relation_lists)
+
+
+@register('collect_images', max_attempts=3, priority=-10)
+def collect_images():
+    collect_image_garbage()
+    schedule_next_image_gc()
+
+
+@register('delete_users', batch_size=50)
+def delete_users(payloads):
+    # Accounts deactivated by UserDeleteForm; the cascade (relations, their
+    # mirrors and rollups, the image reference) runs here instead of in the
+    # request. Already deleted ones are skipped, jobs may run more than once.
+    User.objects.filter(pk__in=[payload['user_id'] for payload in payloads], is_active=False).delete()
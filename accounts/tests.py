@@ -1,3 +1,1630 @@
-from django.test import TestCase
+import datetime
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.models import Session
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Q
+from django.db.transaction import TransactionManagementError
+from django.http import Http404, HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import NoReverseMatch, get_script_prefix, reverse, set_script_prefix
+from django.utils import timezone
+
+from utils.activity import ActivityTracker, activity_tracker
+from utils.media import serve_media
+from utils.startup import start_background_threads, startup_report, warm_up
+from utils.memory import UNRESOLVED_VIEW, measure_allocations, request_memory_stats, start_tracking, stop_tracking
+from utils.middleware import MemoryProfilingMiddleware, SessionJanitorMiddleware
+from utils.pubsub import Broker, LocalBroker, get_broker
+from utils.ratelimit import LocalBackend, get_rejection_counts, reset_ratelimits
+from utils.staticfiles import CompressedManifestStaticFilesStorage, get_accepted_encodings, purge_css, serve_static
+from utils.sessions import purge_expired_sessions, run_session_janitor_in_background
+from .availability import availability_index, get_taken_fields
+from .events import get_user_channel, stream_user_events
+from .exports import iter_export
+from .cards import UserCard
+from .forms import UserCreateForm
+from .images import collect_image_garbage, get_image_storage, release, retain
+from .importer import AccountImporter
+from .mutuals import get_mutual_connections
+from .invalidation import FLUSH_ALL, DatabaseTransport, Transport, UnixSocketTransport, dispatch, emit, enable_subscriber, start_subscriber
+from .jobs import _registry, claim_jobs, enqueue, register, run_jobs
+from .management.commands.check_query_plans import get_plan_problems
+from .management.commands.profile_startup import parse_importtime
+from .models import UserUrls, account_urls, Relation, RelationManager, RelationMirror, BulkRelation, FollowerRollup, SiteFollowRollup, ChangeEvent, Job, StoredFile
+from .relations import (
+    bulk_follow, bulk_unfollow, delete_edges, delete_existing_edges, delete_user_edges, record_bulk_unfollows,
+    copy_edges, prune_edges, count_edges, repair_edges,
+)
+from .search import normalize_query, search_users
+from .rollups import backfill_follower_rollups, get_follower_series, get_site_follow_series
+from .sharding import get_shard
+
+
+User = get_user_model()
+
+
+def create_user(username, number, **kwargs):
+    return User.objects.create_user(
+        username=username,
+        password='password',
+        email=f'{username}@example.com',
+        first_name='First',
+        last_name='Last',
+        phone_number=f'+98912000{number:04d}',
+        **kwargs,
+    )
+
+
+# Background threads (job worker, invalidation subscriber, activity flush,
+# session janitor) would write to the test database behind the test's
+# transaction
+test_settings = override_settings(
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+    RATELIMIT_ENABLE=False,
+    JOBS_RUN_IN_PROCESS=False,
+    INVALIDATION_SUBSCRIBE=False,
+    ACTIVITY_TRACKING=False,
+    ACTIVITY_FLUSH_THREAD=False,
+    SESSION_JANITOR_PROBABILITY=0,
+    STORAGES={
+        'default': {'BACKEND': 'django.core.files.storage.InMemoryStorage'},
+        'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    },
+)
+
+
+@test_settings
+class AccountsTestCase(TestCase):
+    def setUp(self):
+        # Logins buffer last_login, nothing may flush it after the test
+        self.addCleanup(activity_tracker.pending.clear)
+        # In-process caches would outlive the test's rows, and ids are reused
+        self.addCleanup(dispatch, [FLUSH_ALL])
+        self.alice = create_user('alice', 1)
+        self.bob = create_user('bob', 2)
+        self.carol = create_user('carol', 3)
+
+    def follow(self, from_user, to_user):
+        return Relation.objects.create(from_user=from_user, to_user=to_user)
+
+
+# ----- URLS -----
+
+class UserUrlsTests(AccountsTestCase):
+    def test_urls_match_reverse(self):
+        previous = get_script_prefix()
+        self.addCleanup(set_script_prefix, previous)
+        usernames = ['alice', 'ünïcödé', 'a b', 'a%b', 'a?b#c', '..']
+
+        for prefix in ('/', '/sub/', '/über uns/'):
+            set_script_prefix(prefix)
+            for username in usernames:
+                urls = UserUrls(mock.Mock(username=username))
+                for attr, (name, with_username) in UserUrls.routes.items():
+                    with self.subTest(prefix=prefix, username=username, attr=attr):
+                        self.assertEqual(getattr(urls, attr), reverse(name, args=[username] if with_username else []))
+
+    def test_quoting(self):
+        self.addCleanup(set_script_prefix, get_script_prefix())
+        set_script_prefix('/über uns/')
+        # Compiled under this prefix, not the root one
+        account_urls.clear()
+
+        self.assertEqual(UserUrls(mock.Mock(username='ünï')).detail, '/%C3%BCber%20uns/accounts/%C3%BCn%C3%AF/')
+        self.assertEqual(self.alice.get_follower_list_url(), '/%C3%BCber%20uns/accounts/alice/followers/')
+        # Falls back to reverse(), which rejects it too
+        with self.assertRaises(NoReverseMatch):
+            UserUrls(mock.Mock(username='a/b')).detail
+
+
+# ----- LISTS -----
+
+class UserListRenderingTests(AccountsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.alice)
+        now = timezone.now()
+        User.objects.filter(pk=self.bob.pk).update(first_name='Bobby', last_seen=now)
+        User.objects.filter(pk=self.carol.pk).update(last_seen=now - datetime.timedelta(hours=2))
+
+    def get_cards(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response, list(response.context['page_obj'])
+
+    def assertCard(self, response, card, user):
+        self.assertIsInstance(card, UserCard)
+        self.assertEqual((card.pk, card.username), (user.pk, user.username))
+        self.assertContains(response, f'@{user.username}</h5>', html=False)
+        self.assertContains(response, f'href="{user.get_absolute_url()}"')
+
+    def test_people_list(self):
+        self.follow(self.alice, self.bob)
+        response, cards = self.get_cards(reverse('accounts:user-list'))
+
+        self.assertEqual([card.username for card in cards], ['bob', 'alice', 'carol'])
+        for card, user in zip(cards, [self.bob, self.alice, self.carol]):
+            self.assertCard(response, card, user)
+        self.assertContains(response, 'Bobby Last')
+        self.assertContains(response, 'Active now', count=1)
+        self.assertContains(response, 'Active 2\xa0hours ago', count=1)
+
+    def test_people_search(self):
+        response, cards = self.get_cards(reverse('accounts:user-list'), search='bob')
+        self.assertEqual([card.username for card in cards], ['bob'])
+        self.assertCard(response, cards[0], self.bob)
+
+        response, cards = self.get_cards(reverse('accounts:user-list'), search='nobody')
+        self.assertEqual(cards, [])
+        self.assertContains(response, 'No people found')
+
+    def test_follower_and_following_lists(self):
+        self.follow(self.bob, self.alice)
+        self.follow(self.carol, self.alice)
+        self.follow(self.alice, self.carol)
+
+        response, cards = self.get_cards(self.alice.get_follower_list_url())
+        self.assertEqual([card.username for card in cards], ['carol', 'bob'])
+        for card, user in zip(cards, [self.carol, self.bob]):
+            self.assertCard(response, card, user)
+        self.assertContains(response, 'Active now', count=1)
+
+        response, cards = self.get_cards(self.alice.get_following_list_url())
+        self.assertEqual([card.username for card in cards], ['carol'])
+        self.assertCard(response, cards[0], self.carol)
+        self.assertNotContains(response, '@bob</h5>')
+
+    def test_inactive_users_are_not_listed(self):
+        self.follow(self.bob, self.alice)
+        User.objects.filter(pk=self.bob.pk).update(is_active=False)
+
+        self.assertEqual(self.get_cards(self.alice.get_follower_list_url())[1], [])
+        self.assertEqual([card.username for card in self.get_cards(reverse('accounts:user-list'))[1]], ['alice', 'carol'])
+
+
+# ----- CONDITIONAL GET -----
+
+class ConditionalGetTests(AccountsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.alice)
+
+    def get_etag(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response['ETag']
+
+    def test_unchanged_page_is_not_modified(self):
+        url = self.bob.get_absolute_url()
+        etag = self.get_etag(url)
+
+        response = self.client.get(url, headers={'if-none-match': etag})
+        self.assertEqual(response.status_code, 304)
+
+    def test_follow_and_unfollow_change_the_etag(self):
+        for url in (self.bob.get_absolute_url(), self.bob.get_follower_list_url()):
+            etag = self.get_etag(url)
+            relation = self.follow(self.carol, self.bob)
+            self.assertEqual(self.client.get(url, headers={'if-none-match': etag}).status_code, 200)
+
+            etag = self.get_etag(url)
+            relation.delete()
+            self.assertEqual(self.client.get(url, headers={'if-none-match': etag}).status_code, 200)
+
+    def test_follower_profile_edit_changes_the_list_etag(self):
+        self.follow(self.carol, self.bob)
+        url = self.bob.get_follower_list_url()
+        etag = self.get_etag(url)
+
+        self.carol.first_name = 'Changed'
+        self.carol.save()
+        self.assertEqual(run_jobs(), 1)
+        self.assertEqual(self.client.get(url, headers={'if-none-match': etag}).status_code, 200)
+
+    def test_listed_user_presence_changes_the_list_etag(self):
+        self.follow(self.carol, self.bob)
+        url = self.bob.get_follower_list_url()
+        etag = self.get_etag(url)
+        self.assertEqual(self.client.get(url, headers={'if-none-match': etag}).status_code, 304)
+
+        User.objects.filter(pk=self.carol.pk).update(last_seen=timezone.now())
+        self.assertEqual(self.client.get(url, headers={'if-none-match': etag}).status_code, 200)
+
+
+# ----- USER DELETION -----
+
+class UserDeleteCascadeTests(AccountsTestCase):
+    def count_delete_queries(self, edges):
+        user = create_user('leaving', 10)
+        others = [create_user(f'other{index}', 20 + index) for index in range(edges)]
+        for other in others:
+            self.follow(user, other)
+            self.follow(other, user)
+
+        with CaptureQueriesContext(connection) as captured:
+            user.delete()
+        for other in others:
+            other.delete()
+        return len(captured.captured_queries)
+
+    @override_settings(SITE_ROLLUP_STRIPES=1)
+    def test_query_count_does_not_grow_with_edges(self):
+        self.assertEqual(self.count_delete_queries(2), self.count_delete_queries(6))
+
+    def test_edges_and_rollups(self):
+        self.follow(self.alice, self.bob)
+        self.follow(self.bob, self.alice)
+        self.follow(self.carol, self.alice)
+
+        self.alice.delete()
+
+        self.assertFalse(Relation.objects.filter(from_user_id=self.alice.pk).exists())
+        self.assertFalse(Relation.objects.filter(to_user_id=self.alice.pk).exists())
+        self.assertEqual(self.bob.get_followers_count(), 0)
+        self.assertEqual(self.bob.get_following_count(), 0)
+        self.assertEqual(self.carol.get_following_count(), 0)
+
+        today = timezone.localdate()
+        self.assertEqual(FollowerRollup.objects.get(user=self.bob, day=today).lost, 1)
+        self.assertFalse(FollowerRollup.objects.filter(user_id=self.alice.pk).exists())
+        [site] = get_site_follow_series(today, today)
+        self.assertEqual((site['gained'], site['lost']), (3, 3))
+
+        self.bob.refresh_from_db()
+        self.assertGreater(self.bob.relations_updated_at, self.bob.updated_at)
+
+    def test_edges_are_deleted_in_batches(self):
+        dave = create_user('dave', 4)
+        for other in (self.bob, self.carol):
+            self.follow(self.alice, other)
+            self.follow(other, self.alice)
+        self.follow(dave, self.alice)
+
+        with mock.patch('accounts.relations.record_bulk_unfollows', wraps=record_bulk_unfollows) as record:
+            with transaction.atomic():
+                delete_user_edges(self.alice.pk, batch_size=2)
+
+        # Three followers, then two followed users
+        self.assertEqual([len(call.args[0]) for call in record.call_args_list], [2, 1, 2])
+        self.assertFalse(Relation.objects.filter(Q(from_user=self.alice) | Q(to_user=self.alice)).exists())
+        self.assertEqual(User.objects.get(pk=self.bob.pk).followers_count, 0)
+
+
+class UserDeactivationTests(AccountsTestCase):
+    def test_deleted_account_leaves_lists_search_and_mutuals(self):
+        self.follow(self.alice, self.carol)
+        self.follow(self.carol, self.bob)
+        self.follow(self.alice, self.bob)
+        self.assertEqual(get_mutual_connections(self.alice.pk, self.bob.pk).count, 1)
+
+        self.client.force_login(self.carol)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('accounts:user-delete'), {'username': 'carol'})
+        self.assertTrue(Job.objects.filter(name='delete_users').exists())
+
+        self.client.force_login(self.alice)
+        for url, query in [
+            (reverse('accounts:user-list'), {}),
+            (reverse('accounts:user-list'), {'search': 'carol'}),
+            (reverse('accounts:user-follower-list', args=['bob']), {}),
+            (reverse('accounts:user-following-list', args=['alice']), {}),
+        ]:
+            cards = self.client.get(url, query).context['page_obj']
+            self.assertNotIn('carol', [card.username for card in cards])
+        self.assertEqual(get_mutual_connections(self.alice.pk, self.bob.pk).count, 0)
+
+
+# ----- EXPORTS -----
+
+class RelationExportTests(AccountsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.follow(self.alice, self.carol)
+        self.follow(self.bob, self.carol)
+        self.client.force_login(self.alice)
+        self.url = reverse('accounts:user-follower-export', args=['carol'])
+
+    def read(self, response):
+        return b''.join(response.streaming_content).decode()
+
+    def test_ndjson_resumes_from_the_cursor(self):
+        rows = [json.loads(line) for line in self.read(self.client.get(self.url)).splitlines()]
+        self.assertEqual([row['username'] for row in rows], ['alice', 'bob'])
+
+        rest = self.read(self.client.get(self.url, {'cursor': rows[0]['cursor']}))
+        self.assertEqual([json.loads(line)['username'] for line in rest.splitlines()], ['bob'])
+
+    def test_csv_header_only_on_the_first_request(self):
+        response = self.client.get(self.url, {'format': 'csv'})
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        lines = self.read(response).splitlines()
+        self.assertEqual((lines[0], len(lines)), ('cursor,username,first_name,last_name,followed_at', 3))
+
+        cursor = lines[1].split(',')[0]
+        self.assertEqual(len(self.read(self.client.get(self.url, {'format': 'csv', 'cursor': cursor})).splitlines()), 1)
+
+    def test_small_chunks_and_gzip(self):
+        lines = b''.join(iter_export(self.carol, 'followers', chunk_size=1)).decode().splitlines()
+        self.assertEqual(len(lines), 2)
+
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(len(gzip.decompress(b''.join(response.streaming_content)).splitlines()), 2)
+
+    def test_gzip_refused_with_zero_quality(self):
+        for header in ('gzip;q=0', 'br, gzip; q=0.0', 'identity'):
+            with self.subTest(header=header):
+                response = self.client.get(self.url, HTTP_ACCEPT_ENCODING=header)
+                self.assertNotIn('Content-Encoding', response)
+                self.assertIn('Accept-Encoding', response['Vary'])
+                self.assertEqual(len(self.read(response).splitlines()), 2)
+
+    def test_invalid_parameters(self):
+        for query in ({'format': 'xml'}, {'cursor': '-1'}):
+            self.assertEqual(self.client.get(self.url, query).status_code, 400)
+
+
+# ----- RATE LIMITS -----
+
+class RateLimitTests(AccountsTestCase):
+    def test_sliding_window(self):
+        backend = LocalBackend()
+
+        self.assertEqual([backend.hit('key', 2, 60, now=0) for _ in range(3)], [True, True, False])
+        # The previous window still counts in full at the start of the next
+        self.assertFalse(backend.hit('key', 2, 60, now=60))
+        # and for half of it halfway through
+        self.assertTrue(backend.hit('key', 2, 60, now=90))
+        self.assertFalse(backend.hit('key', 2, 60, now=90))
+        self.assertTrue(backend.hit('other', 2, 60, now=91))
+
+    def test_least_recently_used_keys_are_evicted(self):
+        backend = LocalBackend(max_keys=2)
+
+        for key in ('a', 'b', 'a', 'c'):
+            backend.hit(key, 1, 60, now=0)
+        self.assertEqual(list(backend.buckets), ['a', 'c'])
+
+    @override_settings(RATELIMIT_ENABLE=True)
+    def test_view_answers_429_with_retry_after(self):
+        self.addCleanup(reset_ratelimits)
+        reset_ratelimits()
+        url = reverse('accounts:user-password-reset')
+
+        # 3/h per username, whatever its case
+        for username in ('alice', 'ALICE', 'Alice'):
+            self.assertNotEqual(self.client.post(url, {'username': username}).status_code, 429)
+        response = self.client.post(url, {'username': 'alice'})
+
+        self.assertEqual(response.status_code, 429)
+        self.assertTrue(0 < int(response['Retry-After']) <= 3600)
+        self.assertEqual(get_rejection_counts(), {'UserPasswordResetView:post:username': 1})
+        self.assertNotEqual(self.client.post(url, {'username': 'bob'}).status_code, 429)
+
+
+# ----- SEARCH -----
+
+class SearchTests(AccountsTestCase):
+    def search(self, search, scope=('all', None)):
+        queryset, count = search_users(User.objects.order_by('username'), search, scope)
+        return [user.username for user in queryset], count
+
+    def test_normalized_query(self):
+        self.assertEqual(normalize_query('  ＡLice \t Smith '), 'alice smith')
+
+    def test_cached_ids_until_a_user_changes(self):
+        with self.assertNumQueries(2):
+            self.assertEqual(self.search('AL'), (['alice'], 1))
+
+        # A hit is the cached id list and one pk IN query
+        with self.assertNumQueries(1):
+            self.assertEqual(self.search('al'), (['alice'], 1))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            create_user('alfred', 4)
+        with self.assertNumQueries(2):
+            self.assertEqual(self.search('al'), (['alfred', 'alice'], 2))
+
+    def test_scope_is_invalidated_by_its_relations(self):
+        scope = ('followers', self.bob.pk)
+        followers = self.bob.get_follower_list()
+        self.assertEqual(search_users(followers, 'a', scope)[0].count(), 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.follow(self.alice, self.bob)
+        queryset, count = search_users(followers, 'a', scope)
+        self.assertEqual(([user.username for user in queryset], count), (['alice'], 1))
+
+    @override_settings(SEARCH_CACHE_MAX_RESULTS=1)
+    def test_broad_queries_are_not_cached(self):
+        self.assertEqual(self.search('first'), (['alice', 'bob', 'carol'], None))
+        self.assertEqual(self.search('first'), (['alice', 'bob', 'carol'], None))
+
+    def test_prefix_of_any_field(self):
+        self.assertEqual(self.search('ali'), (['alice'], 1))
+        self.assertEqual(self.search('lice'), ([], 0))
+        self.assertEqual(self.search('BOB@'), (['bob'], 1))
+
+    def test_matches_keep_the_list_order(self):
+        queryset = User.objects.order_by('-username')
+        for _ in range(2):
+            results, count = search_users(queryset, 'first')
+            self.assertEqual(([user.username for user in results], count), (['carol', 'bob', 'alice'], 3))
+            self.assertEqual([user.username for user in results[1:]], ['bob', 'alice'])
+
+    @override_settings(SEARCH_CACHE_ENABLE=False)
+    def test_cache_disabled(self):
+        self.search('alice')
+        self.assertEqual(self.search('alice'), (['alice'], None))
+
+
+# ----- AVAILABILITY -----
+
+class AvailabilityTests(AccountsTestCase):
+    def setUp(self):
+        super().setUp()
+        availability_index.build()
+
+    def add_user_elsewhere(self, username, number):
+        # Saved by another process: no signals, so not in this filter
+        User.objects.bulk_create([User(
+            username=username,
+            email=f'{username}@example.com',
+            first_name='First',
+            last_name='Last',
+            phone_number=f'+98912000{number:04d}',
+        )])
+
+    def test_filter_miss_skips_the_query(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(get_taken_fields(username='nobody', email='nobody@example.com'), set())
+        with self.assertNumQueries(1):
+            self.assertEqual(get_taken_fields(username='alice', email='nobody@example.com'), {'username'})
+
+    def test_saves_are_added_to_the_filter(self):
+        create_user('dave', 4)
+        self.assertTrue(availability_index.might_exist('username', 'dave'))
+
+    def test_endpoint_confirms_misses_in_the_database(self):
+        self.add_user_elsewhere('erin', 5)
+        self.assertFalse(availability_index.might_exist('username', 'erin'))
+
+        url = reverse('accounts:user-availability')
+        self.assertEqual(self.client.get(url, {'username': 'erin'}).json(), {'username': False})
+        self.assertEqual(self.client.get(url, {'username': 'frank'}).json(), {'username': True})
+
+    def test_endpoint_only_answers_for_usernames(self):
+        url = reverse('accounts:user-availability')
+        response = self.client.get(url, {'email': 'alice@example.com', 'phone_number': '+989120000001'})
+        self.assertEqual(response.json(), {})
+
+    def test_signup_race_is_settled_by_the_constraint(self):
+        self.add_user_elsewhere('erin', 5)
+        form = UserCreateForm({
+            'username': 'erin',
+            'email': 'other@example.com',
+            'first_name': 'First',
+            'last_name': 'Last',
+            'phone_number': '+989120000099',
+            'password': 'password',
+            'confirm_password': 'password',
+        })
+
+        self.assertTrue(form.is_valid())
+        self.assertIsNone(form.save())
+        self.assertIn('username', form.errors)
+
+    def test_one_build_at_a_time(self):
+        with availability_index.build_lock:
+            self.assertIsNone(availability_index.build(blocking=False))
+            self.assertFalse(availability_index.build_in_background())
+        self.assertEqual(availability_index.build(), User.objects.count())
+
+
+# ----- LIVE EVENTS -----
+
+class EventStreamTests(AccountsTestCase):
+    counts = {'followers_count': 1, 'following_count': 2}
+
+    async def test_stream_sends_events_and_closes(self):
+        channel = get_user_channel(self.bob.pk)
+        stream = stream_user_events(self.bob.pk, self.counts)
+
+        snapshot = await anext(stream)
+        self.assertIn('event: counts', snapshot)
+        self.assertTrue(get_broker().has_subscribers(channel))
+
+        get_broker().publish(channel, {'id': 1, 'type': 'follow', 'username': 'alice', **self.counts})
+        self.assertIn('event: follow', await anext(stream))
+
+        # What the server does when the client goes away
+        await stream.aclose()
+        self.assertFalse(get_broker().has_subscribers(channel))
+
+    def test_wsgi_gets_the_counts_and_polls(self):
+        self.follow(self.alice, self.bob)
+        self.client.force_login(self.alice)
+
+        with mock.patch.object(LocalBroker, 'spans_processes', True):
+            response = self.client.get(self.bob.get_events_url())
+
+        self.assertFalse(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        content = response.content.decode()
+        self.assertTrue(content.startswith('retry: 30000\n'))
+        self.assertIn('"followers_count": 1', content)
+
+    def test_wsgi_does_not_poll_a_local_broker(self):
+        self.client.force_login(self.alice)
+        response = self.client.get(self.bob.get_events_url())
+        self.assertEqual((response.status_code, response.content), (204, b''))
+
+    @override_settings(RATELIMIT_ENABLE=True)
+    def test_ratelimited(self):
+        self.addCleanup(reset_ratelimits)
+        reset_ratelimits()
+        self.client.force_login(self.alice)
+
+        statuses = [self.client.get(self.bob.get_events_url()).status_code for _ in range(31)]
+        self.assertEqual((statuses[0], statuses[-1]), (204, 429))
+
+    def test_requires_login(self):
+        response = self.client.get(self.bob.get_events_url())
+        self.assertEqual(response.status_code, 302)
+
+    def test_brokers_implement_the_interface(self):
+        class HalfBroker(Broker):
+            def publish(self, channel, event):
+                pass
+
+        with self.assertRaises(TypeError):
+            HalfBroker()
+        self.assertFalse(get_broker().spans_processes)
+
+
+# ----- IMAGES -----
+
+class ImageTests(AccountsTestCase):
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.storage = get_image_storage()
+
+    def upload(self, user, content):
+        user.image = SimpleUploadedFile('avatar.PNG', content)
+        user.save()
+        return user.image.name
+
+    def refcount(self, name):
+        return StoredFile.objects.get(name=name).refcount
+
+    def age(self, name, seconds):
+        # Released, and the file written, seconds ago
+        then = timezone.now() - datetime.timedelta(seconds=seconds)
+        StoredFile.objects.filter(name=name).update(released_at=then)
+        os.utime(self.storage.path(name), (then.timestamp(), then.timestamp()))
+
+    def test_identical_uploads_share_a_file(self):
+        name = self.upload(self.alice, b'same')
+        self.assertEqual(self.upload(self.bob, b'same'), name)
+        self.assertTrue(name.endswith('.png'))
+
+        self.assertEqual(self.refcount(name), 2)
+        self.assertEqual(len(os.listdir(os.path.dirname(self.storage.path(name)))), 1)
+
+    def test_retain_and_release(self):
+        name = self.upload(self.alice, b'first')
+        self.upload(self.alice, b'second')
+        self.assertEqual(self.refcount(name), 0)
+        self.assertIsNotNone(StoredFile.objects.get(name=name).released_at)
+
+        retain(name)
+        retain(name)
+        release(name)
+        self.assertEqual(self.refcount(name), 1)
+        self.assertIsNone(StoredFile.objects.get(name=name).released_at)
+
+        retain('')
+        release(None)
+        self.assertEqual(StoredFile.objects.count(), 2)
+
+    def test_released_files_are_kept_for_the_grace_period(self):
+        name = self.upload(self.alice, b'first')
+        self.upload(self.alice, b'second')
+
+        self.assertEqual(collect_image_garbage(grace_seconds=60)['deleted'], 0)
+        self.assertTrue(self.storage.exists(name))
+
+        self.age(name, 120)
+        self.assertEqual(collect_image_garbage(grace_seconds=60, dry_run=True)['deleted'], 1)
+        self.assertTrue(self.storage.exists(name))
+
+        stats = collect_image_garbage(grace_seconds=60)
+        self.assertEqual((stats['deleted'], stats['bytes']), (1, len(b'first')))
+        self.assertFalse(self.storage.exists(name))
+        self.assertFalse(StoredFile.objects.filter(name=name).exists())
+        self.assertTrue(self.storage.exists(self.alice.image.name))
+
+    def test_reupload_within_the_sweep_keeps_the_file(self):
+        name = self.upload(self.alice, b'first')
+        self.upload(self.alice, b'second')
+        self.age(name, 120)
+
+        # Uploaded again by someone else: the file is touched, then retained
+        self.assertEqual(self.upload(self.bob, b'first'), name)
+        self.assertEqual(collect_image_garbage(grace_seconds=60)['deleted'], 0)
+        self.assertTrue(self.storage.exists(name))
+        self.assertEqual(self.refcount(name), 1)
+
+    def test_orphans_are_swept_after_the_grace_period(self):
+        name = self.upload(self.alice, b'orphan')
+        StoredFile.objects.filter(name=name).delete()
+
+        self.assertEqual(collect_image_garbage(grace_seconds=60)['orphans'], 0)
+        self.age(name, 120)
+        self.assertEqual(collect_image_garbage(grace_seconds=60)['orphans'], 1)
+        self.assertFalse(self.storage.exists(name))
+
+
+# ----- ROLLUPS -----
+
+class RollupTests(AccountsTestCase):
+    def test_follow_and_unfollow_counts(self):
+        today = timezone.localdate()
+        self.follow(self.alice, self.bob)
+        relation = self.follow(self.carol, self.bob)
+        relation.delete()
+
+        [day] = get_follower_series(self.bob, today, today)
+        self.assertEqual((day['gained'], day['lost'], day['net']), (2, 1, 1))
+
+    def test_followers_count_ranks_the_people_list(self):
+        self.follow(self.alice, self.bob)
+        self.follow(self.carol, self.bob)
+        bulk_follow(self.bob, ['carol'])
+        bulk_unfollow(self.carol, ['bob'])
+        self.alice.delete()
+
+        counts = dict(User.objects.values_list('username', 'followers_count'))
+        self.assertEqual(counts, {'bob': 0, 'carol': 1})
+
+        self.client.force_login(self.bob)
+        response = self.client.get(reverse('accounts:user-list'))
+        self.assertEqual([card.username for card in response.context['page_obj']], ['carol', 'bob'])
+        self.assertFalse(response.context['page_obj'].has_next())
+        # Past the end there is no count to find the last page by
+        response = self.client.get(reverse('accounts:user-list'), {'page': 9})
+        self.assertEqual(response.context['page_obj'].number, 1)
+
+    @override_settings(SITE_ROLLUP_STRIPES=4)
+    def test_site_counts_are_striped_and_summed(self):
+        today = timezone.localdate()
+        users = [create_user(f'user{index}', 10 + index) for index in range(20)]
+        for user in users:
+            self.follow(user, self.alice)
+
+        self.assertLessEqual(SiteFollowRollup.objects.filter(day=today).count(), 4)
+        [day] = get_site_follow_series(today, today)
+        self.assertEqual((day['gained'], day['lost']), (20, 0))
+
+    def test_backfill_keeps_the_larger_count(self):
+        today = timezone.localdate()
+        self.follow(self.alice, self.bob)
+        Relation.objects.bulk_create([Relation(from_user=self.carol, to_user=self.bob)])
+
+        backfill_follower_rollups()
+        backfill_follower_rollups()
+
+        self.assertEqual(get_follower_series(self.bob, today, today)[0]['gained'], 2)
+        self.assertEqual(get_site_follow_series(today, today)[0]['gained'], 2)
+
+
+# ----- BULK FOLLOW -----
+
+class BulkRelationTests(AccountsTestCase):
+    def test_bulk_follow_and_unfollow(self):
+        self.follow(self.alice, self.bob)
+
+        results = bulk_follow(self.alice, ['bob', 'carol', 'alice', 'nobody'])
+        self.assertEqual(results, {'bob': 'already_following', 'carol': 'followed', 'alice': 'self', 'nobody': 'not_found'})
+        self.assertEqual(self.alice.get_following_count(), 2)
+
+        results = bulk_unfollow(self.alice, ['bob', 'carol', 'bob'])
+        self.assertEqual(results, {'bob': 'unfollowed', 'carol': 'unfollowed'})
+        self.assertEqual(self.alice.get_following_count(), 0)
+
+    def test_follow_race_is_counted_once(self):
+        # Followed by another request after bulk_follow checked
+        with mock.patch.object(RelationManager, 'following_of', return_value=Relation.objects.none()):
+            self.follow(self.alice, self.bob)
+            results = bulk_follow(self.alice, ['bob', 'carol'])
+
+        self.assertEqual(results, {'bob': 'already_following', 'carol': 'followed'})
+        today = timezone.localdate()
+        self.assertEqual(get_follower_series(self.bob, today, today)[0]['gained'], 1)
+        self.assertEqual(get_site_follow_series(today, today)[0]['gained'], 2)
+
+    def test_unfollow_race_is_counted_once(self):
+        relation = self.follow(self.alice, self.bob)
+
+        self.assertEqual(delete_existing_edges([relation]), [relation])
+        self.assertEqual(delete_existing_edges([relation]), [])
+
+    def test_edges_are_deleted_without_loading_them(self):
+        relations = [self.follow(self.alice, self.bob), self.follow(self.alice, self.carol)]
+
+        with self.assertNumQueries(1):
+            delete_edges(relations)
+        self.assertEqual(self.alice.get_following_count(), 0)
+
+
+# ----- IMPORT -----
+
+def user_row(username, number, **kwargs):
+    return {
+        'username': username,
+        'email': f'{username}@example.com',
+        'first_name': 'First',
+        'last_name': 'Last',
+        'phone_number': f'+98912000{number:04d}',
+        'password': 'password',
+        **kwargs,
+    }
+
+
+class ImportTests(AccountsTestCase):
+    def import_users(self, rows, workers=0):
+        errors = []
+        with AccountImporter(workers=workers, on_error=lambda *error: errors.append(error)) as importer:
+            importer.import_users(enumerate(rows, start=1))
+        return importer.stats, errors
+
+    def import_relations(self, rows):
+        errors = []
+        with AccountImporter(workers=0, on_error=lambda *error: errors.append(error)) as importer:
+            importer.import_relations(enumerate(rows, start=1))
+        return importer.stats, errors
+
+    def test_users_are_validated_like_the_model(self):
+        stats, errors = self.import_users([
+            user_row('dave', 4),
+            user_row('x' * 31, 5),
+            user_row('erin', 6, first_name='F' * 16),
+            user_row('Frank', 7),
+            user_row('gina', 8, email='not-an-email'),
+        ])
+
+        self.assertEqual(stats['users_created'], 1)
+        self.assertEqual(stats['user_errors'], 4)
+        self.assertEqual([line for kind, line, message in errors], [2, 3, 4, 5])
+        self.assertTrue(errors[0][2].startswith('username: '))
+        self.assertTrue(errors[1][2].startswith('first_name: '))
+        self.assertTrue(User.objects.get(username='dave').check_password('password'))
+
+    def test_conflicts_are_reported_not_counted(self):
+        stats, errors = self.import_users([
+            user_row('alice', 4),
+            user_row('dave', 1),
+            user_row('erin', 5),
+            user_row('erin', 6),
+        ])
+
+        self.assertEqual(stats['users_created'], 1)
+        self.assertEqual([message for kind, line, message in errors], [
+            'Duplicate username in the input',
+            'This username already exists',
+            'This phone_number already exists',
+        ])
+
+    def test_concurrent_conflicts_are_not_counted(self):
+        # Taken by another writer after the batch checked the database
+        taken = {field: set() for field in ('username', 'email', 'phone_number')}
+        with mock.patch.object(AccountImporter, 'get_taken_values', return_value=taken):
+            stats, errors = self.import_users([user_row('alice', 4), user_row('dave', 5)])
+
+        self.assertEqual(stats['users_created'], 1)
+        self.assertEqual([line for kind, line, message in errors], [1])
+        self.assertEqual(User.objects.get(username='alice').email, 'alice@example.com')
+
+    def test_passwords_are_hashed_in_the_worker_pool(self):
+        stats, errors = self.import_users([
+            user_row('dave', 4),
+            user_row('erin', 5, password=None, password_hash=User.objects.get(username='alice').password),
+        ], workers=2)
+
+        self.assertEqual((stats['users_created'], errors), (2, []))
+        self.assertTrue(User.objects.get(username='dave').check_password('password'))
+        self.assertEqual(User.objects.get(username='erin').password, User.objects.get(username='alice').password)
+
+    def test_relations(self):
+        self.follow(self.alice, self.bob)
+
+        stats, errors = self.import_relations([
+            {'from_user': 'alice', 'to_user': 'bob'},
+            {'from_user': 'alice', 'to_user': 'carol'},
+            {'from_user': 'bob', 'to_user': 'carol'},
+            {'from_user': 'bob', 'to_user': 'carol'},
+            {'from_user': 'carol', 'to_user': 'carol'},
+            {'from_user': 'carol', 'to_user': 'nobody'},
+            {'from_user': 'carol'},
+        ])
+
+        self.assertEqual((stats['relations_created'], stats['relations_skipped']), (2, 1))
+        self.assertEqual([line for kind, line, message in errors], [5, 7, 6])
+        self.assertEqual(self.carol.get_followers_count(), 2)
+        self.assertEqual(self.alice.get_following_count(), 2)
+        today = timezone.localdate()
+        self.assertEqual(get_follower_series(self.carol, today, today)[0]['gained'], 2)
+
+
+# ----- INVALIDATION -----
+
+class Steps:
+    # A stop event for Transport.listen() that runs one step per poll
+    def __init__(self, *steps):
+        self.steps = list(steps)
+
+    def wait(self, timeout):
+        if not self.steps:
+            return True
+        self.steps.pop(0)()
+        return False
+
+
+class InvalidationTests(AccountsTestCase):
+    def test_saves_write_the_outbox(self):
+        ChangeEvent.objects.all().delete()
+        self.alice.first_name = 'Changed'
+        self.alice.save()
+
+        self.assertEqual(list(ChangeEvent.objects.values_list('tags', flat=True)), [['user:%s' % self.alice.pk, 'users']])
+
+    @mock.patch('accounts.invalidation.close_old_connections')
+    def test_database_transport_catches_late_commits(self, close_old_connections):
+        messages = []
+        transport = DatabaseTransport()
+        transport.poll_interval = 0
+
+        transport.listen(messages.append, Steps(
+            lambda: ChangeEvent.objects.create(pk=1000, tags=['user:2']),
+            lambda: None,
+            # Took its id before 1000 but committed after it was read
+            lambda: ChangeEvent.objects.create(pk=999, tags=['user:1']),
+            lambda: None,
+        ))
+
+        self.assertEqual([message['tags'] for message in messages], [['user:2'], ['user:1']])
+
+    def test_socket_gone_before_unlink(self):
+        transport = UnixSocketTransport('/nonexistent')
+
+        with mock.patch('accounts.invalidation.glob.glob', return_value=['/nonexistent/gone.sock']):
+            transport.publish({'id': 1, 'tags': ['users']})
+
+    @mock.patch('accounts.invalidation._subscribe', False)
+    @mock.patch('accounts.invalidation._subscriber', None)
+    def test_subscriber_only_where_enabled(self):
+        with mock.patch('accounts.invalidation.threading.Thread') as thread:
+            start_subscriber()
+            thread.assert_not_called()
+
+            enable_subscriber()
+            thread.return_value.start.assert_called_once_with()
+
+    def test_transports_implement_the_interface(self):
+        class ListenOnly(Transport):
+            def listen(self, callback, stop):
+                pass
+
+        with self.assertRaises(TypeError):
+            ListenOnly()
+        self.assertFalse(DatabaseTransport().publishes)
+
+
+class OutboxTransactionTests(TransactionTestCase):
+    def test_emit_requires_a_transaction(self):
+        with self.assertRaises(TransactionManagementError):
+            emit(['users'])
+
+    @test_settings
+    def test_rolled_back_change_leaves_no_event(self):
+        user = create_user('alice', 1)
+        ChangeEvent.objects.all().delete()
+
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                user.first_name = 'Changed'
+                user.save()
+                raise ValueError
+
+        self.assertFalse(ChangeEvent.objects.exists())
+        # Outside any transaction the save opens one for itself
+        user.save()
+        self.assertTrue(ChangeEvent.objects.exists())
+
+
+
+# ----- MUTUALS -----
+
+class MutualConnectionTests(AccountsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.mutuals = [create_user(f'mutual{index}', 100 + index) for index in range(3)]
+        start = timezone.now()
+        for index, user in enumerate(self.mutuals):
+            Relation.objects.create(from_user=self.alice, to_user=user, created_at=start + datetime.timedelta(minutes=index))
+            self.follow(user, self.bob)
+        # Followed by alice only, or following bob only: not mutual
+        self.follow(self.alice, self.carol)
+        self.follow(create_user('other', 200), self.bob)
+
+    def test_count_and_sample(self):
+        mutuals = get_mutual_connections(self.alice.pk, self.bob.pk)
+
+        self.assertEqual((mutuals.count, mutuals.exact, mutuals.others), (3, True, 1))
+        self.assertEqual(mutuals.usernames, ['mutual2', 'mutual1'])
+        self.assertFalse(get_mutual_connections(self.bob.pk, self.alice.pk))
+
+    @override_settings(MUTUALS_MAX_PROBE=2)
+    def test_probe_cap_gives_a_lower_bound(self):
+        mutuals = get_mutual_connections(self.alice.pk, self.bob.pk)
+
+        self.assertEqual((mutuals.count, mutuals.exact), (2, False))
+
+    def test_cached_until_either_side_changes(self):
+        self.assertEqual(get_mutual_connections(self.alice.pk, self.bob.pk).count, 3)
+
+        with self.assertNumQueries(0):
+            get_mutual_connections(self.alice.pk, self.bob.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.follow(self.carol, self.bob)
+        self.assertEqual(get_mutual_connections(self.alice.pk, self.bob.pk).count, 4)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.mutuals[2].username = 'renamed'
+            self.mutuals[2].save()
+        self.assertEqual(get_mutual_connections(self.alice.pk, self.bob.pk).usernames[0], 'renamed')
+
+
+# ----- JOBS -----
+
+class JobTests(AccountsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.handler = mock.Mock()
+        register('test_job', max_attempts=2)(self.handler)
+        self.addCleanup(_registry.pop, 'test_job')
+
+    def enqueue(self, name='test_job', payload=None):
+        with transaction.atomic():
+            return enqueue(name, payload)
+
+    def test_runs_and_deletes(self):
+        self.enqueue(payload={'value': 1})
+
+        self.assertEqual(run_jobs(), 1)
+        self.handler.assert_called_once_with(value=1)
+        self.assertFalse(Job.objects.exists())
+
+    def test_claimed_job_is_not_claimed_again(self):
+        job = self.enqueue()
+
+        token, jobs = claim_jobs(10, 60)
+        self.assertEqual(jobs, [job])
+        self.assertEqual(claim_jobs(10, 60)[1], [])
+
+    def test_failure_is_retried_then_kept(self):
+        self.handler.side_effect = ValueError('boom')
+        job = self.enqueue()
+
+        with self.assertLogs('accounts.jobs', 'ERROR'):
+            run_jobs()
+        job.refresh_from_db()
+        self.assertEqual((job.attempts, job.failed_at), (1, None))
+        self.assertGreater(job.run_at, timezone.now())
+
+        Job.objects.update(run_at=timezone.now())
+        with self.assertLogs('accounts.jobs', 'ERROR'):
+            run_jobs()
+        job.refresh_from_db()
+        self.assertIsNotNone(job.failed_at)
+        self.assertIn('boom', job.last_error)
+        self.assertEqual(run_jobs(), 0)
+
+    def test_expired_lease_is_delivered_again(self):
+        job = self.enqueue()
+        token, jobs = claim_jobs(10, 60)
+
+        # The worker holding it died: once the lease ran out another one runs it
+        Job.objects.update(run_at=timezone.now())
+        self.assertEqual(run_jobs(), 1)
+        self.handler.assert_called_once_with()
+        self.assertFalse(Job.objects.filter(pk=job.pk).exists())
+
+    def test_password_reset_code_is_not_kept(self):
+        send_sms = mock.Mock(side_effect=ValueError)
+        with mock.patch.object(_registry['send_sms'], 'func', send_sms):
+            job = self.enqueue('send_sms', {'phone_number': '+989120000001', 'message': '1234'})
+            with self.assertLogs('accounts.jobs', 'ERROR'):
+                run_jobs()
+                Job.objects.update(run_at=timezone.now())
+                run_jobs()
+
+            job.refresh_from_db()
+            self.assertEqual(send_sms.call_count, 2)
+            self.assertIsNotNone(job.failed_at)
+            self.assertEqual(job.payload, {})
+
+            # Not sent in time: dropped without running
+            job = self.enqueue('send_sms', {'phone_number': '+989120000001', 'message': '5678'})
+            Job.objects.filter(pk=job.pk).update(created_at=timezone.now() - datetime.timedelta(hours=1))
+            run_jobs()
+
+            job.refresh_from_db()
+            self.assertEqual(send_sms.call_count, 2)
+            self.assertEqual((job.last_error, job.payload), ('Expired', {}))
+
+
+# ----- ACTIVITY -----
+
+class ActivityTrackerTests(AccountsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.tracker = ActivityTracker(resolution=60, interval=0.01)
+        self.addCleanup(self.tracker.stop)
+
+    def test_buffers_once_per_resolution_and_flushes_in_bulk(self):
+        now = timezone.now()
+
+        self.assertTrue(self.tracker.record(self.alice.pk, when=now))
+        self.assertFalse(self.tracker.record(self.alice.pk, when=now + datetime.timedelta(seconds=30)))
+        self.assertFalse(self.tracker.record(self.bob.pk, when=now, previous=now - datetime.timedelta(seconds=10)))
+        self.assertTrue(self.tracker.record(self.carol.pk, 'last_login', when=now))
+
+        with self.assertNumQueries(2):
+            self.assertEqual(self.tracker.flush(), 2)
+        self.alice.refresh_from_db()
+        self.carol.refresh_from_db()
+        self.assertEqual((self.alice.last_seen, self.carol.last_login), (now, now))
+        self.assertEqual(self.tracker.flush(), 0)
+
+    def test_failed_flush_is_kept_for_the_next_one(self):
+        self.tracker.record(self.alice.pk)
+
+        with mock.patch.object(User.objects, 'bulk_update', side_effect=DatabaseError), self.assertLogs('utils.activity', 'ERROR'):
+            self.assertEqual(self.tracker.flush(), 0)
+        self.assertIn(self.alice.pk, self.tracker.pending['last_seen'])
+
+    def test_timer_only_where_enabled(self):
+        self.tracker.record(self.alice.pk)
+        self.assertIsNone(self.tracker.thread)
+
+        # Nothing to write from the thread
+        self.tracker.pending.clear()
+        self.assertTrue(self.tracker.enable_thread())
+        self.assertTrue(self.tracker.thread.is_alive())
+
+    @override_settings(ACTIVITY_FLUSH_THREAD=True)
+    def test_timer_flushes_without_another_record(self):
+        flushed = threading.Event()
+
+        with mock.patch.object(self.tracker, 'flush', side_effect=lambda: flushed.set()):
+            self.tracker.record(self.alice.pk)
+            self.assertTrue(flushed.wait(5))
+
+
+# ----- MEDIA -----
+
+class MediaTests(AccountsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        with open(os.path.join(self.root, 'file.txt'), 'wb') as file:
+            file.write(b'0123456789')
+
+    def get(self, path='file.txt', **headers):
+        response = serve_media(RequestFactory().get('/', headers=headers), path, self.root)
+        self.addCleanup(response.close)
+        return response
+
+    def content(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_whole_file(self):
+        response = self.get()
+        self.assertEqual((response.status_code, self.content(response)), (200, b'0123456789'))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=60')
+        self.assertEqual(self.get(**{'if-none-match': response['ETag']}).status_code, 304)
+
+    def test_ranges(self):
+        response = self.get(range='bytes=2-5')
+        self.assertEqual((response.status_code, self.content(response)), (206, b'2345'))
+        self.assertEqual((response['Content-Range'], response['Content-Length']), ('bytes 2-5/10', '4'))
+
+        response = self.get(range='bytes=-3')
+        self.assertEqual((response.status_code, self.content(response)), (206, b'789'))
+        self.assertEqual(response['Content-Range'], 'bytes 7-9/10')
+
+        response = self.get(range='bytes=8-20')
+        self.assertEqual((response.status_code, self.content(response)), (206, b'89'))
+
+        # Several ranges, or a malformed one: the whole file
+        for header in ('bytes=0-1,4-5', 'bytes=5-2', 'lines=1-2'):
+            response = self.get(range=header)
+            self.assertEqual((response.status_code, self.content(response)), (200, b'0123456789'))
+
+    def test_unsatisfiable_range(self):
+        for header in ('bytes=10-', 'bytes=-0'):
+            response = self.get(range=header)
+            self.assertEqual((response.status_code, response['Content-Range']), (416, 'bytes */10'))
+
+    def test_if_range(self):
+        etag = self.get()['ETag']
+        self.assertEqual(self.get(range='bytes=0-0', **{'if-range': etag}).status_code, 206)
+
+        response = self.get(range='bytes=0-0', **{'if-range': '"stale"'})
+        self.assertEqual((response.status_code, self.content(response)), (200, b'0123456789'))
+
+    def test_path_traversal(self):
+        for path in ('../file.txt', 'missing.txt', '/etc/passwd'):
+            with self.assertRaises(Http404):
+                serve_media(RequestFactory().get('/'), path, os.path.join(self.root, 'media'))
+
+    def test_compressed_files_are_not_content_encoded(self):
+        with open(os.path.join(self.root, 'archive.tar.gz'), 'wb') as file:
+            file.write(gzip.compress(b'data'))
+
+        response = self.get('archive.tar.gz')
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertNotIn('Content-Encoding', response)
+
+    def test_offload(self):
+        with override_settings(MEDIA_OFFLOAD='x-accel-redirect', MEDIA_OFFLOAD_PREFIX='/protected/'):
+            response = self.get()
+        self.assertEqual((response['X-Accel-Redirect'], response['Content-Type']), ('/protected/file.txt', 'text/plain'))
+        self.assertEqual(response.content, b'')
+
+        with override_settings(MEDIA_OFFLOAD='x-sendfile'):
+            response = self.get()
+        self.assertEqual(response['X-Sendfile'], os.path.join(self.root, 'file.txt'))
+
+
+# ----- STATIC FILES -----
+
+class CssPurgeTests(AccountsTestCase):
+    def purge(self, css, used=('btn', 'nav', 'active')):
+        return purge_css(css, lambda name: name in used)
+
+    def test_keeps_used_and_drops_unused_rules(self):
+        css = '/* theme */ .btn { color: red } .card { margin: 0 } body, a { margin: 0 }'
+        self.assertEqual(self.purge(css), '.btn { color: red }\nbody, a { margin: 0 }')
+
+    def test_drops_only_unused_selectors_of_a_rule(self):
+        self.assertEqual(self.purge('.btn, .card, #nav { top: 0 }'), '.btn, #nav { top: 0 }')
+        # Every name of a compound selector must be used
+        self.assertEqual(self.purge('.nav .card, .nav.active { top: 0 }'), '.nav.active { top: 0 }')
+        # Names inside :not() don't make a selector match anything
+        self.assertEqual(self.purge('.btn:not(.card) { top: 0 }'), '.btn:not(.card) { top: 0 }')
+
+    def test_purges_inside_media_and_keeps_other_at_rules(self):
+        css = (
+            '@charset "utf-8"; '
+            '@media (min-width: 1px) { .btn { top: 0 } .card { top: 0 } } '
+            '@media print { .card { top: 0 } } '
+            '@font-face { font-family: x; src: url("a{b}.woff") }'
+        )
+        self.assertEqual(self.purge(css), (
+            '@charset "utf-8";\n'
+            '@media (min-width: 1px) {\n.btn { top: 0 }\n}\n'
+            '@font-face { font-family: x; src: url("a{b}.woff") }'
+        ))
+
+
+class StaticFilesTests(AccountsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def write(self, name, data):
+        with open(os.path.join(self.root, name), 'wb') as file:
+            file.write(data)
+
+    def get(self, name='app.css', **headers):
+        response = serve_static(RequestFactory().get('/', headers=headers), name, self.root, {'app.abc123.css'})
+        if response is not None:
+            self.addCleanup(response.close)
+        return response
+
+    def content(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_compress_writes_smaller_variants(self):
+        storage = CompressedManifestStaticFilesStorage(location=self.root)
+        data = b'.btn { color: red }\n' * 100
+        self.write('app.css', data)
+        self.write('logo.png', data)
+        fake_brotli = mock.Mock(MODE_TEXT=1, compress=mock.Mock(return_value=b'br'))
+
+        with mock.patch('utils.staticfiles.brotli', fake_brotli):
+            self.assertEqual(list(storage.compress('app.css')), ['app.css.gz', 'app.css.br'])
+            self.assertEqual(list(storage.compress('logo.png')), [])
+
+        with storage.open('app.css.gz') as file:
+            self.assertEqual(gzip.decompress(file.read()), data)
+        with storage.open('app.css.br') as file:
+            self.assertEqual(file.read(), b'br')
+
+        # Not worth it for a file that doesn't shrink
+        self.write('tiny.css', b'a{}')
+        with mock.patch('utils.staticfiles.brotli', None):
+            self.assertEqual(list(storage.compress('tiny.css')), [])
+
+    def test_accepted_encodings(self):
+        self.assertEqual(get_accepted_encodings('gzip, deflate, br'), {'gzip', 'deflate', 'br'})
+        self.assertEqual(get_accepted_encodings('GZIP;q=0.5, br;q=0, identity;q=x'), {'gzip'})
+        self.assertEqual(get_accepted_encodings(''), set())
+
+    def test_negotiates_precompressed_variant(self):
+        self.write('app.css', b'plain')
+        self.write('app.css.gz', b'gz')
+        self.write('app.css.br', b'br')
+
+        for header, encoding, content in [
+            ('gzip, br', 'br', b'br'),
+            ('gzip', 'gzip', b'gz'),
+            ('gzip, br;q=0', 'gzip', b'gz'),
+            ('gzip;q=0', None, b'plain'),
+            ('', None, b'plain'),
+        ]:
+            with self.subTest(header=header):
+                response = self.get(**{'accept-encoding': header})
+                self.assertEqual(response.get('Content-Encoding'), encoding)
+                self.assertEqual(self.content(response), content)
+                self.assertEqual(response['Content-Type'], 'text/css')
+                self.assertEqual(response['Vary'], 'Accept-Encoding')
+
+    def test_no_vary_without_variants(self):
+        self.write('app.css', b'plain')
+        response = self.get(**{'accept-encoding': 'gzip'})
+        self.assertNotIn('Vary', response)
+        self.assertNotIn('Content-Encoding', response)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=60')
+        self.assertEqual(self.get(**{'if-none-match': response['ETag']}).status_code, 304)
+
+    def test_immutable_names_and_missing_files(self):
+        self.write('app.abc123.css', b'plain')
+        self.assertEqual(self.get('app.abc123.css')['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertIsNone(self.get('missing.css'))
+        self.assertIsNone(self.get('../app.css'))
+
+
+# ----- SESSIONS -----
+
+class SessionJanitorTests(AccountsTestCase):
+    def create_sessions(self, count, expire_date):
+        Session.objects.bulk_create(
+            Session(session_key=f'{expire_date:%Y%m%d}-{i}', session_data='', expire_date=expire_date)
+            for i in range(count)
+        )
+
+    def wait_for_janitor(self):
+        for thread in threading.enumerate():
+            if thread.name == 'session-janitor':
+                thread.join()
+
+    def test_purge_deletes_expired_sessions_in_batches(self):
+        now = timezone.now()
+        self.create_sessions(5, now - datetime.timedelta(days=1))
+        self.create_sessions(2, now + datetime.timedelta(days=1))
+        batches = []
+
+        stats = purge_expired_sessions(batch_size=2, pause=0, progress=lambda stats: batches.append(stats['purged']))
+
+        self.assertEqual(stats['purged'], 5)
+        self.assertEqual(stats['batches'], 3)
+        self.assertEqual(batches, [2, 4, 5])
+        self.assertEqual(Session.objects.count(), 2)
+        self.assertFalse(Session.objects.filter(expire_date__lt=now).exists())
+
+    def test_purge_stops_after_max_batches(self):
+        self.create_sessions(5, timezone.now() - datetime.timedelta(days=1))
+
+        stats = purge_expired_sessions(batch_size=2, max_batches=1, pause=0)
+
+        self.assertEqual(stats['purged'], 2)
+        self.assertEqual(Session.objects.count(), 3)
+
+    @override_settings(SESSION_JANITOR_PROBABILITY=0.5)
+    def test_middleware_runs_janitor_with_probability(self):
+        middleware = SessionJanitorMiddleware(lambda request: HttpResponse())
+        request = RequestFactory().get('/')
+
+        with mock.patch('utils.middleware.run_session_janitor_in_background') as run:
+            with mock.patch('utils.middleware.random.random', side_effect=[0.7, 0.3]):
+                middleware(request)
+                middleware(request)
+
+        run.assert_called_once_with()
+
+    def test_middleware_never_runs_janitor_when_disabled(self):
+        middleware = SessionJanitorMiddleware(lambda request: HttpResponse())
+
+        with mock.patch('utils.middleware.run_session_janitor_in_background') as run:
+            middleware(RequestFactory().get('/'))
+
+        run.assert_not_called()
+
+    @override_settings(SESSION_JANITOR_INTERVAL=60)
+    def test_janitor_runs_once_per_interval(self):
+        with mock.patch('utils.sessions._last_run', 0.0), mock.patch('utils.sessions.purge_expired_sessions') as purge:
+            self.assertTrue(run_session_janitor_in_background())
+            self.wait_for_janitor()
+            self.assertFalse(run_session_janitor_in_background())
+
+            with mock.patch('utils.sessions.time.monotonic', return_value=time.monotonic() + 61):
+                self.assertTrue(run_session_janitor_in_background())
+            self.wait_for_janitor()
+
+        self.assertEqual(purge.call_count, 2)
+
+
+# ----- STARTUP -----
+
+class StartupTests(AccountsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(startup_report.clear)
+
+    def test_warm_up_reports_each_step(self):
+        with mock.patch.object(availability_index, 'build', return_value=3):
+            report = warm_up(time.perf_counter() - 0.5)
+
+        self.assertEqual([name for name in report if isinstance(report[name], dict)], ['templates', 'url_resolvers', 'availability_index'])
+        self.assertGreater(report['templates']['count'], 0)
+        self.assertGreater(report['url_resolvers']['count'], 0)
+        self.assertEqual(report['availability_index']['count'], 3)
+        self.assertGreaterEqual(report['ready_ms'], 500)
+
+    @override_settings(STARTUP_BUDGET_MS=100)
+    def test_over_budget_and_unmigrated_database_are_logged(self):
+        with mock.patch.object(availability_index, 'build', side_effect=DatabaseError), self.assertLogs('utils.startup', 'WARNING') as logs:
+            report = warm_up(time.perf_counter() - 0.5)
+
+        self.assertIsNone(report['availability_index']['count'])
+        self.assertEqual(len(logs.records), 2)
+        self.assertIn('over the 100ms budget', logs.output[-1])
+
+    def test_background_threads(self):
+        for kwargs, run_in_server, starts_worker in [
+            ({}, True, True),
+            ({'jobs': False}, True, False),
+            ({}, False, False),
+        ]:
+            with (
+                self.subTest(kwargs=kwargs, run_in_server=run_in_server),
+                override_settings(JOBS_RUN_IN_SERVER=run_in_server),
+                mock.patch.object(activity_tracker, 'enable_thread') as enable_thread,
+                mock.patch('accounts.invalidation.enable_subscriber') as enable_subscriber,
+                mock.patch('accounts.jobs.enable_worker') as enable_worker,
+            ):
+                start_background_threads(**kwargs)
+
+                enable_thread.assert_called_once_with()
+                enable_subscriber.assert_called_once_with()
+                self.assertEqual(enable_worker.called, starts_worker)
+
+    def test_profile_startup(self):
+        importtime = '\n'.join([
+            'import time: self [us] | cumulative | imported package',
+            'import time:       100 |        100 |   json.decoder',
+            'import time:      2000 |       5000 | django',
+        ])
+        boot = {
+            'report': {'templates': {'count': 9, 'ms': 1.5}, 'ready_ms': 2000},
+            'rss_kb': 40960,
+            'loaded_lazy_modules': ['PIL'],
+        }
+        self.assertEqual(parse_importtime(importtime), [('json.decoder', 100, 100), ('django', 2000, 5000)])
+
+        result = mock.Mock(returncode=0, stdout=json.dumps(boot), stderr=importtime)
+        stdout = StringIO()
+        with mock.patch('subprocess.run', return_value=result) as run, self.settings(STARTUP_BUDGET_MS=1500):
+            call_command('profile_startup', '--module', 'config.asgi', stdout=stdout)
+            with self.assertRaises(CommandError):
+                call_command('profile_startup', '--fail-over-budget', stdout=StringIO())
+
+        self.assertIn('import config.asgi', run.call_args_list[0].args[0][-1])
+        output = stdout.getvalue()
+        self.assertLess(output.index('django'), output.index('json.decoder'))
+        self.assertIn('Warm-up templates: 9 in 1.5ms', output)
+        self.assertIn('RSS after boot: 40.0MB', output)
+        self.assertIn('PIL was imported during boot', output)
+        self.assertIn('over the 1500ms budget', output)
+
+
+# ----- MEMORY -----
+
+class MemoryProfilingTests(AccountsTestCase):
+    def setUp(self):
+        super().setUp()
+        start_tracking()
+        self.addCleanup(stop_tracking)
+
+    def test_response_body_is_not_retained(self):
+        response, peak, retained = measure_allocations(lambda: HttpResponse(b'x' * 1_000_000))
+
+        self.assertGreaterEqual(peak, 1_000_000)
+        self.assertLess(retained, 100_000)
+
+    def test_one_measurement_at_a_time(self):
+        inner = []
+        response, peak, retained = measure_allocations(lambda: inner.append(measure_allocations(HttpResponse)))
+
+        self.assertIsNotNone(peak)
+        self.assertEqual(inner[0][1:], (None, None))
+
+    @override_settings(MEMORY_PROFILING=True, MEMORY_SAMPLE_RATE=1.0)
+    def test_unresolved_paths_share_one_entry(self):
+        middleware = MemoryProfilingMiddleware(lambda request: HttpResponse(status=404))
+
+        for path in ('/missing-1/', '/missing-2/'):
+            middleware(RequestFactory().get(path))
+        self.assertEqual([view['view'] for view in request_memory_stats.get_report()], [UNRESOLVED_VIEW])
+        self.assertEqual(request_memory_stats.get_report()[0]['requests'], 2)
+
+
+# ----- QUERY PLANS -----
+
+class QueryPlanTests(AccountsTestCase):
+    def test_plan_problems(self):
+        self.assertEqual(get_plan_problems(['SEARCH accounts_customuser USING INDEX sqlite_autoindex (username=?)']), set())
+        self.assertEqual(get_plan_problems(['MATERIALIZE ids', 'SCAN ids']), set())
+        self.assertEqual(get_plan_problems(['SCAN accounts_customuser', 'USE TEMP B-TREE FOR ORDER BY']), {'scan', 'sort'})
+
+    def test_plan_problems_of_an_index_walk(self):
+        plan = ['SCAN accounts_customuser USING INDEX accounts_user_rank']
+        self.assertEqual(get_plan_problems(plan, limited=True), set())
+        self.assertEqual(get_plan_problems(plan), {'scan'})
+        self.assertEqual(get_plan_problems([*plan, 'USE TEMP B-TREE FOR ORDER BY'], limited=True), {'scan', 'sort'})
+
+    def test_pages_use_indexes(self):
+        self.follow(self.alice, self.bob)
+        self.follow(self.bob, self.alice)
+        self.follow(self.carol, self.alice)
+
+        stdout = StringIO()
+        call_command('check_query_plans', username='alice', search='ali', stdout=stdout)
+        self.assertIn('people list: ', stdout.getvalue())
+        self.assertIn('All query plans use indexes', stdout.getvalue())
+
+
+# ----- SHARDING -----
+
+# Declared by config.test_settings, which manage.py test uses
+SHARDS = getattr(settings, 'RELATION_TEST_SHARDS', [])
+
+
+@skipUnless(SHARDS, 'No RELATION_TEST_SHARDS databases')
+@override_settings(RELATION_SHARDS=SHARDS)
+class ShardedRelationTests(AccountsTestCase):
+    databases = {'default', *SHARDS}
+
+    def get_copies(self, model, from_user, to_user):
+        return [db for db in SHARDS if model.objects.using(db).filter(from_user_id=from_user.pk, to_user_id=to_user.pk).exists()]
+
+    def test_follow_and_unfollow(self):
+        self.client.force_login(self.alice)
+
+        self.client.get(reverse('accounts:user-follow', args=['bob']))
+        self.assertEqual(self.get_copies(Relation, self.alice, self.bob), [get_shard(self.bob.pk)])
+        self.assertEqual(self.get_copies(RelationMirror, self.alice, self.bob), [get_shard(self.alice.pk)])
+        self.assertEqual((self.bob.get_followers_count(), self.alice.get_following_count()), (1, 1))
+
+        self.client.get(reverse('accounts:user-unfollow', args=['bob']))
+        self.assertEqual(self.get_copies(Relation, self.alice, self.bob), [])
+        self.assertEqual(self.get_copies(RelationMirror, self.alice, self.bob), [])
+        self.assertEqual((self.bob.get_followers_count(), self.alice.get_following_count()), (0, 0))
+
+    def test_failed_mirror_write_rolls_back_the_edge(self):
+        with mock.patch('accounts.signals.save_edges', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                self.follow(self.alice, self.bob)
+
+        self.assertEqual(self.get_copies(Relation, self.alice, self.bob), [])
+        self.assertFalse(FollowerRollup.objects.exists())
+
+    def test_lists_page_newest_first(self):
+        start = timezone.now()
+        followers = [create_user(f'follower{index}', 100 + index) for index in range(12)]
+        for index, follower in enumerate(followers):
+            Relation.objects.create(from_user=follower, to_user=self.bob, created_at=start + datetime.timedelta(minutes=index))
+
+        self.client.force_login(self.alice)
+        url = reverse('accounts:user-follower-list', args=['bob'])
+        pages = [self.client.get(url, {'page': page}).context['page_obj'] for page in (1, 2)]
+        self.assertEqual(pages[0].paginator.count, 12)
+        self.assertEqual([card.username for page in pages for card in page], [follower.username for follower in reversed(followers)])
+
+        # A cached search narrows the edges, an uncached one walks them
+        for enabled in (True, False):
+            with self.settings(SEARCH_CACHE_ENABLE=enabled):
+                page = self.client.get(url, {'search': 'follower1'}).context['page_obj']
+            self.assertEqual([card.username for card in page], ['follower11', 'follower10', 'follower1'])
+            self.assertEqual(page.paginator.count, 3)
+
+        self.assertEqual(list(followers[0].get_following_list()), [self.bob])
+
+    def test_profile_edit_touches_lists_in_a_job(self):
+        self.follow(self.alice, self.bob)
+        self.bob.refresh_from_db()
+        before = self.bob.relations_updated_at
+
+        self.alice.first_name = 'Changed'
+        self.alice.save()
+        self.assertTrue(Job.objects.filter(name='touch_relation_lists').exists())
+        run_jobs()
+
+        self.bob.refresh_from_db()
+        self.assertGreater(self.bob.relations_updated_at, before)
+
+    def test_user_deletion_removes_edges_after_commit(self):
+        self.follow(self.alice, self.bob)
+        self.follow(self.carol, self.alice)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.alice.delete()
+
+        self.assertEqual(count_edges(SHARDS), 0)
+        self.assertFalse(any(RelationMirror.objects.using(db).exists() for db in SHARDS))
+        self.assertEqual(User.objects.get(pk=self.bob.pk).followers_count, 0)
+
+    def test_reshard_and_prune(self):
+        self.follow(self.alice, self.bob)
+        self.follow(self.bob, self.carol)
+        self.follow(self.carol, self.alice)
+
+        self.assertEqual(copy_edges(SHARDS, ['relations_1']), 3)
+        self.assertEqual(count_edges(['relations_1']), 3)
+
+        with self.settings(RELATION_SHARDS=['relations_1']):
+            prune_edges(['relations_1'], ['default', *SHARDS])
+
+            self.assertFalse(Relation.objects.using('relations_0').exists())
+            self.assertFalse(RelationMirror.objects.using('relations_0').exists())
+            self.assertEqual(count_edges(['relations_1']), 3)
+            self.assertEqual(list(self.alice.get_following_list()), [self.bob])
+            self.assertEqual(list(self.alice.get_follower_list()), [self.carol])
+
+    def test_repair(self):
+        self.follow(self.alice, self.bob)
+        # A lost mirror, a mirror without its edge and an edge of a deleted user
+        RelationMirror.objects.using(get_shard(self.alice.pk)).all().delete()
+        RelationMirror.objects.using(get_shard(self.carol.pk)).create(from_user_id=self.carol.pk, to_user_id=self.bob.pk)
+        BulkRelation.objects.using(get_shard(self.bob.pk)).create(from_user_id=999, to_user_id=self.bob.pk)
+
+        self.assertEqual(repair_edges(SHARDS), 2)
+        self.assertEqual(list(self.alice.get_following_list()), [self.bob])
+        self.assertEqual(self.carol.get_following_count(), 0)
+        self.assertEqual(self.bob.get_followers_count(), 1)
@@ -8,6 +8,7 @@ urlpatterns = [
     path('register/', views.UserCreateView.as_view(), name='user-create'),
     path('login/', views.UserLoginView.as_view(), name='user-login'),
     path('logout/', views.UserLogoutView.as_view(), name='user-logout'),
+    path('check-availability/', views.UserAvailabilityView.as_view(), name='user-availability'),
 
     path('reset-password/', views.UserPasswordResetView.as_view(), name='user-password-reset'),
     path('verify-code/', views.UserPasswordVerifyCodeView.as_view(), name='user-password-verify-code'),
@@ -18,11 +19,20 @@ urlpatterns = [
     path('delete-profile-image/', views.UserProfileImageDeleteView.as_view(), name='user-profile-image-delete'),
     
     path('', views.UserListView.as_view(), name='user-list'),
+    path('follow-growth/', views.SiteFollowGrowthView.as_view(), name='site-follow-growth'),
+    path('memory-profile/', views.MemoryProfileView.as_view(), name='memory-profile'),
+    path('bulk-follow/', views.UserBulkFollowView.as_view(), name='user-bulk-follow'),
+    path('bulk-unfollow/', views.UserBulkUnfollowView.as_view(), name='user-bulk-unfollow'),
     
     path('<username>/', views.UserDetailView.as_view(), name='user-detail'),
     path('<username>/follow/', views.UserFollowView.as_view(), name='user-follow'),
     path('<username>/unfollow/', views.UserUnfollowView.as_view(), name='user-unfollow'),
+    path('<username>/events/', views.UserEventStreamView.as_view(), name='user-events'),
     
     path('<username>/followers/', views.UserFollowerListView.as_view(), name='user-follower-list'),
     path('<username>/following/', views.UserFollowingListView.as_view(), name='user-following-list'),
+
+    path('<username>/followers/export/', views.UserFollowerExportView.as_view(), name='user-follower-export'),
+    path('<username>/following/export/', views.UserFollowingExportView.as_view(), name='user-following-export'),
+    path('<username>/follower-growth/', views.UserFollowerGrowthView.as_view(), name='user-follower-growth'),
 ]
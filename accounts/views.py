@@ -1,17 +1,37 @@
-import os
 import random
+import datetime
+import json
 
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse, HttpResponseBadRequest, JsonResponse, Http404
 from django.shortcuts import render, redirect, get_object_or_404
-from django.db.models import Q, Count
+from django.db import transaction
+from django.utils import timezone
 from django.views import View
+from django.views.decorators.http import condition
+from django.views.decorators.cache import cache_control
+from django.utils.decorators import method_decorator
 from django.contrib import messages
 from django.contrib.auth import login, logout, get_user_model
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.contrib.auth.views import redirect_to_login
 
-from utils.mixins import AnonymousRequiredMixin, SelfForbiddenRequiredMixin
-from utils.pagination import get_pagination_context
-from utils.base import send_sms
+from utils.mixins import AnonymousRequiredMixin, SelfForbiddenRequiredMixin, RateLimitMixin, StaffRequiredMixin
+from utils.pubsub import get_broker
+from utils.pagination import UncountedPaginator, get_pagination_context
+from utils.staticfiles import get_accepted_encodings
+from utils.memory import is_enabled as is_memory_profiling_enabled, is_tracking, get_memory_report, start_tracking, stop_tracking, set_baseline
 from .models import Relation
+from .exports import EXPORT_FORMATS, iter_export
+from .conditional import user_page_etag, user_page_last_modified, user_list_condition
+from .availability import PUBLIC_AVAILABILITY_FIELDS, check_availability
+from .cards import get_user_cards
+from .events import format_snapshot, stream_user_events
+from .rollups import get_follower_series, get_site_follow_series
+from .relations import bulk_follow, bulk_unfollow
+from .search import search_users
+from .jobs import enqueue
 from .forms import (
     UserCreateForm,
     UserLoginForm,
@@ -25,6 +45,11 @@ from .forms import (
 
 User = get_user_model()
 
+user_page_condition = method_decorator([
+    cache_control(private=True, no_cache=True),
+    condition(etag_func=user_page_etag, last_modified_func=user_page_last_modified),
+], name='get')
+
 
 class UserCreateView(AnonymousRequiredMixin, View):
     template_name = 'accounts/user_create.html'
@@ -36,17 +61,17 @@ class UserCreateView(AnonymousRequiredMixin, View):
     def post(self, request):
         form = self.form_class(request.POST)
 
-        if not form.is_valid():
+        if not form.is_valid() or form.save() is None:
             return render(request, self.template_name, {'form': form})
         
-        form.save()
         messages.success(request, 'Registered successfully', 'success')
         return redirect('accounts:user-login')
 
 
-class UserLoginView(AnonymousRequiredMixin, View):
+class UserLoginView(AnonymousRequiredMixin, RateLimitMixin, View):
     template_name = 'accounts/user_login.html'
     form_class = UserLoginForm
+    ratelimit_rules = [('ip', '20/m'), ('post:username', '5/m')]
 
     def get(self, request):
         return render(request, self.template_name, {'form': self.form_class()})
@@ -63,6 +88,15 @@ class UserLoginView(AnonymousRequiredMixin, View):
         return redirect('index')
 
 
+class UserAvailabilityView(RateLimitMixin, View):
+    ratelimit_rules = [('ip', '120/m')]
+    ratelimit_methods = ['GET']
+
+    def get(self, request):
+        values = {field: request.GET.get(field, '').strip() for field in PUBLIC_AVAILABILITY_FIELDS}
+        return JsonResponse(check_availability(**values))
+
+
 class UserLogoutView(LoginRequiredMixin, View):
     def get(self, request):
         logout(request)
@@ -72,9 +106,10 @@ class UserLogoutView(LoginRequiredMixin, View):
 
 # ---- RESET PASSWORD ----
 
-class UserPasswordResetView(AnonymousRequiredMixin, View):
+class UserPasswordResetView(AnonymousRequiredMixin, RateLimitMixin, View):
     template_name = 'accounts/user_password_reset.html'
     form_class = UserPasswordResetForm
+    ratelimit_rules = [('ip', '10/h'), ('post:username', '3/h')]
 
     def get(self, request):
         return render(request, self.template_name, {'form': self.form_class()})
@@ -94,7 +129,7 @@ class UserPasswordResetView(AnonymousRequiredMixin, View):
             'otp_code': otp_code,
         }
 
-        send_sms(user.phone_number, otp_code)
+        enqueue('send_sms', {'phone_number': str(user.phone_number), 'message': str(otp_code)})
         messages.success(request, 'We sent you a code', 'success')
         return redirect('accounts:user-password-verify-code')
 
@@ -170,10 +205,9 @@ class UserUpdateView(LoginRequiredMixin, View):
     def post(self, request):
         form = self.form_class(request.POST, request.FILES, user=request.user)
 
-        if not form.is_valid():
+        if not form.is_valid() or form.save() is None:
             return render(request, self.template_name, {'form': form})
 
-        form.save()
         messages.success(request, 'Profile edited successfully', 'success')
         return redirect(request.user.get_absolute_url())
 
@@ -192,6 +226,7 @@ class UserDeleteView(LoginRequiredMixin, View):
             return render(request, self.template_name, {'form': form})
         
         form.save()
+        logout(request)
         messages.success(request, 'Account deleted successfully', 'success')
         return redirect('index')
 
@@ -200,36 +235,34 @@ class UserProfileImageDeleteView(LoginRequiredMixin, View):
     def get(self, request):
         user = request.user
 
-        if user.image and user.image.path:
-            os.remove(user.image.path)
-            user.image.delete()
+        if user.image:
+            # The file itself goes in the background sweep once unreferenced
+            user.image = None
+            user.save(update_fields=['image', 'updated_at'])
             messages.success(request, 'Profile image deleted successfully', 'success')
         return redirect(user.get_absolute_url())
 
 
-class UserListView(LoginRequiredMixin, View):
+class UserListView(LoginRequiredMixin, RateLimitMixin, View):
     template_name = 'accounts/user_list.html'
+    ratelimit_rules = [('user', '30/m')]
+
+    def should_ratelimit(self, request):
+        return bool(request.GET.get('search'))
 
     def get(self, request):
-        user_list = User.objects.annotate(
-            followers_count=Count('followers'),
-        ).order_by('-followers_count')
-
-        if request.GET.get('search'):
-            search = request.GET['search']
-            user_list = user_list.filter(
-                Q(username__icontains=search) |
-                Q(email__icontains=search) |
-                Q(first_name__icontains=search) |
-                Q(last_name__icontains=search) |
-                Q(bio__icontains=search)
-            )
+        # Most followed first, a page at a time on the accounts_user_rank index
+        user_list = search_users(
+            User.objects.filter(is_active=True).order_by('-followers_count', 'pk'),
+            request.GET.get('search', ''),
+        )[0]
 
         return render(request, self.template_name, {
-            'page_obj': get_pagination_context(request, user_list, 10),
+            'page_obj': get_pagination_context(request, get_user_cards(user_list), 10, paginator_class=UncountedPaginator),
         })
 
 
+@user_page_condition
 class UserDetailView(LoginRequiredMixin, View):
     template_name = 'accounts/user_detail.html'
 
@@ -237,72 +270,246 @@ class UserDetailView(LoginRequiredMixin, View):
         user = get_object_or_404(User, username=kwargs['username'])
         return render(request, self.template_name, {
             'user': user,
-            'is_followed': Relation.objects.filter(from_user=request.user, to_user=user).exists(),
+            'is_followed': Relation.objects.between(request.user.pk, user.pk).exists(),
+            'mutuals': user.get_mutual_connections(request.user) if user != request.user else None,
         })
 
 
-class UserFollowView(LoginRequiredMixin, SelfForbiddenRequiredMixin, View):
+class UserEventStreamView(RateLimitMixin, View):
+    # Live over ASGI. Under WSGI a response is read to its end before it is
+    # sent, so an endless stream would hold a worker thread forever: there the
+    # response is the current counts alone, and EventSource reconnects every
+    # EVENTS_POLL_SECONDS instead. Events on a process-local broker don't reach
+    # other workers, so with one that fallback is off: 204 tells EventSource to
+    # stop reconnecting.
+    ratelimit_rules = [('user', '30/m')]
+    ratelimit_methods = ['GET']
+
+    async def get(self, request, **kwargs):
+        if not (await request.auser()).is_authenticated:
+            return redirect_to_login(request.get_full_path())
+
+        user = await User.objects.filter(username=kwargs['username']).afirst()
+        if user is None:
+            raise Http404
+
+        streaming = isinstance(request, ASGIRequest)
+        if not streaming and not get_broker().spans_processes:
+            return HttpResponse(status=204)
+
+        counts = {
+            'followers_count': await Relation.objects.followers_of(user.pk).acount(),
+            'following_count': await Relation.objects.following_of(user.pk).acount(),
+        }
+        if streaming:
+            response = StreamingHttpResponse(stream_user_events(user.pk, counts), content_type='text/event-stream')
+        else:
+            poll = getattr(settings, 'EVENTS_POLL_SECONDS', 30)
+            response = HttpResponse(format_snapshot(counts, poll), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+class UserFollowView(LoginRequiredMixin, RateLimitMixin, SelfForbiddenRequiredMixin, View):
+    ratelimit_rules = [('user', '30/m'), ('ip', '60/m')]
+    ratelimit_methods = ['GET']
+
     def get(self, request, **kwargs):
         user = get_object_or_404(User, username=kwargs['username'])
 
-        if not Relation.objects.filter(from_user=request.user, to_user=user).exists():
-            Relation.objects.create(from_user=request.user, to_user=user)
+        if not Relation.objects.between(request.user.pk, user.pk).exists():
+            with transaction.atomic():
+                Relation.objects.create(from_user=request.user, to_user=user)
             messages.success(request, 'Followed successfully', 'success')
         return redirect(user.get_absolute_url())
 
 
-class UserUnfollowView(LoginRequiredMixin, SelfForbiddenRequiredMixin, View):
+class UserUnfollowView(LoginRequiredMixin, RateLimitMixin, SelfForbiddenRequiredMixin, View):
+    ratelimit_rules = [('user', '30/m'), ('ip', '60/m')]
+    ratelimit_methods = ['GET']
+
     def get(self, request, **kwargs):
         user = get_object_or_404(User, username=kwargs['username'])
-        relation = Relation.objects.filter(from_user=request.user, to_user=user)
+        relation = Relation.objects.between(request.user.pk, user.pk).first()
 
-        if relation.exists():
-            relation.delete()
+        if relation is not None:
+            with transaction.atomic():
+                relation.delete()
             messages.success(request, 'Unfollowed successfully.', 'success')
         return redirect(user.get_absolute_url())
 
 
+class UserBulkRelationView(LoginRequiredMixin, RateLimitMixin, View):
+    ratelimit_rules = [('user', '10/m')]
+    max_usernames = 100
+    action = None
+
+    def get_usernames(self, request):
+        if request.content_type == 'application/json':
+            try:
+                usernames = json.loads(request.body).get('usernames')
+            except (ValueError, AttributeError):
+                return None
+        else:
+            usernames = request.POST.getlist('usernames')
+
+        if not isinstance(usernames, list) or not all(isinstance(username, str) for username in usernames):
+            return None
+        return list(dict.fromkeys(username.strip() for username in usernames if username.strip()))
+
+    def post(self, request):
+        usernames = self.get_usernames(request)
+
+        if not usernames or len(usernames) > self.max_usernames:
+            return HttpResponseBadRequest(f'Send between 1 and {self.max_usernames} usernames')
+        return JsonResponse({'results': self.action(request.user, usernames)})
+
+
+class UserBulkFollowView(UserBulkRelationView):
+    action = staticmethod(bulk_follow)
+
+
+class UserBulkUnfollowView(UserBulkRelationView):
+    action = staticmethod(bulk_unfollow)
+
+
+def get_relation_page(request, username, direction):
+    # Built once per request, the list's conditional validators read it first
+    cache = request.__dict__.setdefault('_relation_pages', {})
+
+    if (username, direction) not in cache:
+        user = get_object_or_404(User, username=username)
+        user_list = user.get_follower_list() if direction == 'followers' else user.get_following_list()
+        user_list, count = search_users(user_list, request.GET.get('search', ''), (direction, user.pk))
+
+        page_obj = get_pagination_context(request, get_user_cards(user_list), 10, count)
+        page_obj.object_list = list(page_obj.object_list)
+        cache[username, direction] = user, page_obj
+    return cache[username, direction]
+
+
+def get_relation_page_condition(direction):
+    return method_decorator([
+        cache_control(private=True, no_cache=True),
+        user_list_condition(lambda request, username: get_relation_page(request, username, direction)[1]),
+    ], name='get')
+
+
+@get_relation_page_condition('followers')
 class UserFollowerListView(LoginRequiredMixin, View):
     template_name = 'accounts/user_follower_list.html'
 
     def get(self, request, **kwargs):
-        user = get_object_or_404(User, username=kwargs['username'])
-        follower_list = user.get_follower_list()
-
-        if request.GET.get('search'):
-            search = request.GET['search']
-            follower_list = follower_list.filter(
-                Q(username__contains=search) |
-                Q(email__contains=search) |
-                Q(first_name__contains=search) |
-                Q(last_name__contains=search) |
-                Q(bio__contains=search)
-            )
-
+        user, page_obj = get_relation_page(request, kwargs['username'], 'followers')
         return render(request, self.template_name, {
             'user': user,
-            'page_obj': get_pagination_context(request, follower_list, 10),
+            'page_obj': page_obj,
         })
 
 
+@get_relation_page_condition('following')
 class UserFollowingListView(LoginRequiredMixin, View):
     template_name = 'accounts/user_following_list.html'
 
     def get(self, request, **kwargs):
-        user = get_object_or_404(User, username=kwargs['username'])
-        following_list = user.get_following_list()
-
-        if request.GET.get('search'):
-            search = request.GET['search']
-            following_list = following_list.filter(
-                Q(username__icontains=search) |
-                Q(email__icontains=search) |
-                Q(first_name__icontains=search) |
-                Q(last_name__icontains=search) |
-                Q(bio__icontains=search)
-            )
-
+        user, page_obj = get_relation_page(request, kwargs['username'], 'following')
         return render(request, self.template_name, {
             'user': user,
-            'page_obj': get_pagination_context(request, following_list, 10),
+            'page_obj': page_obj,
         })
+
+
+class UserRelationExportView(LoginRequiredMixin, View):
+    direction = None
+
+    def get(self, request, **kwargs):
+        user = get_object_or_404(User, username=kwargs['username'])
+        export_format = request.GET.get('format', 'ndjson')
+        cursor = request.GET.get('cursor', '0')
+
+        if export_format not in EXPORT_FORMATS or not cursor.isdigit():
+            return HttpResponseBadRequest('Invalid export parameters')
+
+        gzip = 'gzip' in get_accepted_encodings(request.headers.get('Accept-Encoding', ''))
+        response = StreamingHttpResponse(
+            iter_export(user, self.direction, export_format, int(cursor), gzip=gzip),
+            content_type=EXPORT_FORMATS[export_format],
+        )
+        response['Content-Disposition'] = f'attachment; filename="{user.username}_{self.direction}.{export_format}"'
+        response['Vary'] = 'Accept-Encoding'
+        if gzip:
+            response['Content-Encoding'] = 'gzip'
+        return response
+
+
+class UserFollowerExportView(UserRelationExportView):
+    direction = 'followers'
+
+
+class UserFollowingExportView(UserRelationExportView):
+    direction = 'following'
+
+
+class FollowGrowthMixin:
+    max_days = 366
+
+    def get_range(self, request):
+        days = request.GET.get('days', '30')
+        period = request.GET.get('period', 'day')
+
+        if not days.isdigit() or not 0 < int(days) <= self.max_days or period not in ('day', 'week'):
+            return None
+
+        end = timezone.localdate()
+        return end - datetime.timedelta(days=int(days) - 1), end, period
+
+
+class UserFollowerGrowthView(LoginRequiredMixin, FollowGrowthMixin, View):
+    def get(self, request, **kwargs):
+        user = get_object_or_404(User, username=kwargs['username'])
+        date_range = self.get_range(request)
+
+        if date_range is None:
+            return HttpResponseBadRequest('Invalid growth parameters')
+        return JsonResponse({'series': get_follower_series(user, *date_range)})
+
+
+class SiteFollowGrowthView(StaffRequiredMixin, FollowGrowthMixin, View):
+    def get(self, request):
+        date_range = self.get_range(request)
+
+        if date_range is None:
+            return HttpResponseBadRequest('Invalid growth parameters')
+        return JsonResponse({'series': get_site_follow_series(*date_range)})
+
+
+class MemoryProfileView(StaffRequiredMixin, View):
+    # Memory of the worker process that serves the request: GET reports, POST
+    # action=start|baseline|stop toggles tracemalloc (see utils.memory)
+    max_limit = 100
+
+    def dispatch(self, request, *args, **kwargs):
+        if not is_memory_profiling_enabled():
+            raise Http404
+        return super().dispatch(request, *args, **kwargs)
+
+    def get(self, request):
+        limit = request.GET.get('limit', '20')
+
+        if not limit.isdigit() or not 0 < int(limit) <= self.max_limit:
+            return HttpResponseBadRequest(f'limit must be between 1 and {self.max_limit}')
+        return JsonResponse(get_memory_report(int(limit)))
+
+    def post(self, request):
+        action = request.POST.get('action')
+
+        if action == 'start':
+            start_tracking()
+        elif action == 'stop':
+            stop_tracking()
+        elif action == 'baseline' and is_tracking():
+            set_baseline()
+        else:
+            return HttpResponseBadRequest('action must be start, baseline (while tracing) or stop')
+        return JsonResponse(get_memory_report())
@@ -50,12 +50,16 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'utils.middleware.StaticFilesMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'utils.middleware.SessionJanitorMiddleware',
+    'utils.middleware.ActivityMiddleware',
+    'utils.middleware.MemoryProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'config.urls'
@@ -129,6 +133,15 @@ STATICFILES_DIRS = [
     os.path.join(BASE_DIR, 'staticfiles'),
 ]
 
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'utils.staticfiles.CompressedManifestStaticFilesStorage',
+    },
+}
+
 # Media files
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
@@ -143,4 +156,171 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'accounts.CustomUser'
 
+# Rows fetched per round trip by the follower/following exports
+ACCOUNTS_EXPORT_CHUNK_SIZE = 2000
+
+# Rate limiting: 'local' keeps per-process counters, 'cache' shares them
+# through RATELIMIT_CACHE_ALIAS for multi-process deployments
+RATELIMIT_ENABLE = True
+RATELIMIT_BACKEND = 'local'
+RATELIMIT_CACHE_ALIAS = 'default'
+RATELIMIT_MAX_KEYS = 100_000
+RATELIMIT_IP_META_KEY = 'REMOTE_ADDR'
+
+# Bloom filter of taken usernames/emails/phone numbers, built by the worker
+# warm-up: a miss lets the signup/profile forms skip the uniqueness query (the
+# unique constraints confirm it), the check-availability/ endpoint still asks
+# the database
+AVAILABILITY_BLOOM_CAPACITY = 1_000_000
+AVAILABILITY_BLOOM_ERROR_RATE = 0.01
+AVAILABILITY_BLOOM_REBUILD_INTERVAL = 3600
+AVAILABILITY_BLOOM_MAX_STALE = 10_000
+
+# Worker warm-up on boot (config/wsgi.py, config/asgi.py) and the
+# time-to-ready budget checked by it and by `manage.py profile_startup`
+STARTUP_WARMUP = True
+STARTUP_BUDGET_MS = 1500
+# Modules that must stay out of the boot path, they are imported on first use
+STARTUP_LAZY_MODULES = ['PIL']
+
+# Live follower events (server-sent events over ASGI). Swap PUBSUB_BROKER for
+# a broker shared between processes when running several ASGI workers. Under
+# WSGI the event stream only sends the current counts and the browser polls it
+# every EVENTS_POLL_SECONDS, unless the broker is LocalBroker: then it answers
+# 204 and the browser stops asking.
+PUBSUB_BROKER = 'utils.pubsub.LocalBroker'
+EVENTS_HEARTBEAT_SECONDS = 15
+EVENTS_QUEUE_SIZE = 100
+EVENTS_POLL_SECONDS = 30
+
+# Rows each day of the site-wide follow rollup is striped over, so follows
+# and unfollows don't serialize on one row
+SITE_ROLLUP_STRIPES = 8
+
+# Expired session cleanup (django_session.expire_date is indexed): used by
+# `manage.py purge_sessions` and by SessionJanitorMiddleware, which runs up to
+# SESSION_JANITOR_MAX_BATCHES batches in the background on a random request
+SESSION_JANITOR_BATCH_SIZE = 500
+SESSION_JANITOR_PAUSE = 0.05
+SESSION_JANITOR_INTERVAL = 60
+SESSION_JANITOR_MAX_BATCHES = 10
+SESSION_JANITOR_PROBABILITY = 0.01
+
+# Cache invalidation bus: changes write ChangeEvent rows (the outbox) in the
+# transaction that makes them and `manage.py run_invalidation_tailer` fans them
+# out. With the database transport every process polls the outbox itself,
+# re-reading the last INVALIDATION_POLL_OVERLAP seconds for rows that commit out
+# of id order, and the tailer only prunes rows older than
+# INVALIDATION_OUTBOX_RETENTION seconds. The servers and runworker subscribe;
+# INVALIDATION_SUBSCRIBE = True makes every process subscribe.
+INVALIDATION_TRANSPORT = 'accounts.invalidation.DatabaseTransport'
+INVALIDATION_SUBSCRIBE = False
+INVALIDATION_TAIL_INTERVAL = 0.5
+INVALIDATION_POLL_OVERLAP = 10
+INVALIDATION_OUTBOX_RETENTION = 3600
+INVALIDATION_FILE = BASE_DIR / 'invalidation.log'
+INVALIDATION_SOCKET_DIR = '/tmp/django-invalidation'
+
+# Follow edges sharded over extra databases by user id, e.g.
+# RELATION_SHARDS=relations_0,relations_1 (local SQLite files next to
+# db.sqlite3, migrated with `manage.py migrate --database relations_0`).
+# To reshard, set RELATION_SHARDS_NEXT so writes go to both layouts, run
+# `manage.py reshard_relations`, swap the two and finish with --prune.
+# `reshard_relations --repair` fixes copies a failed cross-database write
+# left behind (see accounts.relations.edge_transaction).
+RELATION_SHARDS = [alias for alias in os.environ.get('RELATION_SHARDS', '').split(',') if alias]
+RELATION_SHARDS_NEXT = [alias for alias in os.environ.get('RELATION_SHARDS_NEXT', '').split(',') if alias] or None
+for alias in [*RELATION_SHARDS, *(RELATION_SHARDS_NEXT or [])]:
+    DATABASES.setdefault(alias, {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / f'{alias}.sqlite3',
+    })
+DATABASE_ROUTERS = ['accounts.sharding.RelationShardRouter']
+
+# collectstatic drops the rules of these stylesheets whose classes/ids appear
+# in none of the STATIC_PURGE_CSS_CONTENT files (or match a safelist regex,
+# for names built at runtime like alert-{{ msg.tags }})
+STATIC_PURGE_CSS = ['css/bootstrap.css']
+STATIC_PURGE_CSS_CONTENT = [BASE_DIR / 'templates', BASE_DIR / 'accounts', BASE_DIR / 'utils']
+STATIC_PURGE_CSS_SAFELIST = [r'^alert-']
+# Cache lifetime of static files without a fingerprint in their name
+STATIC_MAX_AGE = 60
+
+# Uploaded media served by Django (utils.media.serve_media) with ranges and
+# revalidation. Behind nginx set MEDIA_OFFLOAD = 'x-accel-redirect' (and an
+# internal location at MEDIA_OFFLOAD_PREFIX aliased to MEDIA_ROOT), behind
+# Apache/lighttpd 'x-sendfile'; or MEDIA_SERVE = False if it serves MEDIA_URL.
+MEDIA_SERVE = True
+MEDIA_OFFLOAD = None
+MEDIA_OFFLOAD_PREFIX = '/protected-media/'
+MEDIA_MAX_AGE = 60
+
+# Profile images are content addressed and reference counted; unreferenced
+# files are deleted by a background job (or `manage.py collect_images`) once
+# they've been unreferenced for IMAGE_GC_GRACE_SECONDS, sweeps at most every
+# IMAGE_GC_INTERVAL seconds
+IMAGE_GC_GRACE_SECONDS = 3600
+IMAGE_GC_INTERVAL = 300
+
+# Deferred work (accounts.jobs) is stored in the Job table and run by a worker
+# thread in every server process, or only by `manage.py runworker` processes
+# when JOBS_RUN_IN_SERVER is False. JOBS_RUN_IN_PROCESS = True starts that
+# thread in management commands and shells too. Claimed jobs not finished
+# within JOBS_LEASE_SECONDS are claimed again; failures retry with exponential
+# backoff from JOBS_RETRY_DELAY seconds up to JOBS_RETRY_MAX_DELAY.
+JOBS_RUN_IN_SERVER = True
+JOBS_RUN_IN_PROCESS = False
+JOBS_BATCH_SIZE = 50
+JOBS_LEASE_SECONDS = 300
+JOBS_POLL_INTERVAL = 1.0
+JOBS_RETRY_DELAY = 10
+JOBS_RETRY_MAX_DELAY = 3600
+# Password reset codes not sent within this many seconds are dropped, and the
+# code is cleared from the row of a job that failed for good
+SMS_JOB_EXPIRES = 300
+
+# People/follower/following searches cache the matching user ids per
+# normalized query and scope, keyed by invalidation generations (any user
+# change, or a relation change of the scoped user). Queries matching more than
+# SEARCH_CACHE_MAX_RESULTS users are not cached as id lists.
+SEARCH_CACHE_ENABLE = True
+SEARCH_CACHE_MAX_ENTRIES = 10_000
+SEARCH_CACHE_TIMEOUT = 300
+SEARCH_CACHE_MAX_RESULTS = 1000
+SEARCH_CACHE_MAX_USERS = 100_000
+
+# "Followed by ... you follow" on profiles: at most MUTUALS_MAX_PROBE edges of
+# the smaller side are checked (beyond that the count is a lower bound), and
+# results are cached per viewer and profile until either side's relations change
+MUTUALS_SAMPLE_SIZE = 2
+MUTUALS_MAX_PROBE = 5000
+MUTUALS_CACHE_MAX_ENTRIES = 10_000
+MUTUALS_CACHE_TIMEOUT = 600
+
+# "Last seen" presence: ActivityMiddleware buffers a timestamp per user (at
+# most one per ACTIVITY_RESOLUTION seconds) and a timer thread writes the
+# buffer in bulk every ACTIVITY_FLUSH_INTERVAL seconds. The servers and
+# runworker start that thread; ACTIVITY_FLUSH_THREAD = True starts it in every
+# process, elsewhere the buffer is flushed at exit. With
+# ACTIVITY_BATCH_LAST_LOGIN, login() stops writing last_login synchronously
+# and it goes through the same buffer.
+ACTIVITY_TRACKING = True
+ACTIVITY_RESOLUTION = 60
+ACTIVITY_FLUSH_INTERVAL = 30
+ACTIVITY_FLUSH_THREAD = False
+ACTIVITY_ONLINE_SECONDS = 300
+ACTIVITY_BATCH_LAST_LOGIN = True
+
+# Memory instrumentation (utils.memory): with MEMORY_PROFILING on, staff can
+# start/stop tracemalloc in a worker at runtime and read allocation growth by
+# module and per-view request peaks from accounts:memory-profile; see also
+# `manage.py memory_report`. Off, nothing is traced and the middleware is
+# dropped from the stack.
+MEMORY_PROFILING = os.environ.get('MEMORY_PROFILING', '') == '1'
+MEMORY_TRACEMALLOC_FRAMES = 1
+MEMORY_SAMPLE_RATE = 1.0
+
+# Seconds an admin changelist row count is reused before recounting
+ADMIN_COUNT_CACHE_TIMEOUT = 300
+
 # ----- END MY CONFIGS -----
\ No newline at end of file
@@ -0,0 +1,11 @@
+from .settings import *
+
+
+# The sharded layout is tested too (accounts.tests.ShardedRelationTests), on
+# two throwaway databases
+RELATION_TEST_SHARDS = ['relations_0', 'relations_1']
+for alias in RELATION_TEST_SHARDS:
+    DATABASES.setdefault(alias, {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / f'{alias}.sqlite3',
+    })
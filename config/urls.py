@@ -1,9 +1,10 @@
 from django.contrib import admin
 from django.urls import path, include
 from django.views.generic import TemplateView
-from django.conf.urls.static import static
 from django.conf import settings
 
+from utils.media import serve_media
+
 
 urlpatterns = [
     # Django admin panel
@@ -17,6 +18,9 @@ urlpatterns = [
 ]
 
 
-if settings.DEBUG:
-    urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+# Static files are served by utils.middleware.StaticFilesMiddleware, media
+# files by utils.media.serve_media unless a web server in front handles them
+if getattr(settings, 'MEDIA_SERVE', True):
+    urlpatterns += [
+        path(f"{settings.MEDIA_URL.lstrip('/')}<path:path>", serve_media, name='media'),
+    ]
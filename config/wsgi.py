@@ -8,9 +8,26 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/wsgi/
 """
 
 import os
+import time
 
+boot_started = time.perf_counter()
+
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
 application = get_wsgi_application()
+
+# Compile templates, fill the URL resolvers and build the availability index
+# before the server hands this worker its first request. Database connections
+# are per thread, each request thread opens its own. With a preforking
+# server, run this after fork (e.g. a post_fork hook) instead.
+if settings.STARTUP_WARMUP:
+    from utils.startup import warm_up
+    warm_up(boot_started)
+
+# This process's background threads, never started by management commands
+# or shells (see utils.startup)
+from utils.startup import start_background_threads
+start_background_threads()
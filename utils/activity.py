@@ -0,0 +1,132 @@
+import atexit
+import datetime
+import logging
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connections
+from django.utils import timezone
+
+
+logger = logging.getLogger(__name__)
+
+
+def is_recently_seen(last_seen):
+    if last_seen is None:
+        return False
+    return timezone.now() - last_seen < datetime.timedelta(seconds=getattr(settings, 'ACTIVITY_ONLINE_SECONDS', 300))
+
+
+class ActivityTracker:
+    # Buffers per-user timestamps (last_seen on every request, last_login on
+    # login) in this process and writes them with one bulk UPDATE ... CASE
+    # per field every ACTIVITY_FLUSH_INTERVAL seconds, from a timer thread
+    # the server entry points start (see utils.startup). A user seen again
+    # within ACTIVITY_RESOLUTION isn't buffered.
+
+    def __init__(self, resolution=60, interval=30, max_users=100_000, batch_size=500):
+        self.resolution = datetime.timedelta(seconds=resolution)
+        self.interval = interval
+        self.max_users = max_users
+        self.batch_size = batch_size
+        self.pending = defaultdict(dict)
+        self.recorded = {}
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.thread = None
+        self.threaded = False
+        self.thread_lock = threading.Lock()
+        self.stopping = threading.Event()
+
+    def record(self, user_id, field='last_seen', when=None, previous=None):
+        # previous: the value already stored, when the caller has it loaded
+        when = when or timezone.now()
+
+        with self.lock:
+            previous = max(filter(None, [previous, self.recorded.get((field, user_id))]), default=None)
+            if previous is not None and when - previous < self.resolution:
+                return False
+
+            if len(self.recorded) >= self.max_users:
+                self.recorded.clear()
+            self.recorded[field, user_id] = when
+            self.pending[field][user_id] = when
+
+        if self.thread is None or not self.thread.is_alive():
+            self.start()
+        return True
+
+    def flush(self):
+        # The timer thread and the exit hook may both get here
+        with self.flush_lock:
+            with self.lock:
+                pending, self.pending = self.pending, defaultdict(dict)
+
+            User = get_user_model()
+            flushed = 0
+            for field, times in pending.items():
+                users = [User(pk=user_id, **{field: when}) for user_id, when in times.items()]
+                try:
+                    User.objects.bulk_update(users, [field], batch_size=self.batch_size)
+                except Exception:
+                    logger.exception('Flushing %s for %s users failed', field, len(users))
+                    self.restore(field, times)
+                    continue
+                flushed += len(users)
+            return flushed
+
+    def restore(self, field, times):
+        # Back into the buffer for the next flush, unless newer ones came in
+        with self.lock:
+            for user_id, when in times.items():
+                self.pending[field].setdefault(user_id, when)
+
+    # ----- TIMER -----
+
+    def enable_thread(self):
+        self.threaded = True
+        return self.start()
+
+    def start(self):
+        # Also after a fork, where the parent's thread doesn't exist. Only in
+        # processes that called enable_thread(), or in all of them with
+        # ACTIVITY_FLUSH_THREAD: elsewhere (management commands, shells,
+        # tests) the buffer is only flushed at exit
+        if not (self.threaded or getattr(settings, 'ACTIVITY_FLUSH_THREAD', False)):
+            return False
+
+        with self.thread_lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.stopping.clear()
+                self.thread = threading.Thread(target=self.run, args=(self.stopping,), name='activity-flush', daemon=True)
+                self.thread.start()
+        return True
+
+    def run(self, stopping):
+        while not stopping.wait(self.interval):
+            if not self.pending:
+                continue
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Flushing activity failed')
+            finally:
+                connections.close_all()
+
+    def stop(self):
+        self.stopping.set()
+
+
+activity_tracker = ActivityTracker(
+    resolution=getattr(settings, 'ACTIVITY_RESOLUTION', 60),
+    interval=getattr(settings, 'ACTIVITY_FLUSH_INTERVAL', 30),
+)
+
+
+@atexit.register
+def flush_on_exit():
+    # Whatever is buffered when the process stops normally
+    if activity_tracker.pending:
+        activity_tracker.flush()
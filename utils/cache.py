@@ -0,0 +1,70 @@
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+
+class TaggedCache:
+    # Per-process LRU cache with a TTL and tag-based eviction, so entries
+    # derived from a user or relation can be dropped by an invalidation event.
+
+    def __init__(self, max_entries=10_000, timeout=300):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.entries = OrderedDict()
+        self.tag_index = defaultdict(set)
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+
+            if entry is None:
+                return default
+            if entry[0] < time.monotonic():
+                self._delete(key)
+                return default
+
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, tags=(), timeout=None):
+        expires = time.monotonic() + (self.timeout if timeout is None else timeout)
+
+        with self.lock:
+            self._delete(key)
+            self.entries[key] = (expires, value, tuple(tags))
+            for tag in tags:
+                self.tag_index[tag].add(key)
+
+            while len(self.entries) > self.max_entries:
+                self._delete(next(iter(self.entries)))
+
+    def delete(self, key):
+        with self.lock:
+            self._delete(key)
+
+    def _delete(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+
+        for tag in entry[2]:
+            keys = self.tag_index.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tag_index[tag]
+
+    def invalidate(self, tags):
+        with self.lock:
+            for tag in tags:
+                for key in list(self.tag_index.get(tag, ())):
+                    self._delete(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.tag_index.clear()
+
+    def __len__(self):
+        return len(self.entries)
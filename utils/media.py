@@ -0,0 +1,157 @@
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from .staticfiles import IMMUTABLE_CACHE_CONTROL, get_stat_etag
+from .storage import is_content_addressed
+
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# A compressed file is served as what it is, as django.http.FileResponse does:
+# a Content-Encoding would have the client decompress it
+ENCODING_TYPES = {
+    'br': 'application/x-brotli',
+    'bzip2': 'application/x-bzip',
+    'compress': 'application/x-compress',
+    'gzip': 'application/gzip',
+    'xz': 'application/x-xz',
+}
+
+# MEDIA_OFFLOAD mode -> response header handing the transfer to the proxy
+OFFLOAD_HEADERS = {
+    'x-accel-redirect': 'X-Accel-Redirect',
+    'x-sendfile': 'X-Sendfile',
+}
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header, size):
+    # (first, last) byte of a single range, or None to send the whole file
+    # (no header, several ranges, or a malformed one, as RFC 9110 allows)
+    match = RANGE_RE.match(header.strip())
+    if not match or not any(match.groups()):
+        return None
+
+    first, last = match.groups()
+    if not first:
+        if not int(last) or not size:
+            raise RangeNotSatisfiable
+        return max(size - int(last), 0), size - 1
+
+    first = int(first)
+    last = min(int(last), size - 1) if last else size - 1
+    if first >= size:
+        raise RangeNotSatisfiable
+    if last < first:
+        return None
+    return first, last
+
+
+class FileRange:
+    # A window onto an open file. FileResponse hands it to the server's
+    # wsgi.file_wrapper; fileno() keeps it eligible for os.sendfile(), which
+    # gunicorn starts from the current offset for Content-Length bytes.
+
+    def __init__(self, file, first, last):
+        self.file = file
+        self.remaining = last - first + 1
+        file.seek(first)
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def get_cache_control(name):
+    # Content addressed names never change content
+    if is_content_addressed(name):
+        return IMMUTABLE_CACHE_CONTROL
+    return f"public, max-age={getattr(settings, 'MEDIA_MAX_AGE', 60)}"
+
+
+def get_offload_response(name, path, content_type):
+    mode = getattr(settings, 'MEDIA_OFFLOAD', None)
+    response = HttpResponse(content_type=content_type)
+
+    if mode == 'x-accel-redirect':
+        # An internal nginx location aliased to MEDIA_ROOT
+        response[OFFLOAD_HEADERS[mode]] = getattr(settings, 'MEDIA_OFFLOAD_PREFIX', '/protected-media/') + name
+    else:
+        response[OFFLOAD_HEADERS[mode]] = path
+    return response
+
+
+def serve_media(request, path, document_root=None):
+    document_root = document_root or settings.MEDIA_ROOT
+
+    try:
+        full_path = safe_join(document_root, path)
+    except SuspiciousFileOperation:
+        raise Http404
+    if not os.path.isfile(full_path):
+        raise Http404
+
+    content_type, encoding = mimetypes.guess_type(full_path)
+    content_type = ENCODING_TYPES.get(encoding, content_type) or 'application/octet-stream'
+
+    # The proxy does ranges and revalidation itself
+    if getattr(settings, 'MEDIA_OFFLOAD', None) in OFFLOAD_HEADERS:
+        return get_offload_response(path, full_path, content_type)
+
+    stat = os.stat(full_path)
+    etag = get_stat_etag(stat)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(stat.st_mtime),
+        'Cache-Control': get_cache_control(path),
+        'Accept-Ranges': 'bytes',
+    }
+
+    response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if response is not None:
+        for header in ('ETag', 'Last-Modified', 'Cache-Control'):
+            response[header] = headers[header]
+        return response
+
+    byte_range = None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if 'HTTP_RANGE' in request.META and if_range in (None, etag, headers['Last-Modified']):
+        try:
+            byte_range = parse_range(request.META['HTTP_RANGE'], stat.st_size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{stat.st_size}'
+            return response
+
+    file = open(full_path, 'rb')
+    if byte_range is None:
+        response = FileResponse(file, content_type=content_type)
+    else:
+        first, last = byte_range
+        response = FileResponse(FileRange(file, first, last), content_type=content_type, status=206)
+        response['Content-Range'] = f'bytes {first}-{last}/{stat.st_size}'
+        response['Content-Length'] = last - first + 1
+
+    for header, value in headers.items():
+        response[header] = value
+    return response
@@ -0,0 +1,221 @@
+import functools
+import os
+import sys
+import sysconfig
+import threading
+import tracemalloc
+from collections import defaultdict
+
+from django.conf import settings
+
+
+IGNORED_TRACES = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>'),
+]
+
+STDLIB_PATHS = {sysconfig.get_path('stdlib'), sysconfig.get_path('platstdlib')}
+
+
+def is_enabled():
+    return getattr(settings, 'MEMORY_PROFILING', False)
+
+
+def is_tracking():
+    return tracemalloc.is_tracing()
+
+
+# ----- TRACKING -----
+
+_baseline = None
+_lock = threading.Lock()
+
+
+def start_tracking(frames=None):
+    # Tracing slows every allocation down, it's only on between start and stop
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames or getattr(settings, 'MEMORY_TRACEMALLOC_FRAMES', 1))
+    request_memory_stats.clear()
+    set_baseline()
+
+
+def stop_tracking():
+    global _baseline
+
+    with _lock:
+        _baseline = None
+    tracemalloc.stop()
+
+
+def take_snapshot():
+    return tracemalloc.take_snapshot().filter_traces(IGNORED_TRACES)
+
+
+def set_baseline(snapshot=None):
+    global _baseline
+
+    with _lock:
+        _baseline = snapshot or take_snapshot()
+    return _baseline
+
+
+def get_baseline():
+    return _baseline
+
+
+def get_rss():
+    # Resident set size in bytes, Linux only
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+# ----- GROUPING -----
+
+@functools.lru_cache(maxsize=4096)
+def get_module(filename):
+    # Dotted module name from the longest sys.path entry holding the file
+    for base in sorted(filter(None, sys.path), key=len, reverse=True):
+        if filename.startswith(base.rstrip(os.sep) + os.sep):
+            module = os.path.splitext(os.path.relpath(filename, base))[0].replace(os.sep, '.')
+            return module.removesuffix('.__init__'), base
+    return filename, None
+
+
+@functools.lru_cache(maxsize=4096)
+def get_group(filename):
+    # 'accounts.*' / 'utils.*' for the project, the top level package for
+    # third-party code (django, PIL, phonenumbers, ...), 'stdlib' for the rest
+    module, base = get_module(filename)
+    package = module.split('.')[0]
+
+    if base is not None and os.path.abspath(base) == os.path.abspath(settings.BASE_DIR):
+        return f'{package}.*'
+    if base is not None and base not in STDLIB_PATHS:
+        return package
+    return 'stdlib'
+
+
+def compare_snapshots(snapshot, baseline=None, limit=20):
+    # Growth since baseline (or everything traced without one), by group and
+    # by the top allocation sites
+    if baseline is None:
+        stats = [(stat.traceback[0], stat.size, stat.count) for stat in snapshot.statistics('lineno')]
+    else:
+        stats = [(stat.traceback[0], stat.size_diff, stat.count_diff) for stat in snapshot.compare_to(baseline, 'lineno')]
+
+    groups = defaultdict(lambda: {'size': 0, 'count': 0})
+    for frame, size, count in stats:
+        group = groups[get_group(frame.filename)]
+        group['size'] += size
+        group['count'] += count
+
+    stats.sort(key=lambda stat: stat[1], reverse=True)
+    return {
+        'groups': sorted(
+            ({'group': name, **totals} for name, totals in groups.items()),
+            key=lambda group: group['size'], reverse=True,
+        ),
+        'top': [
+            {
+                'site': f'{get_module(frame.filename)[0]}:{frame.lineno}',
+                'group': get_group(frame.filename),
+                'size': size,
+                'count': count,
+            }
+            for frame, size, count in stats[:limit]
+        ],
+    }
+
+
+def get_memory_report(limit=20):
+    report = {
+        'pid': os.getpid(),
+        'rss': get_rss(),
+        'tracing': tracemalloc.is_tracing(),
+    }
+    if not report['tracing']:
+        return report
+
+    current, peak = tracemalloc.get_traced_memory()
+    report.update({
+        'traced': current,
+        'traced_peak': peak,
+        'since_baseline': get_baseline() is not None,
+        **compare_snapshots(take_snapshot(), get_baseline(), limit),
+        'views': request_memory_stats.get_report(limit),
+    })
+    return report
+
+
+# ----- REQUESTS -----
+
+_measuring = threading.Lock()
+
+
+def get_body_size(response):
+    # A response body still referenced when the request returns (streamed
+    # ones are produced later, while being sent)
+    if getattr(response, 'streaming', True):
+        return 0
+    return len(response.content)
+
+
+def measure_allocations(func, *args):
+    # (response, peak traced above the start, still allocated afterwards
+    # besides the response body), or (response, None, None) while another
+    # thread is measuring: tracemalloc has a single peak for the process and
+    # resetting it would cut that measurement short. Allocations other
+    # threads make in the meantime are still counted in both figures.
+    if not _measuring.acquire(blocking=False):
+        return func(*args), None, None
+
+    try:
+        tracemalloc.reset_peak()
+        start, _ = tracemalloc.get_traced_memory()
+        response = func(*args)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        _measuring.release()
+    return response, peak - start, current - start - get_body_size(response)
+
+
+# Requests no URL pattern matched, counted together
+UNRESOLVED_VIEW = '<unresolved>'
+
+
+class RequestMemoryStats:
+    # Per view: how many requests were sampled, their peak allocation above
+    # what was traced when they started, and what they left allocated apart
+    # from the response body (see measure_allocations).
+
+    def __init__(self):
+        self.views = defaultdict(lambda: {'requests': 0, 'peak_max': 0, 'peak_total': 0, 'retained_total': 0})
+        self.lock = threading.Lock()
+
+    def record(self, view_name, peak, retained):
+        if peak is None:
+            return
+
+        with self.lock:
+            stats = self.views[view_name]
+            stats['requests'] += 1
+            stats['peak_max'] = max(stats['peak_max'], peak)
+            stats['peak_total'] += peak
+            stats['retained_total'] += retained
+
+    def get_report(self, limit=20):
+        with self.lock:
+            views = [{'view': name, **stats} for name, stats in self.views.items()]
+        return sorted(views, key=lambda view: view['retained_total'], reverse=True)[:limit]
+
+    def clear(self):
+        with self.lock:
+            self.views.clear()
+
+
+request_memory_stats = RequestMemoryStats()
@@ -0,0 +1,85 @@
+import random
+import tracemalloc
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from .activity import activity_tracker
+from .memory import UNRESOLVED_VIEW, is_enabled as is_memory_profiling_enabled, measure_allocations, request_memory_stats
+from .sessions import run_session_janitor_in_background
+from .staticfiles import get_immutable_names, serve_static
+
+
+class SessionJanitorMiddleware:
+    # Opportunistically trims expired sessions from a background thread, at
+    # most once per SESSION_JANITOR_INTERVAL per process.
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.probability = getattr(settings, 'SESSION_JANITOR_PROBABILITY', 0.01)
+
+    def __call__(self, request):
+        response = self.get_response(request)
+
+        if self.probability and random.random() < self.probability:
+            run_session_janitor_in_background()
+        return response
+
+
+class StaticFilesMiddleware:
+    # Serves collected files from STATIC_ROOT before sessions, auth or URL
+    # resolving run: the precompressed variant the client accepts, with
+    # immutable caching for fingerprinted names. Anything else falls through.
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.prefix = settings.STATIC_URL
+        self.root = settings.STATIC_ROOT
+        self.immutable_names = get_immutable_names()
+
+    def __call__(self, request):
+        if self.root and request.method in ('GET', 'HEAD') and request.path.startswith(self.prefix):
+            response = serve_static(request, request.path[len(self.prefix):], self.root, self.immutable_names)
+            if response is not None:
+                return response
+        return self.get_response(request)
+
+
+class ActivityMiddleware:
+    # Marks authenticated users as seen; the write happens later, batched
+    # with everyone else's (see utils.activity).
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = getattr(settings, 'ACTIVITY_TRACKING', True)
+
+    def __call__(self, request):
+        response = self.get_response(request)
+
+        user = getattr(request, 'user', None)
+        if self.enabled and user is not None and user.is_authenticated:
+            activity_tracker.record(user.pk, previous=user.last_seen)
+        return response
+
+
+class MemoryProfilingMiddleware:
+    # Samples the peak traced allocation of MEMORY_SAMPLE_RATE of the requests
+    # while tracemalloc runs, one request at a time (see utils.memory). Not in
+    # the stack at all unless MEMORY_PROFILING is set.
+
+    def __init__(self, get_response):
+        if not is_memory_profiling_enabled():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'MEMORY_SAMPLE_RATE', 1.0)
+
+    def __call__(self, request):
+        if not tracemalloc.is_tracing() or random.random() >= self.sample_rate:
+            return self.get_response(request)
+
+        response, peak, retained = measure_allocations(self.get_response, request)
+
+        # Not the path of a 404: the stats would grow with every URL tried
+        match = request.resolver_match
+        request_memory_stats.record(match.view_name if match else UNRESOLVED_VIEW, peak, retained)
+        return response
@@ -1,5 +1,10 @@
+from asgiref.sync import sync_to_async
 from django.shortcuts import redirect, get_object_or_404
 from django.contrib.auth import get_user_model
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.core.exceptions import PermissionDenied
+
+from .ratelimit import is_ratelimited, ratelimited_response
 
 
 User = get_user_model()
@@ -18,3 +23,36 @@ class SelfForbiddenRequiredMixin:
         if request.user == user:
             return redirect('index')
         return super().dispatch(request, *args, **kwargs)
+
+
+class StaffRequiredMixin(LoginRequiredMixin):
+    def dispatch(self, request, *args, **kwargs):
+        if request.user.is_authenticated and not request.user.is_staff:
+            raise PermissionDenied
+        return super().dispatch(request, *args, **kwargs)
+
+
+class RateLimitMixin:
+    ratelimit_rules = []
+    ratelimit_methods = ['POST']
+
+    def should_ratelimit(self, request):
+        return request.method in self.ratelimit_methods
+
+    def dispatch(self, request, *args, **kwargs):
+        if self.view_is_async:
+            return self.adispatch(request, *args, **kwargs)
+
+        if self.should_ratelimit(request):
+            retry_after = is_ratelimited(request, self.__class__.__name__, self.ratelimit_rules)
+            if retry_after is not None:
+                return ratelimited_response(retry_after)
+        return super().dispatch(request, *args, **kwargs)
+
+    async def adispatch(self, request, *args, **kwargs):
+        # request.user may still have to be loaded from the session
+        if self.should_ratelimit(request):
+            retry_after = await sync_to_async(is_ratelimited)(request, self.__class__.__name__, self.ratelimit_rules)
+            if retry_after is not None:
+                return ratelimited_response(retry_after)
+        return await super().dispatch(request, *args, **kwargs)
@@ -1,9 +1,90 @@
-from django.core.paginator import Paginator
+import hashlib
 
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
+from django.db import connections
+from django.utils.functional import cached_property
 
-def get_pagination_context(request, object_list, per_page):
-    paginator = Paginator(object_list, per_page)
+
+def get_pagination_context(request, object_list, per_page, count=None, paginator_class=Paginator):
+    paginator = paginator_class(object_list, per_page)
+    if count is not None:
+        # Already known (e.g. a cached search), saves the COUNT query
+        paginator.count = count
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
 
     return page_obj
+
+
+def get_estimated_count(queryset):
+    # PostgreSQL keeps a planner estimate for whole tables; other backends
+    # (and filtered querysets) fall back to the cached exact count.
+    connection = connections[queryset.db]
+
+    if connection.vendor != 'postgresql' or queryset.query.where:
+        return None
+
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT reltuples FROM pg_class WHERE relname = %s', [queryset.model._meta.db_table])
+        row = cursor.fetchone()
+
+    if row is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+class CachedCountPaginator(Paginator):
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not hasattr(queryset, 'query'):
+            return super().count
+
+        estimate = get_estimated_count(queryset)
+        if estimate is not None:
+            return estimate
+
+        try:
+            sql = str(queryset.query).encode()
+        except EmptyResultSet:
+            return 0
+        key = f'paginator_count:{queryset.db}:{hashlib.md5(sql, usedforsecurity=False).hexdigest()}'
+        return cache.get_or_set(
+            key,
+            queryset.count,
+            getattr(settings, 'ADMIN_COUNT_CACHE_TIMEOUT', 300),
+        )
+
+
+class UncountedPaginator(Paginator):
+    # For lists too long to count on every page: a page reads one row past its
+    # end to know whether there is a next one, the page links stop there
+    def validate_number(self, number):
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger('That page number is not an integer')
+        if number < 1:
+            raise EmptyPage('That page number is less than 1')
+        return number
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        rows = list(self.object_list[bottom:bottom + self.per_page + 1])
+
+        # As far as is known: enough for num_pages, has_next and end_index
+        self.__dict__['count'] = bottom + len(rows)
+        if not rows and number > 1:
+            raise EmptyPage('That page contains no results')
+        return self._get_page(rows[:self.per_page], number, self)
+
+    def get_page(self, number):
+        # Past the end, the last page isn't known without counting
+        try:
+            return self.page(number)
+        except (PageNotAnInteger, EmptyPage):
+            return self.page(1)
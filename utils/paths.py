@@ -1,16 +1,7 @@
 import os
 
-from django.conf import settings
-from django.utils.text import slugify
-
 
 def get_user_profile_image_upload_path(instance, filename):
-    username = slugify(instance.username)
-    filename = f"{username}{os.path.splitext(filename)[1]}"
-    file_path = f"accounts/{username}/{filename}"
-    full_path = os.path.join(settings.MEDIA_ROOT, file_path)
-
-    if os.path.isfile(full_path):
-        os.remove(full_path)
-
-    return file_path
+    # Only the directory and extension matter, the storage names the file
+    # by its content (utils.storage.ContentAddressedStorage)
+    return f"accounts/images/image{os.path.splitext(filename)[1].lower()}"
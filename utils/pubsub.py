@@ -0,0 +1,105 @@
+import abc
+import asyncio
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+class Subscription:
+    # One bounded queue per connection, owned by the event loop serving it.
+    # A slow consumer never blocks publishers: when the queue is full the
+    # oldest event is dropped, events carry full state so the latest wins.
+
+    def __init__(self, broker, channel, maxsize):
+        self.broker = broker
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize)
+        self.dropped = 0
+
+    def deliver(self, event):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+    def push(self, event):
+        try:
+            self.loop.call_soon_threadsafe(self.deliver, event)
+        except RuntimeError:
+            self.close()
+
+    async def get(self):
+        return await self.queue.get()
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class Broker(abc.ABC):
+    # Whether an event published in one process reaches subscribers in others
+    spans_processes = True
+
+    @abc.abstractmethod
+    def subscribe(self, channel, maxsize=100):
+        pass
+
+    @abc.abstractmethod
+    def unsubscribe(self, subscription):
+        pass
+
+    @abc.abstractmethod
+    def publish(self, channel, event):
+        pass
+
+    def has_subscribers(self, channel):
+        # Brokers spanning processes cannot know, so publishers must assume yes
+        return True
+
+
+class LocalBroker(Broker):
+    spans_processes = False
+
+    def __init__(self):
+        self.channels = defaultdict(set)
+        self.lock = threading.Lock()
+
+    def subscribe(self, channel, maxsize=100):
+        subscription = Subscription(self, channel, maxsize)
+        with self.lock:
+            self.channels[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscriptions = self.channels.get(subscription.channel)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self.channels[subscription.channel]
+
+    def publish(self, channel, event):
+        with self.lock:
+            subscriptions = list(self.channels.get(channel, ()))
+
+        for subscription in subscriptions:
+            subscription.push(event)
+
+    def has_subscribers(self, channel):
+        return channel in self.channels
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                _broker = import_string(getattr(settings, 'PUBSUB_BROKER', 'utils.pubsub.LocalBroker'))()
+    return _broker
@@ -0,0 +1,178 @@
+import math
+import threading
+import time
+from collections import Counter, OrderedDict
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+
+
+RATE_PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    count, period = rate.split('/')
+    return int(count), RATE_PERIODS[period[-1]] * int(period[:-1] or 1)
+
+
+def get_window_weight(now, window):
+    return 1 - (now % window) / window
+
+
+class LocalBackend:
+    # Sliding-window counter approximated from the current and previous fixed
+    # windows: O(1) per check, one small list per key, LRU-evicted past max_keys.
+
+    def __init__(self, max_keys=100_000):
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def hit(self, key, limit, window, now=None):
+        now = time.time() if now is None else now
+        current = int(now // window)
+
+        with self.lock:
+            bucket = self.buckets.get(key)
+
+            if bucket is None:
+                bucket = self.buckets[key] = [current, 0, 0]
+                if len(self.buckets) > self.max_keys:
+                    self.buckets.popitem(last=False)
+            else:
+                self.buckets.move_to_end(key)
+
+            if bucket[0] != current:
+                bucket[1] = bucket[2] if bucket[0] == current - 1 else 0
+                bucket[2] = 0
+                bucket[0] = current
+
+            if bucket[1] * get_window_weight(now, window) + bucket[2] >= limit:
+                return False
+            bucket[2] += 1
+            return True
+
+    def clear(self):
+        with self.lock:
+            self.buckets.clear()
+
+
+class CacheBackend:
+    # Same algorithm on a shared Django cache (Redis, Memcached, database) so
+    # every worker process sees the same counters.
+
+    def __init__(self, alias='default'):
+        self.alias = alias
+
+    def hit(self, key, limit, window, now=None):
+        cache = caches[self.alias]
+        now = time.time() if now is None else now
+        current = int(now // window)
+        current_key = f'ratelimit:{key}:{current}'
+        previous_key = f'ratelimit:{key}:{current - 1}'
+
+        counts = cache.get_many([current_key, previous_key])
+        if counts.get(previous_key, 0) * get_window_weight(now, window) + counts.get(current_key, 0) >= limit:
+            return False
+
+        if not cache.add(current_key, 1, timeout=window * 2):
+            try:
+                cache.incr(current_key)
+            except ValueError:
+                cache.set(current_key, 1, timeout=window * 2)
+        return True
+
+    def clear(self):
+        pass
+
+
+_backend = None
+_backend_lock = threading.Lock()
+_rejections = Counter()
+
+
+def get_backend():
+    global _backend
+
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if getattr(settings, 'RATELIMIT_BACKEND', 'local') == 'cache':
+                    _backend = CacheBackend(getattr(settings, 'RATELIMIT_CACHE_ALIAS', 'default'))
+                else:
+                    _backend = LocalBackend(getattr(settings, 'RATELIMIT_MAX_KEYS', 100_000))
+    return _backend
+
+
+def get_rejection_counts():
+    return dict(_rejections)
+
+
+def reset_ratelimits():
+    global _backend
+
+    if _backend is not None:
+        _backend.clear()
+    _backend = None
+    _rejections.clear()
+
+
+def get_client_ip(request):
+    return request.META.get(getattr(settings, 'RATELIMIT_IP_META_KEY', 'REMOTE_ADDR'), '')
+
+
+def get_ratelimit_key(request, kind):
+    if callable(kind):
+        return kind(request)
+    if kind == 'ip':
+        return get_client_ip(request)
+    if kind == 'user':
+        if request.user.is_authenticated:
+            return f'user:{request.user.pk}'
+        return f'ip:{get_client_ip(request)}'
+    if kind.startswith('post:'):
+        return request.POST.get(kind[5:], '').lower() or None
+    if kind.startswith('get:'):
+        return request.GET.get(kind[4:], '').lower() or None
+    raise ValueError(f"Unknown rate limit key {kind}")
+
+
+def is_ratelimited(request, scope, rules):
+    if not getattr(settings, 'RATELIMIT_ENABLE', True):
+        return None
+
+    backend = get_backend()
+    for kind, rate in rules:
+        value = get_ratelimit_key(request, kind)
+        if value is None:
+            continue
+
+        limit, window = parse_rate(rate)
+        name = kind if isinstance(kind, str) else kind.__name__
+        if not backend.hit(f'{scope}:{name}:{value}', limit, window):
+            _rejections[f'{scope}:{name}'] += 1
+            return math.ceil(window - time.time() % window)
+    return None
+
+
+def ratelimited_response(retry_after):
+    response = HttpResponse('Too many requests, try again later.', status=429)
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+def ratelimit(rules, methods=('POST',), scope=None):
+    def decorator(view_func):
+        view_scope = scope or view_func.__qualname__
+
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if request.method in methods:
+                retry_after = is_ratelimited(request, view_scope, rules)
+                if retry_after is not None:
+                    return ratelimited_response(retry_after)
+            return view_func(request, *args, **kwargs)
+        return wrapper
+    return decorator
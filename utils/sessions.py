@@ -0,0 +1,75 @@
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.db import connections, transaction
+from django.utils import timezone
+
+
+def purge_expired_sessions(batch_size=None, max_batches=None, max_seconds=None, pause=None, progress=None):
+    # Deletes expired rows a small batch at a time, oldest first through the
+    # expire_date index, each batch in its own short transaction. Nothing to
+    # checkpoint: deleted rows are gone, so a stopped run simply resumes.
+    batch_size = batch_size or getattr(settings, 'SESSION_JANITOR_BATCH_SIZE', 500)
+    pause = getattr(settings, 'SESSION_JANITOR_PAUSE', 0.05) if pause is None else pause
+    stats = {'purged': 0, 'batches': 0, 'lock_seconds': 0.0, 'max_lock_seconds': 0.0}
+    started = time.monotonic()
+    now = timezone.now()
+
+    while max_batches is None or stats['batches'] < max_batches:
+        if max_seconds is not None and time.monotonic() - started >= max_seconds:
+            break
+
+        session_keys = list(
+            Session.objects.filter(expire_date__lt=now).order_by('expire_date').values_list('session_key', flat=True)[:batch_size]
+        )
+        if not session_keys:
+            break
+
+        lock_started = time.monotonic()
+        with transaction.atomic():
+            purged, _ = Session.objects.filter(session_key__in=session_keys, expire_date__lt=now).delete()
+        lock_seconds = time.monotonic() - lock_started
+
+        stats['purged'] += purged
+        stats['batches'] += 1
+        stats['lock_seconds'] += lock_seconds
+        stats['max_lock_seconds'] = max(stats['max_lock_seconds'], lock_seconds)
+        if progress:
+            progress(stats)
+
+        if len(session_keys) < batch_size:
+            break
+        time.sleep(pause)
+
+    stats['elapsed_seconds'] = time.monotonic() - started
+    return stats
+
+
+_janitor_lock = threading.Lock()
+_last_run = 0.0
+
+
+def run_session_janitor_in_background():
+    global _last_run
+
+    # _last_run is only read and set while holding the lock, so two requests
+    # can't both see an old value and start a run each
+    interval = getattr(settings, 'SESSION_JANITOR_INTERVAL', 60)
+    if not _janitor_lock.acquire(blocking=False):
+        return False
+    if time.monotonic() - _last_run < interval:
+        _janitor_lock.release()
+        return False
+    _last_run = time.monotonic()
+
+    def run():
+        try:
+            purge_expired_sessions(max_batches=getattr(settings, 'SESSION_JANITOR_MAX_BATCHES', 10))
+        finally:
+            connections.close_all()
+            _janitor_lock.release()
+
+    threading.Thread(target=run, name='session-janitor', daemon=True).start()
+    return True
@@ -0,0 +1,103 @@
+import logging
+import os
+import time
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.template import engines
+from django.urls import get_resolver
+
+
+logger = logging.getLogger(__name__)
+
+startup_report = {}
+
+
+def get_project_template_names(engine):
+    # Only the project's own templates (templates/, <app>/templates/), the
+    # admin ones are compiled on demand by the few staff who need them.
+    base_dir = str(settings.BASE_DIR)
+
+    for template_dir in engine.template_dirs:
+        template_dir = str(template_dir)
+        if not template_dir.startswith(base_dir):
+            continue
+
+        for root, dirs, files in os.walk(template_dir):
+            for filename in files:
+                if filename.endswith('.html'):
+                    yield os.path.relpath(os.path.join(root, filename), template_dir)
+
+
+def compile_templates():
+    count = 0
+
+    for engine in engines.all():
+        for name in get_project_template_names(engine):
+            engine.get_template(name)
+            count += 1
+    return count
+
+
+def populate_url_resolvers():
+    resolver = get_resolver()
+    count = len(resolver.reverse_dict)
+
+    for namespace, (prefix, sub_resolver) in resolver.namespace_dict.items():
+        count += len(sub_resolver.reverse_dict)
+    return count
+
+
+def build_availability_index():
+    # A full users scan for the signup checks' Bloom filter, better here than
+    # in the first request that needs it
+    from accounts.availability import availability_index
+
+    try:
+        return availability_index.build()
+    except DatabaseError:
+        # Not migrated yet: the first check builds it in the background
+        logger.warning('Could not build the availability index', exc_info=True)
+        return None
+
+
+WARM_UP_STEPS = [
+    ('templates', compile_templates),
+    ('url_resolvers', populate_url_resolvers),
+    ('availability_index', build_availability_index),
+]
+
+
+def warm_up(boot_started=None):
+    started = time.perf_counter()
+
+    for name, step in WARM_UP_STEPS:
+        step_started = time.perf_counter()
+        result = step()
+        startup_report[name] = {
+            'count': result,
+            'ms': round((time.perf_counter() - step_started) * 1000, 2),
+        }
+
+    finished = time.perf_counter()
+    startup_report['warm_up_ms'] = round((finished - started) * 1000, 2)
+    startup_report['ready_ms'] = round((finished - (boot_started or started)) * 1000, 2)
+
+    budget = getattr(settings, 'STARTUP_BUDGET_MS', None)
+    if budget and startup_report['ready_ms'] > budget:
+        logger.warning('Worker took %sms to get ready, over the %sms budget', startup_report['ready_ms'], budget)
+    return startup_report
+
+
+def start_background_threads(jobs=True):
+    # Called by the server entry points (config/wsgi.py, config/asgi.py,
+    # `manage.py runworker`) only, so management commands and shells don't
+    # start threads that write behind their back
+    from accounts.invalidation import enable_subscriber
+    from accounts.jobs import enable_worker
+    from .activity import activity_tracker
+
+    activity_tracker.enable_thread()
+    enable_subscriber()
+    if jobs and getattr(settings, 'JOBS_RUN_IN_SERVER', True):
+        enable_worker()
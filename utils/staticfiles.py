@@ -0,0 +1,248 @@
+import gzip
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.base import ContentFile
+from django.http import FileResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+COMMENT_RE = re.compile(r'/\*.*?\*/', re.S)
+NOT_RE = re.compile(r':not\([^)]*\)')
+NAME_RE = re.compile(r'[.#](-?[_a-zA-Z][\w-]*)')
+TOKEN_RE = re.compile(r'[\w-]+')
+
+# Accept-Encoding value -> suffix of the precompressed file, best first
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+# ----- CSS PURGING -----
+
+def get_used_tokens(paths, extensions=('.html', '.py', '.js', '.txt')):
+    # Every word-like token in the templates and code that render markup: a
+    # class name that appears nowhere in them can't end up in a page.
+    tokens = set()
+
+    for root in paths:
+        for directory, dirnames, filenames in os.walk(root):
+            dirnames[:] = [name for name in dirnames if name not in ('migrations', '__pycache__')]
+            for filename in filenames:
+                if filename.endswith(extensions):
+                    with open(os.path.join(directory, filename), encoding='utf-8', errors='ignore') as file:
+                        tokens.update(TOKEN_RE.findall(file.read()))
+    return tokens
+
+
+def split_selectors(prelude):
+    selectors, depth, start = [], 0, 0
+
+    for index, char in enumerate(prelude):
+        if char in '([':
+            depth += 1
+        elif char in ')]':
+            depth -= 1
+        elif char == ',' and not depth:
+            selectors.append(prelude[start:index].strip())
+            start = index + 1
+    selectors.append(prelude[start:].strip())
+    return selectors
+
+
+def find_block_end(css, start):
+    depth, index, quote = 1, start, None
+
+    while index < len(css):
+        char = css[index]
+        if quote:
+            if char == '\\':
+                index += 1
+            elif char == quote:
+                quote = None
+        elif char in '"\'':
+            quote = char
+        elif char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if not depth:
+                return index + 1
+        index += 1
+    return len(css)
+
+
+def purge_css(css, is_used):
+    # Drops the rules whose selectors all name a class or id is_used() rejects.
+    # @media/@supports blocks are purged recursively, other at-rules are kept.
+    css = COMMENT_RE.sub('', css)
+    output, index = [], 0
+
+    while index < len(css):
+        brace = css.find('{', index)
+        semicolon = css.find(';', index)
+        if brace == -1:
+            break
+
+        if semicolon != -1 and semicolon < brace:
+            output.append(css[index:semicolon + 1].strip())
+            index = semicolon + 1
+            continue
+
+        prelude = css[index:brace].strip()
+        end = find_block_end(css, brace + 1)
+        body = css[brace + 1:end - 1]
+        index = end
+
+        if prelude.startswith(('@media', '@supports')):
+            inner = purge_css(body, is_used)
+            if inner:
+                output.append(f'{prelude} {{\n{inner}\n}}')
+        elif prelude.startswith('@'):
+            output.append(f'{prelude} {{{body}}}')
+        else:
+            selectors = [
+                selector for selector in split_selectors(prelude)
+                if all(is_used(name) for name in NAME_RE.findall(NOT_RE.sub('', selector)))
+            ]
+            if selectors:
+                output.append(f"{', '.join(selectors)} {{{body}}}")
+    return '\n'.join(output)
+
+
+# ----- STORAGE -----
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    # Fingerprinted names (via the manifest) plus .gz and, with the brotli
+    # package installed, .br siblings written once at collectstatic time.
+    # CSS files listed in STATIC_PURGE_CSS lose their unused rules first.
+
+    compress_extensions = ('.css', '.js', '.svg', '.txt', '.html', '.json', '.xml', '.map')
+    min_compression_ratio = 0.95
+
+    def post_process(self, paths, dry_run=False, **options):
+        if not dry_run:
+            paths = {**paths, **self.purge(paths)}
+
+        yield from super().post_process(paths, dry_run, **options)
+
+        if not dry_run:
+            for name in sorted({*paths, *self.hashed_files.values()}):
+                for compressed_name in self.compress(name):
+                    yield name, compressed_name, True
+
+    def purge(self, paths):
+        names = [name for name in getattr(settings, 'STATIC_PURGE_CSS', []) if name in paths]
+        if not names:
+            return {}
+
+        used = get_used_tokens(getattr(settings, 'STATIC_PURGE_CSS_CONTENT', []))
+        safelist = [re.compile(pattern) for pattern in getattr(settings, 'STATIC_PURGE_CSS_SAFELIST', [])]
+
+        def is_used(name):
+            return name in used or any(pattern.search(name) for pattern in safelist)
+
+        purged = {}
+        for name in names:
+            # Always from the source, so a second collectstatic doesn't purge
+            # the already purged copy again
+            storage, path = paths[name]
+            with storage.open(path) as file:
+                css = file.read().decode('utf-8')
+
+            self.replace(name, purge_css(css, is_used).encode('utf-8'))
+            purged[name] = (self, name)
+        return purged
+
+    def compress(self, name):
+        if not name.endswith(self.compress_extensions) or not self.exists(name):
+            return
+
+        with self.open(name) as file:
+            data = file.read()
+
+        variants = [('.gz', gzip.compress(data, compresslevel=9, mtime=0))]
+        if brotli is not None:
+            variants.append(('.br', brotli.compress(data, mode=brotli.MODE_TEXT)))
+
+        for suffix, compressed in variants:
+            if len(compressed) < len(data) * self.min_compression_ratio:
+                self.replace(name + suffix, compressed)
+                yield name + suffix
+
+    def replace(self, name, data):
+        if self.exists(name):
+            self.delete(name)
+        self._save(name, ContentFile(data))
+
+
+# ----- SERVING -----
+
+def get_accepted_encodings(header):
+    accepted = set()
+
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        quality = params.strip()
+        if quality.startswith('q='):
+            try:
+                if float(quality[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        if coding:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+def get_stat_etag(stat):
+    return f'"{int(stat.st_mtime):x}-{stat.st_size:x}"'
+
+
+def get_immutable_names():
+    # Fingerprinted names never change content, see the manifest
+    return set(getattr(staticfiles_storage, 'hashed_files', {}).values())
+
+
+def serve_static(request, name, root, immutable_names=()):
+    try:
+        path = safe_join(root, name)
+    except SuspiciousFileOperation:
+        return None
+    if not os.path.isfile(path):
+        return None
+
+    accepted = get_accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    variants = [(encoding, path + suffix) for encoding, suffix in ENCODINGS if os.path.isfile(path + suffix)]
+    encoding, file_path = next(((encoding, variant) for encoding, variant in variants if encoding in accepted), (None, path))
+
+    stat = os.stat(file_path)
+    headers = {
+        'ETag': get_stat_etag(stat),
+        'Cache-Control': IMMUTABLE_CACHE_CONTROL if name in immutable_names else f"public, max-age={getattr(settings, 'STATIC_MAX_AGE', 60)}",
+    }
+    if variants:
+        headers['Vary'] = 'Accept-Encoding'
+
+    response = get_conditional_response(request, etag=headers['ETag'], last_modified=int(stat.st_mtime))
+    if response is None:
+        content_type, _ = mimetypes.guess_type(name)
+        response = FileResponse(open(file_path, 'rb'), content_type=content_type or 'application/octet-stream')
+        response['Last-Modified'] = http_date(stat.st_mtime)
+        if encoding:
+            response['Content-Encoding'] = encoding
+
+    for header, value in headers.items():
+        response[header] = value
+    return response
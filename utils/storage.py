@@ -0,0 +1,45 @@
+import hashlib
+import os
+import posixpath
+import re
+
+from django.core.files.storage import FileSystemStorage
+
+
+CONTENT_NAME_RE = re.compile(r'(^|/)[0-9a-f]{2}/[0-9a-f]{62}(\.\w+)?$')
+
+
+def is_content_addressed(name):
+    return bool(CONTENT_NAME_RE.search(name))
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    # Files are named by the SHA-256 of their bytes under the directory the
+    # upload_to path asks for: identical uploads share one file, and a name
+    # never gets different content, so it can be cached forever. Nothing is
+    # deleted here, see accounts.images for the reference counted sweep.
+
+    def get_content_name(self, name, content):
+        digest = hashlib.sha256()
+        content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+
+        directory, filename = posixpath.split(name)
+        digest = digest.hexdigest()
+        extension = os.path.splitext(filename)[1].lower()
+        return posixpath.join(directory, digest[:2], digest[2:] + extension)
+
+    def _save(self, name, content):
+        name = self.get_content_name(name, content)
+
+        if self.exists(name):
+            # Refresh the mtime so a sweep that saw it unreferenced leaves it
+            os.utime(self.path(name))
+            return name
+        return super()._save(name, content)
+
+
+def get_profile_image_storage():
+    return ContentAddressedStorage()
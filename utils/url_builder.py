@@ -0,0 +1,92 @@
+import threading
+from importlib import import_module
+from urllib.parse import quote
+
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.urls import get_script_prefix, get_urlconf, reverse
+from django.urls.converters import StringConverter
+from django.utils.http import RFC3986_SUBDELIMS, escape_leading_slashes
+
+
+URL_SAFE = RFC3986_SUBDELIMS + '/~:@'
+
+
+def is_plain_segment(value):
+    # Values reverse() would put in the URL unchanged: no quoting, no '/'
+    # (which the str converter rejects) and no dot segments.
+    return bool(value) and value not in ('.', '..') and '/' not in value and quote(value, safe=URL_SAFE) == value
+
+
+class UrlBuilder:
+    # Precompiled %-templates for the named routes of one URL namespace. Each
+    # template is captured once from reverse() with placeholder arguments, so
+    # build() only has to quote the script prefix (memoized) and format.
+
+    def __init__(self, namespace, urlconf_module):
+        self.namespace = namespace
+        self.urlconf_module = urlconf_module
+        self.templates = None
+        self.prefixes = {}
+        self.lock = threading.Lock()
+
+    def compile(self):
+        templates = {}
+        prefix = get_script_prefix()
+
+        for pattern in import_module(self.urlconf_module).urlpatterns:
+            converters = getattr(pattern.pattern, 'converters', {})
+            if not pattern.name or any(type(converter) is not StringConverter for converter in converters.values()):
+                continue
+
+            name = f'{self.namespace}:{pattern.name}'
+            placeholders = [f'urlbuilderarg{index}x' for index in range(len(converters))]
+            url = reverse(name, args=placeholders)[len(quote(prefix, safe=URL_SAFE)):]
+
+            template = url.replace('%', '%%')
+            for placeholder in placeholders:
+                template = template.replace(placeholder, '%s', 1)
+            templates[name] = (template, len(placeholders))
+        return templates
+
+    def get_templates(self):
+        if self.templates is None:
+            with self.lock:
+                if self.templates is None:
+                    self.templates = self.compile()
+        return self.templates
+
+    def get_prefix(self):
+        prefix = get_script_prefix()
+        quoted = self.prefixes.get(prefix)
+
+        if quoted is None:
+            quoted = self.prefixes[prefix] = quote(prefix, safe=URL_SAFE)
+        return quoted
+
+    def build(self, name, *args):
+        compiled = self.get_templates().get(name) if get_urlconf() is None else None
+
+        if compiled is None or len(args) != compiled[1] or not all(is_plain_segment(str(arg)) for arg in args):
+            return reverse(name, args=args)
+        return escape_leading_slashes(self.get_prefix() + compiled[0] % args)
+
+    def clear(self):
+        self.templates = None
+        self.prefixes = {}
+
+
+builders = []
+
+
+def get_url_builder(namespace, urlconf_module):
+    builder = UrlBuilder(namespace, urlconf_module)
+    builders.append(builder)
+    return builder
+
+
+@receiver(setting_changed)
+def clear_url_builders(setting, **kwargs):
+    if setting == 'ROOT_URLCONF':
+        for builder in builders:
+            builder.clear()